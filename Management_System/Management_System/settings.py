@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,14 +46,17 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'libraryweb.middleware.PerformanceMiddleware',#opt-in timings, see LIBRARY_PERF_INSTRUMENTATION
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'libraryweb.middleware.LibraryUserMiddleware',#resolves request.library_user from the url's lib_num
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'libraryweb.middleware.InactivityLogoutMiddleware',#automatically clears session , makes user inactive and logs out
+    'libraryweb.middleware.PerformanceViewMiddleware',#marks where the view starts for PerformanceMiddleware
 ]
 
 
@@ -60,7 +64,8 @@ ROOT_URLCONF = 'Management_System.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates, timing renders for LIBRARY_PERF_INSTRUMENTATION
+        'BACKEND': 'libraryweb.template_backends.TimedDjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -76,15 +81,47 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'Management_System.wsgi.application'
+ASGI_APPLICATION = 'Management_System.asgi.application'
 
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# SQLite settings per deployment profile, picked by the LIBRARY_DATABASE_PROFILE
+# environment variable. 'production' is tuned for concurrent requests:
+# - WAL lets readers carry on while a borrow or return is being written
+# - synchronous=NORMAL only syncs at WAL checkpoints, which is still safe in WAL mode
+# - busy_timeout waits up to 5s for a lock instead of failing with "database is locked"
+# - IMMEDIATE transactions take the write lock up front; a deferred transaction
+#   that later writes can't wait for it and fails straight away
+# - mmap_size and cache_size (in KiB when negative) keep hot pages in memory
+# - connections are kept for CONN_MAX_AGE seconds instead of one per request,
+#   and checked before reuse, so serve it with a WSGI server (see asgi.py)
+LIBRARY_SQLITE_PROFILES = {
+    'development': {},
+    'production': {
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA busy_timeout=5000;'
+                'PRAGMA mmap_size=268435456;'
+                'PRAGMA cache_size=-65536;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
+        },
+    },
+}
+LIBRARY_DATABASE_PROFILE = os.environ.get('LIBRARY_DATABASE_PROFILE', 'development')
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        **LIBRARY_SQLITE_PROFILES[LIBRARY_DATABASE_PROFILE],
     }
 }
 
@@ -136,6 +173,89 @@ STATICFILES_DIRS = [
 
 STATIC_URL = 'static/'
 
+# collectstatic writes fingerprinted copies (css/base.<hash>.css) that
+# libraryweb.files.serve_file marks immutable for a year
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'libraryweb.files.HashedStaticFilesStorage'},
+}
+
+# Browser cache lifetime in seconds for media and un-fingerprinted static
+# files; they are revalidated with ETag / If-Modified-Since afterwards
+LIBRARY_FILE_MAX_AGE = 3600
+
+# Search ranking: BM25 relevance plus these weights times the book's
+# average rating and borrowed count (only used when SQLite has FTS5)
+LIBRARY_SEARCH_RATING_WEIGHT = 0.5
+LIBRARY_SEARCH_BORROW_WEIGHT = 0.1
+
+# Number of books on the home page leaderboard. Ratings, loans and stock
+# changes that can alter it refresh it after their transaction commits
+LIBRARY_LEADERBOARD_SIZE = 10
+
+# Per-process LRU of path -> title-cased redirect target (or None) kept by
+# CaseInsensitiveMiddleware, read when the middleware is built
+LIBRARY_CANONICAL_PATH_CACHE_SIZE = 2048
+
+# Per-process cache of LibraryUser lookups behind request.library_user.
+# Saves in this process invalidate entries, the TTL (seconds) bounds how
+# long another worker's changes can take to show up.
+LIBRARY_MEMBER_CACHE_SIZE = 1024
+LIBRARY_MEMBER_CACHE_TTL = 30
+
+# Session activity is persisted at most once per this many seconds (0 writes
+# it on every request), and inactivity timeouts are written in batches at
+# most LIBRARY_PRESENCE_FLUSH_INTERVAL seconds after the first of them
+LIBRARY_ACTIVITY_GRANULARITY = 30
+LIBRARY_PRESENCE_FLUSH_INTERVAL = 10
+
+# Rendered book cards are cached in 'template_fragments' under the book's
+# version stamp, so entries never go stale and need no timeout. Per-process
+# memory is enough; point both aliases at memcached or redis to share them
+# between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'template_fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'template-fragments',
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
+}
+
+# Search and history pages are paged by cursor; the first page counts the
+# matches up to this many and shows "1000+" beyond it
+LIBRARY_PAGINATION_COUNT_LIMIT = 1000
+
+# Reviews shown on a book's page, and fetched per "load more" click
+LIBRARY_REVIEWS_PER_PAGE = 10
+
+# "Because you borrowed" recommendations: neighbours kept per book by the
+# refresh_recommendations job, and the score bonus for a shared genre
+LIBRARY_RECOMMENDATION_NEIGHBOURS = 20
+LIBRARY_RECOMMENDATION_GENRE_WEIGHT = 0.2
+
+# Per-request instrumentation (off by default): a Server-Timing header with
+# SQL, template, view and middleware time, and a JSON line per request on the
+# libraryweb.performance logger. Requests taking LIBRARY_PERF_SLOW_MS or more
+# are logged as warnings with their LIBRARY_PERF_EXPLAIN_QUERIES slowest
+# statements and EXPLAIN output.
+LIBRARY_PERF_INSTRUMENTATION = False
+LIBRARY_PERF_SLOW_MS = 500
+LIBRARY_PERF_EXPLAIN_QUERIES = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'libraryweb.performance': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
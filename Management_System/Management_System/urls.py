@@ -14,11 +14,13 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path,include
+from django.urls import path,include,re_path
 from django.shortcuts import redirect
 from django.conf import settings
-from django.conf.urls.static import static
+from libraryweb.files import serve_file
 
 
 handler404 = 'libraryweb.views.error_404'
@@ -30,5 +32,8 @@ urlpatterns = [
     path('Library/', include('libraryweb.urls', namespace='libraryweb')), # Include app URLs under 'Library' 
 ] 
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) 
\ No newline at end of file
+urlpatterns += [
+    # Served in production too: sendfile, conditional requests and byte ranges
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), serve_file, {'document_root': settings.MEDIA_ROOT}),
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.STATIC_URL.lstrip('/')), serve_file, {'document_root': settings.STATIC_ROOT, 'use_finders': settings.DEBUG}),
+]
@@ -1,4 +1,9 @@
-from django.contrib import admin
+from datetime import timedelta
+
+from django.contrib import admin, messages
+from django.core.exceptions import ValidationError
+from django.db.models import F, Min
+from django.http import HttpResponseRedirect
 from .models import (
     LibraryUser,
     BookMain,
@@ -9,10 +14,25 @@ from .models import (
     Rating,
     UserHistory
 )
+from .circulation import checkout, return_book, return_books
+from .pagination import EstimatedCountPaginator
+
 
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist defaults for tables that grow without bound: estimated
+    counts, no second COUNT(*) for the "show all" link, and raw id inputs
+    instead of <select>s listing every member or book on the change form.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 100
 
-class LibraryUserAdmin(admin.ModelAdmin):
+
+class LibraryUserAdmin(LargeTableAdmin):
     list_display = ('user', 'lib_num', 'is_active', 'fav_genre')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
     search_fields = ('user__username', 'lib_num')
     list_filter = ('is_active',)
     ordering = ('user',)
@@ -28,51 +48,111 @@ class LibraryUserAdmin(admin.ModelAdmin):
 admin.site.register(LibraryUser, LibraryUserAdmin)
 
 
-class BookMainAdmin(admin.ModelAdmin):
-    list_display = ('isbn', 'title', 'author', 'genre', 'cover_image', 'average_rating')
+class BookMainAdmin(LargeTableAdmin):
+    list_display = ('isbn', 'title', 'author', 'genre', 'cover_image', 'average_rating', 'available_copies')
+    list_select_related = ('availability',)
     search_fields = ('isbn', 'title', 'author')
     list_filter = ('genre',)
     ordering = ('title',)
+    readonly_fields = ('rating_sum', 'rating_count', 'avg_rating', 'version', 'cover_derivatives')
 
+    @admin.display(description='Average Rating', ordering='avg_rating')
     def average_rating(self, obj):
-        return obj.average_rating
-    average_rating.short_description = 'Average Rating'
+        return obj.avg_rating
+
+    @admin.display(description='Available', ordering='availability__available_books')
+    def available_copies(self, obj):
+        # Joined by list_select_related; books without stock show as blank
+        availability = getattr(obj, 'availability', None)
+        return availability.available_books if availability else None
 
 
 admin.site.register(BookMain, BookMainAdmin)
 
 
-class AvailBooksAdmin(admin.ModelAdmin):
+class AvailBooksAdmin(LargeTableAdmin):
     list_display = ('book', 'total_books', 'available_books', 'books_borrowed', 'earliest_return')
+    list_select_related = ('book',)
     search_fields = ('book__title',)
     list_filter = ('book__genre',)
+    raw_id_fields = ('book',)
 
-    def books_borrowed(self, obj):
-        return obj.remaining_books
+    def get_queryset(self, request):
+        # Both computed columns come from the changelist query itself
+        return super().get_queryset(request).annotate(
+            borrowed=F('total_books') - F('available_books'),
+            earliest_borrow=Min('borrowed_instances__borrow_date'),
+        )
 
-    books_borrowed.short_description = 'Books Borrowed'
+    @admin.display(description='Books Borrowed', ordering='borrowed')
+    def books_borrowed(self, obj):
+        return obj.borrowed
 
+    @admin.display(description='Earliest Return', ordering='earliest_borrow')
     def earliest_return(self, obj):
-        return obj.earliest_return()
-
-    earliest_return.short_description = 'Earliest Return'
+        # Same as AvailBooks.earliest_return(), without a query per row
+        if obj.earliest_borrow is None:
+            return None
+        return obj.earliest_borrow + timedelta(days=LateFees.LOAN_DAYS)
 
 
 admin.site.register(AvailBooks, AvailBooksAdmin)
 
 
-class UserBorrowedAdmin(admin.ModelAdmin):
+class UserBorrowedAdmin(LargeTableAdmin):
     list_display = ('user', 'book', 'borrow_date','return_date')
+    list_select_related = ('user__user', 'book__book')
+    raw_id_fields = ('user', 'book')
     search_fields = ('user__lib_num', 'book__book__title')
     list_filter = ('borrow_date',)
     ordering = ('-borrow_date',)
 
+    def save_model(self, request, obj, form, change):
+        # New loans go through the circulation service for the atomic copy count
+        if change:
+            super().save_model(request, obj, form, change)
+            return
+        try:
+            loan = checkout(obj.user, obj.book)
+        except ValidationError as e:
+            # UserBorrowed.clean() passed when the form was validated, but
+            # another checkout took the last copy or loan slot since then:
+            # nothing was saved, say so on the add form
+            self.message_user(request, ' '.join(e.messages), messages.ERROR)
+            return
+        obj.pk, obj.borrow_date = loan.pk, loan.borrow_date
+        obj._state.adding = False
+
+    def log_addition(self, request, obj, message):
+        if obj.pk is not None:
+            return super().log_addition(request, obj, message)
+
+    def response_add(self, request, obj, post_url_continue=None):
+        if obj.pk is None:
+            return HttpResponseRedirect(request.get_full_path())
+        return super().response_add(request, obj, post_url_continue)
+
+    def delete_model(self, request, obj):
+        return_book(obj)
+
+    def delete_queryset(self, request, queryset):
+        return_books(queryset)
+
+    @admin.action(description='Return selected books')
+    def return_selected(self, request, queryset):
+        returned = return_books(queryset)
+        self.message_user(request, f"Returned {returned} books.")
+
+    actions = ['return_selected']
+
 
 admin.site.register(UserBorrowed, UserBorrowedAdmin)
 
 
-class UserHistoryAdmin(admin.ModelAdmin):
+class UserHistoryAdmin(LargeTableAdmin):
     list_display = ('user', 'book', 'borrow_date', 'return_date', 'on_time')
+    list_select_related = ('user__user', 'book')
+    raw_id_fields = ('user', 'book')
     search_fields = ('user__lib_num', 'book__title')
     list_filter = ('on_time', 'return_date')
     ordering = ('-return_date',)
@@ -81,8 +161,10 @@ class UserHistoryAdmin(admin.ModelAdmin):
 admin.site.register(UserHistory, UserHistoryAdmin)
 
 
-class LateFeesAdmin(admin.ModelAdmin):
+class LateFeesAdmin(LargeTableAdmin):
     list_display = ('user_borrowed', 'days_late', 'fee')
+    list_select_related = ('user_borrowed__user', 'user_borrowed__book__book')
+    raw_id_fields = ('user_borrowed',)
     search_fields = ('user_borrowed__user__lib_num',)
     list_filter = ('days_late',)
 
@@ -90,8 +172,10 @@ class LateFeesAdmin(admin.ModelAdmin):
 admin.site.register(LateFees, LateFeesAdmin)
 
 
-class RequestAdmin(admin.ModelAdmin):
+class RequestAdmin(LargeTableAdmin):
     list_display = ('user', 'isbn', 'title', 'author', 'request_date')
+    list_select_related = ('user__user',)
+    raw_id_fields = ('user',)
     search_fields = ('isbn', 'title', 'user__lib_num')
     list_filter = ('request_date',)
 
@@ -99,8 +183,10 @@ class RequestAdmin(admin.ModelAdmin):
 admin.site.register(Request, RequestAdmin)
 
 
-class RatingAdmin(admin.ModelAdmin):
+class RatingAdmin(LargeTableAdmin):
     list_display = ('user', 'book', 'rating', 'review', 'created_at')
+    list_select_related = ('user__user', 'book')
+    raw_id_fields = ('user', 'book')
     search_fields = ('user__lib_num', 'book__title')
     list_filter = ('rating', 'created_at')
 
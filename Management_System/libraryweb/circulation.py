@@ -0,0 +1,139 @@
+from collections import Counter
+from datetime import timedelta
+from time import sleep
+
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connections, transaction
+from django.db.models import F, QuerySet
+from django.utils.timezone import now
+
+from .leaderboard import note_books_changed
+from .models import AvailBooks, BookMain, LateFees, LibraryUser, UserBorrowed, UserHistory
+
+# SQLite reports lock contention between writers as an OperationalError
+LOCK_RETRIES = 5
+LOCK_BACKOFF = 0.05
+
+
+def _retry_when_locked(operation):
+    for attempt in range(LOCK_RETRIES):
+        try:
+            return operation()
+        except OperationalError as e:
+            if 'locked' not in str(e) or attempt == LOCK_RETRIES - 1:
+                raise
+            sleep(LOCK_BACKOFF * (attempt + 1))
+
+
+def checkout(library_user, avail):
+    """
+    Lend one copy of `avail` (an AvailBooks row) to `library_user`.
+
+    The copy is taken with a conditional UPDATE and the loan, its LateFees
+    row and the member limit check all happen in the same transaction, so
+    a failed check leaves no trace. Raises ValidationError when no copy is
+    left or the member already holds UserBorrowed.MAX_LOANS books.
+    """
+    def lend():
+        with transaction.atomic():
+            loan = UserBorrowed(user=library_user, book=avail)
+            loan.save()  # Takes the copy; post_save creates the LateFees row
+
+            # Count after inserting, behind a lock on the member row, so two
+            # simultaneous checkouts by one member can't both pass the limit
+            LibraryUser.objects.select_for_update().filter(pk=library_user.pk).exists()
+            if UserBorrowed.objects.filter(user=library_user).count() > UserBorrowed.MAX_LOANS:
+                raise ValidationError(
+                    f"A user can only borrow a maximum of {UserBorrowed.MAX_LOANS} books at a time."
+                )
+        return loan
+
+    return _retry_when_locked(lend)
+
+
+def return_book(loan):
+    """
+    Return a loan: the copy is put back, the UserHistory row is written and
+    the loan with its LateFees row is removed, all in one transaction.
+    Raises UserBorrowed.DoesNotExist if the loan was already returned.
+    """
+    def give_back():
+        with transaction.atomic():
+            # Claim the loan with a no-op UPDATE first. It locks the row (the
+            # whole database on SQLite) and tells us whether it still exists,
+            # so a loan returned twice concurrently is only counted once.
+            claimed = UserBorrowed.objects.filter(pk=loan.pk).update(borrow_date=F('borrow_date'))
+            if not claimed:
+                raise UserBorrowed.DoesNotExist("This loan has already been returned.")
+            loan.delete()  # pre_delete puts the copy back, post_delete writes history
+
+    _retry_when_locked(give_back)
+
+
+def return_books(loans):
+    """
+    Return many loans at once with the same effect as deleting them one by
+    one through the signals, but in a fixed number of queries: one grouped
+    UPDATE per title, one bulk_create for the history and two DELETEs,
+    plus the claim, the read of the claimed loans and one version bump.
+    Loans that were already returned are skipped. Returns the number returned.
+    """
+    if isinstance(loans, QuerySet):
+        loan_ids = list(loans.values_list('pk', flat=True))
+    else:
+        loan_ids = [loan.pk for loan in loans]
+    if not loan_ids:
+        return 0
+
+    def give_back():
+        with transaction.atomic():
+            # Claim first (see return_book), then read what is still on loan
+            UserBorrowed.objects.filter(pk__in=loan_ids).update(borrow_date=F('borrow_date'))
+            rows = list(
+                UserBorrowed.objects.filter(pk__in=loan_ids)
+                .values_list('pk', 'user_id', 'book_id', 'book__book_id', 'borrow_date')
+            )
+            if not rows:
+                return 0
+
+            copies = Counter(avail_id for _, _, avail_id, _, _ in rows)
+            for avail_id, returned in copies.items():
+                AvailBooks.objects.filter(pk=avail_id).update(available_books=F('available_books') + returned)
+
+            returned_at = now()
+            due = timedelta(days=LateFees.LOAN_DAYS)
+            UserHistory.objects.bulk_create([
+                UserHistory(
+                    user_id=user_id,
+                    book_id=book_id,
+                    borrow_date=borrow_date,
+                    return_date=returned_at,
+                    on_time=returned_at <= borrow_date + due,
+                )
+                for _, user_id, _, book_id, borrow_date in rows
+            ])
+
+            returned_ids = [pk for pk, _, _, _, _ in rows]
+            LateFees.objects.filter(user_borrowed_id__in=returned_ids).delete()
+            # A plain DELETE, because QuerySet.delete() would load every loan to
+            # send the pre_delete (handle_bulk_delete) and post_delete
+            # (create_user_history_on_delete) signals, whose work is done above
+            delete_loans(returned_ids)
+            book_ids = {book_id for _, _, _, book_id, _ in rows}
+            BookMain.bump_versions(book_ids)
+            note_books_changed(book_ids)
+        return len(rows)
+
+    return _retry_when_locked(give_back)
+
+
+def delete_loans(loan_ids):
+    connection = connections[UserBorrowed._base_manager.db]
+    quote = connection.ops.quote_name
+    placeholders = ', '.join(['%s'] * len(loan_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {quote(UserBorrowed._meta.db_table)} "
+            f"WHERE {quote(UserBorrowed._meta.pk.column)} IN ({placeholders})",
+            loan_ids,
+        )
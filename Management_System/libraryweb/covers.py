@@ -0,0 +1,95 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+# Widths in pixels of the derivatives made from each original cover
+SIZES = {
+    'thumb': 120,
+    'card': 240,
+    'detail': 480,
+}
+# WebP for browsers that take it, JPEG as the <img> fallback
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+DERIVED_DIR = 'book_covers/derived'
+
+
+def derivative_name(original, size, ext):
+    stem = os.path.splitext(os.path.basename(original))[0]
+    return f"{DERIVED_DIR}/{stem}-{size}.{ext}"
+
+
+def derivatives_exist(original):
+    return all(
+        default_storage.exists(derivative_name(original, size, ext))
+        for size in SIZES for ext in FORMATS
+    )
+
+
+def generate_derivatives(original, force=False):
+    """
+    Write every size/format derivative of a cover next to the originals.
+    Existing files are kept unless force=True. Returns the number written,
+    or None if the original can't be read as an image.
+    """
+    from PIL import Image
+
+    if not force and derivatives_exist(original):
+        return 0
+    try:
+        with default_storage.open(original, 'rb') as f:
+            image = Image.open(f)
+            image.load()
+    except (OSError, ValueError):
+        return None
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    written = 0
+    for size, width in SIZES.items():
+        resized = image.copy()
+        # thumbnail() keeps the aspect ratio and never upscales
+        resized.thumbnail((width, width * 2), Image.LANCZOS)
+        for ext, (pillow_format, params) in FORMATS.items():
+            name = derivative_name(original, size, ext)
+            buffer = BytesIO()
+            resized.save(buffer, pillow_format, **params)
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            default_storage.save(name, ContentFile(buffer.getvalue()))
+            written += 1
+    return written
+
+
+def delete_derivatives(original):
+    for size in SIZES:
+        for ext in FORMATS:
+            default_storage.delete(derivative_name(original, size, ext))
+
+
+def cover_sources(original, resized):
+    """
+    URLs for a cover's <picture>: a srcset per format and the JPEG used as
+    the plain src. Falls back to the original until its derivatives have
+    been written (BookMain.cover_derivatives): rendering never touches
+    the disk or Pillow.
+    """
+    if not resized:
+        url = default_storage.url(original)
+        return {'webp_srcset': '', 'jpg_srcset': '', 'src': url}
+    srcsets = {
+        ext: ', '.join(
+            f"{default_storage.url(derivative_name(original, size, ext))} {width}w"
+            for size, width in SIZES.items()
+        )
+        for ext in FORMATS
+    }
+    return {
+        'webp_srcset': srcsets['webp'],
+        'jpg_srcset': srcsets['jpg'],
+        'src': default_storage.url(derivative_name(original, 'card', 'jpg')),
+    }
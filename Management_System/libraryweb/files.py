@@ -0,0 +1,175 @@
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+# Names ManifestStaticFilesStorage writes, e.g. css/base.3f2a1b9c4d5e.css
+FINGERPRINTED_RE = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+class HashedStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    collectstatic writes fingerprinted copies so they can be cached for a
+    year. Files missing from the manifest (not collected yet, or in tests)
+    keep their plain name and are revalidated instead of failing the page.
+    """
+    manifest_strict = True
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+
+class FileRange:
+    """
+    The part of an open file that a Range request asked for. Keeps fileno()
+    so wsgi.file_wrapper can still sendfile() it: the file is positioned at
+    the start of the range and Content-Length bounds the copy.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def parse_range(header, size):
+    """
+    Return (start, length) for a single "bytes=" range, None to ignore the
+    header, or False when the range can't be satisfied. Multiple ranges are
+    ignored and the whole file is sent, which RFC 9110 allows.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        # Suffix range: the last N bytes
+        length = min(int(last), size)
+        return (size - length, length) if length else False
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end - start + 1
+
+
+def if_range_matches(request, etag, mtime):
+    """
+    A Range only applies if If-Range, when sent, still names this version
+    of the file; otherwise the full file is sent.
+    """
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == int(mtime)
+
+
+def file_max_age(path):
+    if FINGERPRINTED_RE.search(path):
+        return IMMUTABLE_MAX_AGE
+    return getattr(settings, 'LIBRARY_FILE_MAX_AGE', 3600)
+
+
+@require_safe
+def serve_file(request, path, document_root=None, use_finders=False):
+    """
+    Serve a file below document_root with a FileResponse, so WSGI servers
+    that provide wsgi.file_wrapper (gunicorn, uWSGI) send it with sendfile().
+    Answers conditional requests with 304, honours single byte ranges and
+    lets fingerprinted names be cached forever.
+    """
+    fullpath = None
+    if use_finders:
+        # DEBUG: pick up edits in the app's static folder without collectstatic
+        fullpath = finders.find(path)
+    if not fullpath:
+        # Raises SuspiciousFileOperation (a 400) for paths escaping the root
+        fullpath = safe_join(document_root, path)
+    try:
+        file = open(fullpath, 'rb')
+    except OSError:
+        raise Http404("File not found")
+    try:
+        stats = os.fstat(file.fileno())
+        if not stat.S_ISREG(stats.st_mode):
+            raise Http404("File not found")
+
+        etag = f'"{stats.st_mtime_ns:x}-{stats.st_size:x}"'
+        max_age = file_max_age(path)
+        cache_control = f"public, max-age={max_age}"
+        if max_age == IMMUTABLE_MAX_AGE:
+            cache_control += ", immutable"
+        headers = {
+            'ETag': etag,
+            'Last-Modified': http_date(stats.st_mtime),
+            'Cache-Control': cache_control,
+            'Accept-Ranges': 'bytes',
+        }
+
+        # Hands back the response it was given unless the request's
+        # preconditions produce a 304 (or 412) carrying these headers
+        conditional = get_conditional_response(
+            request, etag=etag, last_modified=int(stats.st_mtime), response=HttpResponse(headers=headers),
+        )
+        if conditional.status_code in (304, 412):
+            file.close()
+            return conditional
+
+        content_type, encoding = mimetypes.guess_type(fullpath)
+        content_type = content_type or 'application/octet-stream'
+
+        byte_range = None
+        if 'HTTP_RANGE' in request.META and if_range_matches(request, etag, stats.st_mtime):
+            byte_range = parse_range(request.META['HTTP_RANGE'], stats.st_size)
+        if byte_range is False:
+            file.close()
+            response = HttpResponse(status=416, headers=headers)
+            response['Content-Range'] = f"bytes */{stats.st_size}"
+            return response
+
+        if byte_range is None:
+            response = FileResponse(file, content_type=content_type, headers=headers)
+        else:
+            start, length = byte_range
+            response = FileResponse(FileRange(file, start, length), status=206, content_type=content_type, headers=headers)
+            response['Content-Length'] = str(length)
+            response['Content-Range'] = f"bytes {start}-{start + length - 1}/{stats.st_size}"
+    except BaseException:
+        file.close()
+        raise
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta, timezone
+
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils.timezone import now
+
+from .models import LateFees, UserBorrowed
+
+LATE_FEES_TABLE = LateFees._meta.db_table
+BORROWED_TABLE = UserBorrowed._meta.db_table
+
+# Whole days past the due date, floored at zero, from the current time in
+# microseconds since the epoch and the loan days. Same result as
+# LateFees.calculate_fees(): the span is counted in whole microseconds, from
+# the UTC text Django stores (the fraction right-padded, it may be missing or
+# shorter), and integer division floors it like timedelta.days. julianday()
+# is a float and rounded a span just short of a whole day up to it.
+BORROWED_MICROSECONDS = (
+    "(CAST(strftime('%%s', ub.borrow_date) AS INTEGER) * 1000000"
+    " + CAST(substr(substr(ub.borrow_date, 21) || '000000', 1, 6) AS INTEGER))"
+)
+DAYS_LATE_SQL = f"MAX(0, (%s - {BORROWED_MICROSECONDS}) / 86400000000 - %s)"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def bulk_supported():
+    return connection.vendor == 'sqlite'
+
+
+def recompute_late_fees(chunk_size=5000, dry_run=False, current_time=None):
+    """
+    Bring days_late and fee up to date with a few set-based UPDATEs per chunk
+    of chunk_size LateFees rows (in id order), writing only rows whose
+    overdue day count changed.
+    Each chunk commits on its own so the database is never locked for long.
+
+    Returns a dict of counters for --stats output.
+    """
+    current_time = current_time or now()
+    now_param = (current_time - EPOCH) // timedelta(microseconds=1)
+    days_late = DAYS_LATE_SQL
+    days_params = [now_param, LateFees.LOAN_DAYS]
+
+    stats = {'scanned': LateFees.objects.count(), 'days_changed': 0, 'fees_changed': 0, 'chunks': 0}
+
+    # The last id of the next chunk_size rows: keyset chunks hold exactly
+    # chunk_size rows (bar the last) however sparse the ids are
+    chunk_end = (
+        f"SELECT MAX(id) FROM (SELECT id FROM {LATE_FEES_TABLE} "
+        f"WHERE id > %s ORDER BY id LIMIT %s)"
+    )
+    stale_ids = (
+        f"SELECT lf.id FROM {LATE_FEES_TABLE} lf "
+        f"JOIN {BORROWED_TABLE} ub ON ub.id = lf.user_borrowed_id "
+        f"WHERE lf.id > %s AND lf.id <= %s AND lf.days_late != {days_late}"
+    )
+
+    low = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(chunk_end, [low, chunk_size])
+            high = cursor.fetchone()[0]
+            if high is None:
+                break
+            if dry_run:
+                cursor.execute(f"SELECT count(*) FROM ({stale_ids})", [low, high] + days_params)
+                stats['days_changed'] += cursor.fetchone()[0]
+                cursor.execute(
+                    f"SELECT count(*) FROM {LATE_FEES_TABLE} lf "
+                    f"JOIN {BORROWED_TABLE} ub ON ub.id = lf.user_borrowed_id "
+                    f"WHERE lf.id > %s AND lf.id <= %s AND lf.fee != {days_late} * %s",
+                    [low, high] + days_params + [LateFees.FEE_PER_DAY],
+                )
+                stats['fees_changed'] += cursor.fetchone()[0]
+            else:
+                cursor.execute(
+                    f"UPDATE {LATE_FEES_TABLE} SET days_late = ("
+                    f"SELECT {days_late} FROM {BORROWED_TABLE} ub "
+                    f"WHERE ub.id = {LATE_FEES_TABLE}.user_borrowed_id"
+                    f") WHERE id IN ({stale_ids})",
+                    days_params + [low, high] + days_params,
+                )
+                stats['days_changed'] += cursor.rowcount
+                cursor.execute(
+                    f"UPDATE {LATE_FEES_TABLE} SET fee = days_late * %s "
+                    f"WHERE id > %s AND id <= %s AND fee != days_late * %s",
+                    [LateFees.FEE_PER_DAY, low, high, LateFees.FEE_PER_DAY],
+                )
+                stats['fees_changed'] += cursor.rowcount
+        stats['chunks'] += 1
+        low = high
+
+    stats['outstanding'] = LateFees.objects.aggregate(total=Sum('fee'))['total'] or 0
+    return stats
+
+
+def recompute_late_fees_per_row():
+    """
+    The original row-by-row path, used for non-SQLite databases and as the
+    benchmark baseline. One UPDATE per loan.
+    """
+    updated_count = 0
+    with transaction.atomic():
+        for late_fee in LateFees.objects.select_related('user_borrowed'):
+            late_fee.calculate_fees()
+            updated_count += 1
+    return updated_count
@@ -0,0 +1,110 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
+from django.utils.timezone import now
+
+from .models import BookMain, PopularBook
+
+
+def leaderboard_size():
+    return getattr(settings, 'LIBRARY_LEADERBOARD_SIZE', 10)
+
+
+def borrowed_count():
+    """
+    Copies of a book out on loan, as in AvailBooks.remaining_books: total
+    minus available, which checkout and return keep in step. Shared by the
+    leaderboard and search ranking, and spares a GROUP BY over every loan.
+    """
+    return Coalesce(F('availability__total_books') - F('availability__available_books'), 0)
+
+
+def ranked_books():
+    """
+    The full popularity ordering used by the home page.
+    """
+    return (
+        BookMain.objects.annotate(borrowed_count=borrowed_count())
+        .order_by('-avg_rating', '-borrowed_count', 'title')
+    )
+
+
+def refresh_leaderboard():
+    """
+    Recompute the top books and replace the stored leaderboard.
+    Returns the number of entries written.
+    """
+    top = ranked_books().values_list('pk', 'avg_rating', 'borrowed_count')[:leaderboard_size()]
+    refreshed_at = now()
+    with transaction.atomic():
+        PopularBook.objects.all().delete()
+        entries = PopularBook.objects.bulk_create([
+            PopularBook(
+                position=position,
+                book_id=book_id,
+                avg_rating=avg_rating,
+                borrowed_count=borrowed_count,
+                refreshed_at=refreshed_at,
+            )
+            for position, (book_id, avg_rating, borrowed_count) in enumerate(top, start=1)
+        ])
+    return len(entries)
+
+
+def refresh_if_affected(book_ids):
+    """
+    Refresh the leaderboard only when a change to one of these books can
+    alter it: a book is already listed, the board has free slots, or a book
+    now ranks above the last entry.
+    """
+    book_ids = set(book_ids)
+    entries = list(
+        PopularBook.objects.order_by('position')
+        .values_list('book_id', 'avg_rating', 'borrowed_count', 'book__title')
+    )
+    if len(entries) < leaderboard_size() or any(entry[0] in book_ids for entry in entries):
+        refresh_leaderboard()
+        return True
+
+    def sort_key(row):
+        return (-row[1], -row[2], row[3])
+
+    cutoff = sort_key(entries[-1])
+    books = ranked_books().filter(pk__in=book_ids).values_list('pk', 'avg_rating', 'borrowed_count', 'title')
+    if any(sort_key(book) < cutoff for book in books):
+        refresh_leaderboard()
+        return True
+    return False
+
+
+def note_book_changed(book_id):
+    """
+    Called from signals when a book's rating or loans change. The check runs
+    after the surrounding transaction commits so it sees the final totals.
+    """
+    note_books_changed([book_id])
+
+
+def note_books_changed(book_ids):
+    book_ids = list(book_ids)
+    transaction.on_commit(lambda: refresh_if_affected(book_ids))
+
+
+def popular_books():
+    """
+    Read the leaderboard in one query. Returns BookMain objects carrying a
+    borrowed_count attribute, like the annotated queryset it replaces.
+
+    Never writes: the board is kept current by note_book_changed() and the
+    refresh_leaderboard command, so a request may see it a moment stale.
+    Until it is first built, the top books are read from ranked_books().
+    """
+    books = list(
+        BookMain.objects.filter(leaderboard_entry__isnull=False)
+        .annotate(borrowed_count=F('leaderboard_entry__borrowed_count'))
+        .order_by('leaderboard_entry__position')
+    )
+    if not books:
+        books = list(ranked_books()[:leaderboard_size()])
+    return books
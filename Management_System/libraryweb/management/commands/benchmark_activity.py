@@ -0,0 +1,72 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.utils.timezone import now
+from libraryweb.models import LibraryUser
+
+
+class WriteCounter:
+    def __init__(self):
+        self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith(('UPDATE', 'INSERT', 'DELETE')):
+            self.writes += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = 'Count database writes per page view with and without activity throttling'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument(
+            '--think-time',
+            type=float,
+            default=5,
+            help='Simulated seconds between page views.',
+        )
+
+    def handle(self, *args, **options):
+        password = 'benchmark-pass-123'
+        user = User.objects.create_user(username='activity-benchmark', password=password)
+        library_user = LibraryUser.objects.create(user=user)
+        try:
+            results = {}
+            for label, granularity in (('every request', 0), ('throttled', None)):
+                overrides = {} if granularity is None else {'LIBRARY_ACTIVITY_GRANULARITY': granularity}
+                with override_settings(**overrides):
+                    results[label] = self.run(user.username, password, library_user.lib_num, options)
+        finally:
+            user.delete()
+
+        for label, (sign_in, per_view, sign_out) in results.items():
+            self.stdout.write(
+                f"{label}: sign in {sign_in} writes, {per_view:.2f} writes per page view, sign out {sign_out} writes"
+            )
+        saved = results['every request'][1] - results['throttled'][1]
+        self.stdout.write(self.style.SUCCESS(f"Writes saved per page view: {saved:.2f}"))
+
+    def run(self, username, password, lib_num, options):
+        client = Client()
+        counter = WriteCounter()
+        clock = [now()]
+
+        with connection.execute_wrapper(counter), mock.patch('libraryweb.middleware.now', lambda: clock[0]):
+            client.post('/Library/Signin/', {'username': username, 'password': password})
+            sign_in = counter.writes
+
+            counter.writes = 0
+            for _ in range(options['requests']):
+                clock[0] += timedelta(seconds=options['think_time'])
+                client.get(f'/Library/{lib_num}/Credits/')
+            per_view = counter.writes / options['requests']
+
+            counter.writes = 0
+            client.get('/Library/Signout/')
+            sign_out = counter.writes
+        return sign_in, per_view, sign_out
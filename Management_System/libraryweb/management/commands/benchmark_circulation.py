@@ -0,0 +1,142 @@
+import copy
+import random
+import sqlite3
+import tempfile
+import threading
+from collections import Counter
+from pathlib import Path
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from libraryweb.circulation import checkout, return_book
+from libraryweb.models import AvailBooks, BookMain, LibraryUser, UserBorrowed, UserHistory
+
+
+class Command(BaseCommand):
+    help = (
+        'Stress the checkout/return service from many threads and verify the inventory counters stay exact '
+        '(on a throwaway copy of the database)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=200, help='Operations per thread.')
+        parser.add_argument('--members', type=int, default=20)
+        parser.add_argument('--books', type=int, default=5)
+        parser.add_argument('--copies', type=int, default=4, help='Copies of each book.')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        database = connections['default'].settings_dict
+        if database['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("This benchmark runs against a copy of the SQLite database.")
+        if str(database['NAME']) == ':memory:' or 'mode=memory' in str(database['NAME']):
+            raise CommandError("Run it against a database file.")
+        original = copy.deepcopy(database)
+
+        # The threads commit their own transactions, so instead of rolling
+        # back, work on a throwaway copy of the database
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'circulation.sqlite3'
+            connections.close_all()
+            source, target = sqlite3.connect(original['NAME']), sqlite3.connect(path)
+            try:
+                source.backup(target)
+            finally:
+                source.close()
+                target.close()
+            database['NAME'] = path
+            try:
+                self.run(options)
+            finally:
+                connections.close_all()
+                database.clear()
+                database.update(original)
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        members, books = self.seed(options)
+        counts = Counter()
+        errors = []
+        lock = threading.Lock()
+
+        def worker(thread_seed):
+            local_rng = random.Random(thread_seed)
+            local = Counter()
+            try:
+                for _ in range(options['operations']):
+                    member = local_rng.choice(members)
+                    loans = list(UserBorrowed.objects.filter(user=member))
+                    try:
+                        if loans and local_rng.random() < 0.5:
+                            return_book(local_rng.choice(loans))
+                            local['returns'] += 1
+                        else:
+                            checkout(member, local_rng.choice(books))
+                            local['checkouts'] += 1
+                    except ValidationError:
+                        local['rejected'] += 1
+                    except UserBorrowed.DoesNotExist:
+                        local['lost_race'] += 1  # Another thread returned this loan first
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+                with lock:
+                    counts.update(local)
+
+        threads = [threading.Thread(target=worker, args=(rng.random(),)) for _ in range(options['threads'])]
+        started = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - started
+
+        problems = self.verify(members, books, counts)
+
+        total_ops = sum(counts.values())
+        self.stdout.write(
+            f"{options['threads']} threads, {total_ops} operations in {elapsed:.2f}s "
+            f"({total_ops / elapsed:.0f} ops/s): {dict(counts)}"
+        )
+        if errors:
+            raise CommandError(f"{len(errors)} threads failed, first error: {errors[0]!r}")
+        if problems:
+            raise CommandError("Counters drifted:\n" + "\n".join(problems))
+        self.stdout.write(self.style.SUCCESS("Inventory counters, loan limits and history are exact."))
+
+    def seed(self, options):
+        members = []
+        for n in range(options['members']):
+            user = User.objects.create(username=f'circulation-benchmark-{n}')
+            members.append(LibraryUser.objects.create(user=user, is_active=True))
+        books = []
+        for n in range(options['books']):
+            book = BookMain.objects.create(
+                isbn=f'99{n:011d}', title=f'Circulation Benchmark {n}', author='Benchmark', genre='Benchmark',
+            )
+            books.append(AvailBooks.objects.create(
+                book=book, total_books=options['copies'], available_books=options['copies'],
+            ))
+        return members, books
+
+    def verify(self, members, books, counts):
+        problems = []
+        for avail in AvailBooks.objects.filter(pk__in=[b.pk for b in books]):
+            on_loan = UserBorrowed.objects.filter(book=avail).count()
+            if avail.available_books != avail.total_books - on_loan:
+                problems.append(
+                    f"{avail.book_id}: available {avail.available_books}, expected {avail.total_books - on_loan}"
+                )
+        for member in members:
+            held = UserBorrowed.objects.filter(user=member).count()
+            if held > UserBorrowed.MAX_LOANS:
+                problems.append(f"{member.lib_num} holds {held} books")
+        history = UserHistory.objects.filter(user__in=members).count()
+        if history != counts['returns']:
+            problems.append(f"{history} history rows for {counts['returns']} returns")
+        return problems
@@ -0,0 +1,200 @@
+import copy
+import math
+import random
+import sqlite3
+import tempfile
+import threading
+from collections import Counter
+from pathlib import Path
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection, connections
+from django.db.backends.signals import connection_created
+from libraryweb.circulation import checkout, return_book
+from libraryweb.models import AvailBooks, BookMain, LibraryUser, UserBorrowed, UserHistory
+
+# Django's defaults with the rollback journal spelled out, since WAL mode is
+# stored in the database file and would survive from an earlier run
+BASELINE = {'OPTIONS': {'init_command': 'PRAGMA journal_mode=DELETE'}}
+
+
+class Command(BaseCommand):
+    help = (
+        'Mixed read/write throughput of the SQLite database with Django defaults and with the '
+        'production profile (WAL, synchronous=NORMAL, busy_timeout, mmap, cache, persistent connections)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent workers, like server threads.')
+        parser.add_argument('--seconds', type=float, default=10, help='Run time per profile.')
+        parser.add_argument('--write-ratio', type=float, default=0.2, help='Share of operations that borrow or return.')
+        parser.add_argument('--members', type=int, default=40)
+        parser.add_argument('--books', type=int, default=20)
+        parser.add_argument('--copies', type=int, default=5, help='Copies of each benchmark book.')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        database = connections['default'].settings_dict
+        if database['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError("This benchmark compares SQLite settings.")
+        if str(database['NAME']) == ':memory:' or 'mode=memory' in str(database['NAME']):
+            raise CommandError("Run it against a database file.")
+        original = copy.deepcopy(database)
+        profiles = {'default': BASELINE, 'production': settings.LIBRARY_SQLITE_PROFILES['production']}
+
+        results = {}
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                for name, profile in profiles.items():
+                    # Each profile starts from its own copy of the current data
+                    path = Path(directory) / f'{name}.sqlite3'
+                    self.copy_database(original['NAME'], path)
+                    self.use_database(database, original, path, profile)
+                    results[name] = self.run(options)
+            finally:
+                connections.close_all()
+                database.clear()
+                database.update(original)
+
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:<10} {result['ops_per_second']:8.0f} ops/s "
+                f"(reads {result['reads']}, writes {result['writes']}), "
+                f"p95 read {result['read_p95']:.1f}ms, p95 write {result['write_p95']:.1f}ms, "
+                f"'database is locked' {result['locked']}, connections opened {result['connections']}"
+            )
+        gain = results['production']['ops_per_second'] / results['default']['ops_per_second']
+        self.stdout.write(self.style.SUCCESS(f"Production profile: {gain:.2f}x the throughput of the defaults."))
+
+    @staticmethod
+    def copy_database(source, target):
+        connections.close_all()
+        source, target = sqlite3.connect(source), sqlite3.connect(target)
+        try:
+            source.backup(target)
+        finally:
+            source.close()
+            target.close()
+
+    @staticmethod
+    def use_database(database, original, path, profile):
+        """
+        Point the default alias at `path` with the profile's settings. New
+        connections, including each worker thread's, read them on connect.
+        """
+        connections.close_all()
+        database.clear()
+        database.update(copy.deepcopy(original))
+        database.update(copy.deepcopy(profile))
+        database['NAME'] = path
+
+    def seed(self, options):
+        members = []
+        for n in range(options['members']):
+            user = User.objects.create(username=f'database-benchmark-{n}')
+            members.append(LibraryUser.objects.create(user=user, is_active=True))
+        books = []
+        for n in range(options['books']):
+            book = BookMain.objects.create(
+                isbn=f'98{n:011d}', title=f'Database Benchmark {n}', author='Benchmark', genre='Benchmark',
+            )
+            books.append(AvailBooks.objects.create(
+                book=book, total_books=options['copies'], available_books=options['copies'],
+            ))
+        return members, books
+
+    def run(self, options):
+        members, books = self.seed(options)
+        genres = list(BookMain.objects.values_list('genre', flat=True).distinct()[:20])
+        rng = random.Random(options['seed'])
+        counts = Counter()
+        timings = {'read': [], 'write': []}
+        errors = []
+        lock = threading.Lock()
+        opened = Counter()
+
+        def count_connections(sender, connection, **kwargs):
+            with lock:
+                opened['connections'] += 1
+
+        connection_created.connect(count_connections)
+
+        def read(local_rng, member):
+            operation = local_rng.randrange(3)
+            if operation == 0:
+                list(BookMain.objects.filter(genre=local_rng.choice(genres)).order_by('title')[:25])
+            elif operation == 1:
+                BookMain.objects.select_related('availability').get(pk=local_rng.choice(books).book_id)
+            else:
+                list(UserHistory.objects.filter(user=member).select_related('book').order_by('-borrow_date')[:10])
+
+        def write(local_rng, member):
+            loans = list(UserBorrowed.objects.filter(user=member))
+            if loans and (len(loans) == UserBorrowed.MAX_LOANS or local_rng.random() < 0.5):
+                return_book(local_rng.choice(loans))
+            else:
+                checkout(member, local_rng.choice(books))
+
+        def worker(thread_seed, deadline):
+            local_rng = random.Random(thread_seed)
+            local = Counter()
+            local_timings = {'read': [], 'write': []}
+            try:
+                while perf_counter() < deadline:
+                    kind = 'write' if local_rng.random() < options['write_ratio'] else 'read'
+                    member = local_rng.choice(members)
+                    started = perf_counter()
+                    try:
+                        (write if kind == 'write' else read)(local_rng, member)
+                        local[f'{kind}s'] += 1
+                        local_timings[kind].append(perf_counter() - started)
+                    except (ValidationError, UserBorrowed.DoesNotExist):
+                        local['rejected'] += 1  # No copy left or a loan returned by another thread
+                    except OperationalError as e:
+                        if 'locked' not in str(e):
+                            raise
+                        local['locked'] += 1
+                    # What Django does around each request: drop the connection
+                    # unless CONN_MAX_AGE keeps it
+                    close_old_connections()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+                with lock:
+                    counts.update(local)
+                    for kind, values in local_timings.items():
+                        timings[kind] += values
+
+        connections.close_all()
+        deadline = perf_counter() + options['seconds']
+        threads = [
+            threading.Thread(target=worker, args=(rng.random(), deadline)) for _ in range(options['threads'])
+        ]
+        started = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - started
+        connection_created.disconnect(count_connections)
+        if errors:
+            raise CommandError(f"{len(errors)} workers failed, first error: {errors[0]!r}")
+
+        def p95(values):
+            values = sorted(values)
+            return values[max(0, math.ceil(0.95 * len(values)) - 1)] * 1000 if values else 0.0
+
+        return {
+            'ops_per_second': (counts['reads'] + counts['writes']) / elapsed,
+            'reads': counts['reads'],
+            'writes': counts['writes'],
+            'locked': counts['locked'],
+            'read_p95': p95(timings['read']),
+            'write_p95': p95(timings['write']),
+            'connections': opened['connections'],
+        }
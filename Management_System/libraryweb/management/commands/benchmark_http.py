@@ -0,0 +1,332 @@
+import importlib.util
+import json
+import math
+import random
+import socket
+import subprocess
+import sys
+import threading
+from http.cookiejar import CookieJar
+from time import perf_counter, sleep
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Exists, OuterRef
+from django.urls import reverse
+from django.utils.timezone import now
+from libraryweb.management.commands.seed_dataset import DEFAULT_PASSWORD, USERNAME_PREFIX
+from libraryweb.models import BookMain, LibraryUser, UserBorrowed
+
+# Route name: URL name, in the order reports list them
+ROUTES = {
+    'home': 'home',
+    'search': 'search',
+    'detail': 'detail',
+    'borrowed': 'borrow',
+    'history': 'history',
+    'latefees': 'late',
+}
+DEFAULT_MIX = 'home=30,search=25,detail=20,borrowed=10,history=10,latefees=5'
+BENCHMARK_PASSWORD = 'http-benchmark-pass'
+
+
+class NoRedirects(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class BenchmarkClient:
+    """
+    One simulated browser with its own cookie jar for the session and CSRF
+    cookies. Redirects are not followed, so a signed-out session shows up as
+    failed requests rather than fast sign-in pages.
+    """
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies), NoRedirects)
+
+    def request(self, path, data=None):
+        """
+        Fetch a page and read the whole body. Returns the status code.
+        """
+        request = Request(self.base_url + path, data=urlencode(data).encode() if data else None)
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                response.read()
+                return response.status
+        except HTTPError as e:
+            e.read()
+            return e.code
+
+    def sign_in(self, username, password):
+        signin = reverse('libraryweb:signin')
+        self.request(signin)
+        token = next((cookie.value for cookie in self.cookies if cookie.name == settings.CSRF_COOKIE_NAME), '')
+        status = self.request(signin, {'username': username, 'password': password, 'csrfmiddlewaretoken': token})
+        if status != 302:
+            raise CommandError(
+                f"Signing in {username} failed with status {status}. "
+                f"With --url, is the server using this database?"
+            )
+
+
+def percentile(ordered, percent):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def summarise(samples, elapsed):
+    """
+    Requests/sec and latency percentiles (ms) of (seconds, ok) samples.
+    Latencies only cover successful requests; failures are counted.
+    """
+    latencies = sorted(seconds * 1000 for seconds, ok in samples if ok)
+    return {
+        'requests': len(samples),
+        'errors': len(samples) - len(latencies),
+        'requests_per_second': round(len(samples) / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 2) if latencies else None,
+            'p50': round(percentile(latencies, 50), 2) if latencies else None,
+            'p95': round(percentile(latencies, 95), 2) if latencies else None,
+            'p99': round(percentile(latencies, 99), 2) if latencies else None,
+            'max': round(latencies[-1], 2) if latencies else None,
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the member pages over HTTP: sign in members, replay a weighted mix of '
+        'Home/Search/Detail/Borrowed/History/Latefees requests from concurrent clients and '
+        'report requests/sec and p50/p95/p99 latency per route as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            help='Base URL of a running server, e.g. http://127.0.0.1:8000. The server must use '
+                 'the same database as this command, which picks the members and books to request '
+                 '(and creates the throwaway members, without --seeded) locally. '
+                 'Without it a runserver is started on a free port for the run.',
+        )
+        parser.add_argument(
+            '--asgi',
+            action='store_true',
+            help='Start a single uvicorn worker serving ASGI_APPLICATION instead of runserver.',
+        )
+        parser.add_argument('--clients', type=int, default=8, help='Concurrent clients.')
+        parser.add_argument('--requests', type=int, default=2000, help='Measured requests, split over the clients.')
+        parser.add_argument('--warmup', type=int, default=100, help='Unmeasured requests sent first.')
+        parser.add_argument('--members', type=int, default=20, help='Members signed in, shared by the clients.')
+        parser.add_argument(
+            '--seeded',
+            action='store_true',
+            help='Sign in as members made by seed_dataset (preferring ones with loans) '
+                 'instead of creating empty members for the run.',
+        )
+        parser.add_argument('--password', default=DEFAULT_PASSWORD, help='Password of the seed_dataset members.')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Route weights, default {DEFAULT_MIX}.')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request fails.')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options['mix'])
+        if options['clients'] < 1 or options['members'] < 1:
+            raise CommandError("Need at least one client and one member.")
+        books = list(BookMain.objects.filter(availability__isnull=False).order_by('?').values_list('isbn', 'title')[:500])
+        if not books:
+            raise CommandError("No books to request. Run seed_dataset first.")
+        isbns = [isbn for isbn, _ in books]
+        # Search terms: an empty search (browse), and words from real titles
+        terms = [''] + sorted({
+            word for _, title in books[:50] for word in title.split() if word.isalpha() and len(word) > 3
+        })
+        rng = random.Random(options['seed'])
+
+        members, created = self.members(options)
+        server = None
+        try:
+            if not options['url']:
+                server = self.start_server(options['asgi'])
+            base_url = options['url'] or server.base_url
+            report = self.run(base_url, members, mix, isbns, terms, rng, options)
+        finally:
+            if created:
+                User.objects.filter(pk__in=[member.user_id for member, _ in members]).delete()
+            if server:
+                server.terminate()
+                server.wait()
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            overall = report['overall']
+            self.stdout.write(self.style.SUCCESS(
+                f"{overall['requests']} requests at {overall['requests_per_second']} requests/s, "
+                f"p95 {overall['latency_ms']['p95']}ms. Report written to {options['output']}."
+            ))
+        else:
+            self.stdout.write(output)
+
+    def parse_mix(self, mix):
+        weights = {}
+        for item in mix.split(','):
+            route, _, weight = item.partition('=')
+            route = route.strip().lower()
+            if route not in ROUTES or not weight.strip().isdigit():
+                raise CommandError(f"--mix expects ROUTE=WEIGHT with ROUTE in {', '.join(ROUTES)}, got {item!r}")
+            weights[route] = int(weight)
+        if not any(weights.values()):
+            raise CommandError("--mix needs a route with a weight above 0.")
+        return weights
+
+    def members(self, options):
+        """
+        Members to sign in and whether they were created for this run.
+        """
+        if options['seeded']:
+            members = list(
+                LibraryUser.objects.filter(user__username__regex=rf'^{USERNAME_PREFIX}[0-9a-f]{{8}}_')
+                .annotate(has_loans=Exists(UserBorrowed.objects.filter(user=OuterRef('pk'))))
+                .order_by('-has_loans', 'pk').select_related('user')[:options['members']]
+            )
+            if not members:
+                raise CommandError("No seed_dataset members found. Run seed_dataset first.")
+            return [(member, options['password']) for member in members], False
+
+        password = make_password(BENCHMARK_PASSWORD)
+        tag = f"{random.getrandbits(32):08x}"
+        members = []
+        for n in range(options['members']):
+            user = User.objects.create(username=f'http-benchmark-{tag}-{n}', password=password)
+            members.append(LibraryUser.objects.create(user=user, is_active=True))
+        return [(member, BENCHMARK_PASSWORD) for member in members], True
+
+    def start_server(self, asgi=False):
+        """
+        runserver (or uvicorn, for ASGI) on a free local port, without the
+        autoreloader, serving this project's settings and database.
+        """
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        if asgi:
+            if importlib.util.find_spec('uvicorn') is None:
+                raise CommandError("--asgi needs uvicorn (pip install uvicorn).")
+            module, _, attribute = settings.ASGI_APPLICATION.rpartition('.')
+            command = [sys.executable, '-m', 'uvicorn', f'{module}:{attribute}', '--port', str(port),
+                       '--log-level', 'warning']
+        else:
+            command = [sys.executable, str(settings.BASE_DIR / 'manage.py'), 'runserver', '--noreload',
+                       '--skip-checks', f'127.0.0.1:{port}']
+        process = subprocess.Popen(
+            command, cwd=settings.BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        process.base_url = f'http://127.0.0.1:{port}'
+        for _ in range(300):
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return process
+            except OSError:
+                if process.poll() is not None:
+                    break
+                sleep(0.1)
+        process.terminate()
+        raise CommandError("The local server did not start.")
+
+    def plan(self, rng, mix, count, lib_num, isbns, terms):
+        """
+        `count` request paths for one client, drawn from the weighted mix.
+        """
+        routes = rng.choices(list(mix), weights=list(mix.values()), k=count)
+        paths = []
+        for route in routes:
+            kwargs = {'lib_num': lib_num}
+            if route == 'detail':
+                kwargs['isbn'] = rng.choice(isbns)
+            path = reverse(f'libraryweb:{ROUTES[route]}', kwargs=kwargs)
+            if route == 'search':
+                path += '?' + urlencode({'query': rng.choice(terms)})
+            paths.append((route, path))
+        return paths
+
+    def run(self, base_url, members, mix, isbns, terms, rng, options):
+        clients = options['clients']
+        per_client = -(-options['requests'] // clients)
+        warmup = -(-options['warmup'] // clients) if options['warmup'] else 0
+        plans = []
+        for n in range(clients):
+            member, password = members[n % len(members)]
+            client = BenchmarkClient(base_url, options['timeout'])
+            try:
+                client.sign_in(member.user.username, password)
+            except URLError as e:
+                raise CommandError(f"Cannot reach {base_url}: {e.reason}")
+            plans.append((client, self.plan(rng, mix, warmup + per_client, member.lib_num, isbns, terms)))
+
+        samples = [[] for _ in range(clients)]
+        errors = []
+        start = threading.Barrier(clients + 1)
+
+        def worker(index, client, plan):
+            try:
+                for route, path in plan[:warmup]:
+                    client.request(path)
+                start.wait()
+                for route, path in plan[warmup:]:
+                    started = perf_counter()
+                    try:
+                        ok = client.request(path) == 200
+                    except (URLError, OSError):
+                        ok = False
+                    samples[index].append((route, perf_counter() - started, ok))
+            except Exception as e:
+                errors.append(e)
+                start.abort()
+
+        threads = [
+            threading.Thread(target=worker, args=(index, client, plan))
+            for index, (client, plan) in enumerate(plans)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            start.wait()
+        except threading.BrokenBarrierError:
+            pass
+        started = perf_counter()
+        for thread in threads:
+            thread.join()
+        elapsed = perf_counter() - started
+        if errors:
+            raise CommandError(f"{len(errors)} clients failed, first error: {errors[0]!r}")
+
+        measured = [sample for client_samples in samples for sample in client_samples]
+        return {
+            'base_url': base_url,
+            'finished_at': now().isoformat(),
+            'clients': clients,
+            'members': len(members),
+            'mix': mix,
+            'elapsed_seconds': round(elapsed, 3),
+            'overall': summarise([(seconds, ok) for _, seconds, ok in measured], elapsed),
+            'routes': {
+                route: summarise([(seconds, ok) for name, seconds, ok in measured if name == route], elapsed)
+                for route in ROUTES if route in mix and mix[route]
+            },
+        }
@@ -0,0 +1,70 @@
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from libraryweb.late_fees import BORROWED_TABLE, LATE_FEES_TABLE, bulk_supported, recompute_late_fees, recompute_late_fees_per_row
+from libraryweb.models import AvailBooks, BookMain, LibraryUser
+
+
+class Command(BaseCommand):
+    help = 'Benchmark update_late_fees on synthetic loans (everything is rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loans', type=int, default=1_000_000, help='Number of synthetic loans to create.')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument(
+            '--per-row',
+            action='store_true',
+            help='Also time the old row-by-row path (slow on large loan counts).',
+        )
+
+    def handle(self, *args, **options):
+        if not bulk_supported():
+            raise CommandError("The set-based late fee update needs SQLite.")
+
+        with transaction.atomic():
+            self.seed(options['loans'])
+
+            timings = {}
+            started = perf_counter()
+            first = recompute_late_fees(chunk_size=options['chunk_size'])
+            timings['bulk_first_run'] = perf_counter() - started
+
+            started = perf_counter()
+            second = recompute_late_fees(chunk_size=options['chunk_size'])
+            timings['bulk_unchanged_run'] = perf_counter() - started
+
+            if options['per_row']:
+                started = perf_counter()
+                recompute_late_fees_per_row()
+                timings['per_row_run'] = perf_counter() - started
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"Loans: {options['loans']}")
+        self.stdout.write(f"First run updated {first['days_changed']} rows, second run {second['days_changed']}")
+        for name, seconds in timings.items():
+            self.stdout.write(f"{name}: {seconds:.3f}s ({options['loans'] / seconds:,.0f} loans/s)")
+
+    def seed(self, loans):
+        started = perf_counter()
+        user = User.objects.create(username='late-fee-benchmark')
+        library_user = LibraryUser.objects.create(user=user)
+        book = BookMain.objects.create(isbn='0000000000000', title='Benchmark Book', author='Benchmark', genre='Benchmark')
+        avail = AvailBooks.objects.create(book=book, total_books=loans, available_books=0)
+
+        # Spread borrow dates over the last 30 days so about 90% of loans are overdue
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < %s) "
+                f"INSERT INTO {BORROWED_TABLE} (user_id, book_id, borrow_date) "
+                f"SELECT %s, %s, strftime('%%Y-%%m-%%d %%H:%%M:%%f', 'now', -(n * 43200 / %s) || ' minutes') FROM seq",
+                [loans, library_user.pk, avail.pk, loans],
+            )
+            cursor.execute(
+                f"INSERT INTO {LATE_FEES_TABLE} (user_borrowed_id, days_late, fee) "
+                f"SELECT id, 0, 0 FROM {BORROWED_TABLE} WHERE book_id = %s",
+                [avail.pk],
+            )
+        self.stdout.write(f"Seeded {loans} loans in {perf_counter() - started:.3f}s")
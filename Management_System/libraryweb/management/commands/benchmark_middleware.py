@@ -0,0 +1,50 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory
+from libraryweb.middleware import CaseInsensitiveMiddleware
+
+PATHS = [
+    '/Library/Signin/',
+    '/Library/Signup/',
+    '/Library/2024LIB0001/Home/',
+    '/Library/2024LIB0001/Search/',
+    '/Library/2024LIB0001/9780380295791/',
+    '/static/css/base.css',
+    '/media/book_covers/9780380295791.jpg',
+    '/admin/',
+    '/not/a/page/',
+]
+
+
+class Command(BaseCommand):
+    help = 'Micro-benchmark CaseInsensitiveMiddleware: requests/sec with and without it'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200_000)
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        requests = [factory.get(path) for path in PATHS]
+        total = options['requests']
+
+        def view(request):
+            return HttpResponse()
+
+        def run(handler):
+            started = perf_counter()
+            for n in range(total):
+                handler(requests[n % len(requests)])
+            return total / (perf_counter() - started)
+
+        middleware = CaseInsensitiveMiddleware(view)
+        without = run(view)
+        with_middleware = run(middleware)
+
+        self.stdout.write(f"Without middleware: {without:,.0f} requests/s")
+        self.stdout.write(f"With middleware:    {with_middleware:,.0f} requests/s")
+        self.stdout.write(
+            f"Added latency: {(1 / with_middleware - 1 / without) * 1e6:.2f}us per request "
+            f"(path cache: {middleware.canonical_path.cache_info()})"
+        )
@@ -0,0 +1,54 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from libraryweb.covers import generate_derivatives
+from libraryweb.models import BookMain
+
+
+def _generate(args):
+    # Runs in a worker process; django.setup() has already happened in the
+    # parent and fork carries the configured settings over
+    original, force = args
+    return original, generate_derivatives(original, force=force)
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate resized WebP and JPEG derivatives for every book cover, in a process pool, '
+        'and mark them ready so pages serve them instead of the originals'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('--force', action='store_true', help='Regenerate derivatives that already exist.')
+        parser.add_argument('--chunk-size', type=int, default=32)
+
+    def handle(self, *args, **options):
+        covers = (
+            BookMain.objects.exclude(cover_image='').exclude(cover_image__isnull=True)
+            .values_list('cover_image', flat=True).iterator()
+        )
+        jobs = ((name, options['force']) for name in covers)
+
+        generated = unchanged = failed = 0
+        ready = []
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            for original, written in pool.map(_generate, jobs, chunksize=options['chunk_size']):
+                if written is None:
+                    failed += 1
+                    self.stderr.write(f"Could not read {original}")
+                    continue
+                if written:
+                    generated += 1
+                else:
+                    unchanged += 1
+                ready.append(original)
+                if len(ready) >= options['chunk_size']:
+                    BookMain.mark_cover_derivatives(ready)
+                    ready = []
+        BookMain.mark_cover_derivatives(ready)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated derivatives for {generated} covers, {unchanged} already up to date, {failed} failed."
+        ))
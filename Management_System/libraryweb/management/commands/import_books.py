@@ -0,0 +1,89 @@
+import json
+import os
+from itertools import islice
+from time import perf_counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from libraryweb.importer import CatalogueImporter, dump_records, normalise_record
+from libraryweb.search import fts_enabled, rebuild_fts_table
+
+
+class Command(BaseCommand):
+    help = (
+        'Import books from an Open Library dump (--dump) or the Open Library search API '
+        '(--query), downloading covers concurrently and writing in batches.'
+    )
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--dump', help='Path to an Open Library editions dump or a JSON lines file.')
+        source.add_argument('--query', action='append', help='Search term to import, can be repeated.')
+        parser.add_argument('--limit', type=int, default=100, help='Results per search term.')
+        parser.add_argument('--genre', help='Genre for every imported book (defaults to the search term).')
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent cover downloads.')
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument(
+            '--client',
+            default='libraryweb.importer.OpenLibraryClient',
+            help='Dotted path of the HTTP client class, e.g. libraryweb.importer.StubClient for offline runs.',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='JSON file recording how many source records were imported, so an interrupted run can resume.',
+        )
+
+    def handle(self, *args, **options):
+        client = import_string(options['client'])(pool_size=options['workers'])
+        importer = CatalogueImporter(client, workers=options['workers'], batch_size=options['batch_size'])
+
+        checkpoint = options['checkpoint']
+        done = self.read_checkpoint(checkpoint)
+        if done:
+            self.stdout.write(f"Resuming after {done} records from {checkpoint}")
+
+        started = perf_counter()
+        records = islice(self.records(client, options), done, None)
+        while True:
+            batch = list(islice(records, options['batch_size']))
+            if not batch:
+                break
+            importer.import_batch([book for book in batch if book])
+            done += len(batch)
+            self.write_checkpoint(checkpoint, done)
+            self.stdout.write(f"{done} records read, {importer.created} books added")
+
+        if importer.created and fts_enabled():
+            rebuild_fts_table()
+        self.stdout.write(self.style.SUCCESS(
+            f"Added {importer.created} books, skipped {importer.skipped} "
+            f"in {perf_counter() - started:.1f}s."
+        ))
+
+    def records(self, client, options):
+        """
+        Yield normalised records (None for unusable ones, so they still
+        count towards the checkpoint position).
+        """
+        if options['dump']:
+            if not os.path.exists(options['dump']):
+                raise CommandError(f"No such dump file: {options['dump']}")
+            for record in dump_records(options['dump']):
+                yield normalise_record(record, options['genre'])
+        else:
+            for term in options['query']:
+                for record in client.search(term, limit=options['limit']):
+                    yield normalise_record(record, options['genre'] or term)
+
+    def read_checkpoint(self, path):
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            return json.load(f).get('records', 0)
+
+    def write_checkpoint(self, path, done):
+        if not path:
+            return
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump({'records': done}, f)
+        os.replace(f"{path}.tmp", path)
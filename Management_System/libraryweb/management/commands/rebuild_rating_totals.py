@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce
+from libraryweb.models import BookMain, Rating
+
+
+def rating_totals_subqueries():
+    """
+    Correlated subqueries computing each book's true rating sum and count.
+    """
+    ratings = Rating.objects.filter(book=OuterRef('pk')).order_by().values('book')
+    true_sum = Coalesce(Subquery(ratings.annotate(total=Sum('rating')).values('total')), Value(0), output_field=IntegerField())
+    true_count = Coalesce(Subquery(ratings.annotate(total=Count('pk')).values('total')), Value(0), output_field=IntegerField())
+    return true_sum, true_count
+
+
+class Command(BaseCommand):
+    help = 'Backfill or verify the stored rating_sum/rating_count/avg_rating on BookMain'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report books whose stored totals differ from the Rating table.',
+        )
+
+    def handle(self, *args, **options):
+        true_sum, true_count = rating_totals_subqueries()
+
+        if options['verify']:
+            drifted = (
+                BookMain.objects.annotate(true_sum=true_sum, true_count=true_count)
+                .exclude(rating_sum=F('true_sum'), rating_count=F('true_count'))
+                .values_list('isbn', 'rating_sum', 'rating_count', 'true_sum', 'true_count')
+            )
+            mismatches = 0
+            for isbn, rating_sum, rating_count, actual_sum, actual_count in drifted:
+                mismatches += 1
+                self.stdout.write(
+                    f"{isbn}: stored {rating_sum}/{rating_count}, actual {actual_sum}/{actual_count}"
+                )
+            if mismatches:
+                raise CommandError(f"{mismatches} books have stale rating totals. Run without --verify to fix.")
+            self.stdout.write(self.style.SUCCESS("All rating totals are consistent."))
+            return
+
+        with transaction.atomic():
+            BookMain.objects.update(rating_sum=true_sum, rating_count=true_count)
+            updated_count = BookMain.objects.update(
+                version=F('version') + 1,
+                avg_rating=Case(
+                    When(rating_count__gt=0, then=Cast(F('rating_sum'), FloatField()) / F('rating_count')),
+                    default=Value(0.0),
+                    output_field=FloatField(),
+                )
+            )
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt rating totals for {updated_count} books."))
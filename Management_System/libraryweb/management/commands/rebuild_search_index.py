@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from libraryweb.search import rebuild_fts_table
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the FTS5 full-text search table from BookMain'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='Database alias to rebuild.')
+
+    def handle(self, *args, **options):
+        using = options['database']
+        connection = connections[using]
+        if connection.vendor != 'sqlite':
+            raise CommandError("Full-text search needs SQLite, searches on this database use the icontains fallback.")
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            if not cursor.fetchone()[0]:
+                raise CommandError("This SQLite build has no FTS5, searches use the icontains fallback.")
+
+        indexed = rebuild_fts_table(using=using)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} books for full-text search."))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from libraryweb.leaderboard import refresh_leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Recompute the popular books leaderboard shown on the home page'
+
+    def handle(self, *args, **kwargs):
+        entries = refresh_leaderboard()
+        self.stdout.write(self.style.SUCCESS(f"Leaderboard refreshed with {entries} books."))
@@ -0,0 +1,23 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from libraryweb.recommendations import refresh_neighbours
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the item-item "because you borrowed" neighbours from UserHistory and Rating. '
+        'Only books touched since the last run are redone unless --full is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every book, not just the changed ones.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+        run = refresh_neighbours(full=options['full'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Full' if run.full else 'Incremental'} refresh: neighbours recomputed for "
+            f"{run.books_refreshed} books in {perf_counter() - started:.1f}s."
+        ))
@@ -0,0 +1,262 @@
+import random
+from datetime import timedelta
+from itertools import islice
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, Count, F, Max, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Mod
+from django.db.models.lookups import Exact
+from django.utils.timezone import now
+from libraryweb.leaderboard import refresh_leaderboard
+from libraryweb.models import (
+    AvailBooks,
+    BookMain,
+    LateFees,
+    LibNumCounter,
+    LibraryUser,
+    Rating,
+    UserBorrowed,
+    UserHistory,
+)
+from libraryweb.recommendations import refresh_neighbours
+from libraryweb.search import fts_enabled, rebuild_fts_table
+
+GENRES = [
+    'Fiction', 'Mystery', 'Science Fiction', 'Fantasy', 'Romance', 'History',
+    'Biography', 'Science', 'Poetry', 'Philosophy', 'Travel', 'Children',
+]
+WORDS = [
+    'Silent', 'Broken', 'Golden', 'Hidden', 'Last', 'Northern', 'Winter', 'Crimson',
+    'River', 'Garden', 'Empire', 'Shadow', 'Letters', 'Island', 'Machine', 'Journey',
+    'House', 'Stars', 'Memory', 'Kingdom', 'Storm', 'Library', 'Harbour', 'Mountain',
+]
+NAMES = [
+    'Ada', 'Ravi', 'Meera', 'John', 'Priya', 'Tomas', 'Lena', 'Arjun', 'Sofia', 'Kenji',
+    'Okafor', 'Iyer', 'Novak', 'Fischer', 'Sharma', 'Costa', 'Haddad', 'Nakamura',
+]
+REVIEWS = ['', '', '', 'Loved it.', 'Slow start, great ending.', 'Not for me.', 'Read it twice.']
+# Books are drawn from a Pareto distribution, so a few titles get most of the loans
+POPULARITY_SHAPE = 1.2
+# Generated ISBNs are 979 + a 10 digit counter, clear of real 978 ISBNs
+ISBN_PREFIX = '979'
+# Usernames are USERNAME_PREFIX + a random tag per run + a counter
+USERNAME_PREFIX = 'seed'
+DEFAULT_PASSWORD = 'library-seed'
+
+
+def spread(base, days, key='pk'):
+    """
+    base minus one of `days` (a list of day counts), picked by key modulo
+    len(days), for set-based UPDATEs of dates that auto_now_add flattened.
+    """
+    return Case(*(
+        When(Exact(Mod(key, len(days)), offset), then=base - Value(timedelta(days=day)))
+        for offset, day in enumerate(days)
+    ))
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a large synthetic library (books, members, borrowing history, ratings and '
+        'current loans) with bulk inserts. Adds to the existing data; safe to rerun.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=100_000)
+        parser.add_argument('--members', type=int, default=50_000)
+        parser.add_argument('--history', type=int, default=1_000_000)
+        parser.add_argument('--ratings', type=int, default=200_000)
+        parser.add_argument(
+            '--loans',
+            type=int,
+            default=30_000,
+            help=f'Current loans, up to {UserBorrowed.MAX_LOANS} per member.',
+        )
+        parser.add_argument('--password', default=DEFAULT_PASSWORD, help='Password of every generated member.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable datasets.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--skip-derived',
+            action='store_true',
+            help="Don't rebuild rating totals, late fees, the search index, leaderboard and recommendations afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        if options['books'] < 1 or options['members'] < 1:
+            raise CommandError("Need at least one book and one member.")
+        if options['loans'] > options['members'] * UserBorrowed.MAX_LOANS:
+            raise CommandError(f"At most {UserBorrowed.MAX_LOANS} loans per member.")
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.started = perf_counter()
+
+        books = self.create_books(options['books'])
+        members = self.create_members(options['members'], options['password'])
+        self.create_history(books, members, options['history'])
+        self.create_ratings(books, members, options['ratings'])
+        self.create_loans(books, members, options['loans'])
+        if not options['skip_derived']:
+            self.rebuild_derived_data()
+        self.stdout.write(self.style.SUCCESS(f"Seeded the dataset in {perf_counter() - self.started:.1f}s."))
+
+    def log(self, message):
+        self.stdout.write(f"[{perf_counter() - self.started:6.1f}s] {message}")
+
+    def bulk_create(self, model, objects):
+        """
+        Insert a generator of unsaved objects a batch at a time, so only one
+        batch is ever in memory. Returns the number inserted.
+        """
+        objects = iter(objects)
+        created = 0
+        with transaction.atomic():
+            while batch := list(islice(objects, self.batch_size)):
+                model.objects.bulk_create(batch)
+                created += len(batch)
+        return created
+
+    def pick_book(self, books):
+        return books[int(self.random.paretovariate(POPULARITY_SHAPE) - 1) % len(books)]
+
+    def create_books(self, count):
+        # Continue after the ISBNs of an earlier run
+        highest = BookMain.objects.filter(isbn__startswith=ISBN_PREFIX).aggregate(highest=Max('isbn'))['highest']
+        first = int(highest[len(ISBN_PREFIX):]) + 1 if highest else 0
+        self.bulk_create(BookMain, (
+            BookMain(
+                isbn=f"{ISBN_PREFIX}{number:010d}",
+                title=f"The {WORDS[number % len(WORDS)]} {WORDS[number // len(WORDS) % len(WORDS)]} {number}",
+                author=f"{NAMES[number % len(NAMES)]} {NAMES[number // len(NAMES) % len(NAMES)]}",
+                genre=GENRES[number % len(GENRES)],
+            )
+            for number in range(first, first + count)
+        ))
+        books = list(
+            BookMain.objects.filter(isbn__gte=f"{ISBN_PREFIX}{first:010d}", isbn__startswith=ISBN_PREFIX)
+            .order_by('isbn').values_list('pk', flat=True)
+        )
+        self.bulk_create(AvailBooks, (
+            AvailBooks(book_id=book_id, total_books=copies, available_books=copies)
+            for book_id in books
+            for copies in [self.random.randint(1, 8)]
+        ))
+        self.log(f"{len(books)} books")
+        return books
+
+    def create_members(self, count, password):
+        # One hash shared by every member: hashing each would take minutes
+        password = make_password(password)
+        prefix = f"{USERNAME_PREFIX}{self.random.getrandbits(32):08x}_"
+        self.bulk_create(User, (User(username=f"{prefix}{n}", password=password) for n in range(count)))
+        users = User.objects.filter(username__startswith=prefix).order_by('pk').values_list('pk', flat=True)
+
+        year = now().year
+        first_number = LibNumCounter.allocate(year, count=count)
+        self.bulk_create(LibraryUser, (
+            LibraryUser(
+                user_id=user_id,
+                lib_num=LibraryUser.format_lib_num(year, first_number + offset),
+                is_active=True,
+                fav_genre=', '.join(self.random.sample(GENRES, self.random.randint(1, 3))),
+            )
+            for offset, user_id in enumerate(users.iterator(chunk_size=self.batch_size))
+        ))
+        members = list(
+            LibraryUser.objects.filter(user__username__startswith=prefix).order_by('pk').values_list('pk', flat=True)
+        )
+        self.log(f"{len(members)} members")
+        return members
+
+    def create_history(self, books, members, count):
+        current = now()
+        after = UserHistory.objects.aggregate(highest=Max('pk'))['highest'] or 0
+        created = self.bulk_create(UserHistory, (
+            UserHistory(
+                user_id=self.random.choice(members),
+                book_id=self.pick_book(books),
+                borrow_date=current - timedelta(days=self.random.uniform(LateFees.LOAN_DAYS * 3, 3 * 365)),
+                on_time=False,
+            )
+            for _ in range(count)
+        ))
+        # return_date is auto_now_add; return a third of the loans late
+        UserHistory.objects.filter(pk__gt=after).update(
+            return_date=spread(F('borrow_date'), [-1, -2, -(LateFees.LOAN_DAYS + 4)]),
+        )
+        UserHistory.objects.filter(
+            pk__gt=after, return_date__lte=F('borrow_date') + Value(timedelta(days=LateFees.LOAN_DAYS)),
+        ).update(on_time=True)
+        self.log(f"{created} history rows")
+
+    def create_ratings(self, books, members, count):
+        after = Rating.objects.aggregate(highest=Max('pk'))['highest'] or 0
+        per_member = -(-count // len(members))
+
+        def ratings():
+            remaining = count
+            for member in members:
+                # A member rates a book once; past the popular titles any book will do
+                rated = set()
+                while len(rated) < min(per_member, remaining, len(books)):
+                    rated.add(self.pick_book(books) if len(rated) < per_member // 2 + 1 else self.random.choice(books))
+                for book_id in rated:
+                    yield Rating(
+                        user_id=member,
+                        book_id=book_id,
+                        rating=self.random.choices(range(6), weights=(1, 2, 4, 8, 10, 7))[0],
+                        review=self.random.choice(REVIEWS),
+                    )
+                    remaining -= 1
+                if remaining <= 0:
+                    return
+
+        created = self.bulk_create(Rating, ratings())
+        Rating.objects.filter(pk__gt=after).update(
+            created_at=spread(F('created_at'), [0, 3, 11, 40, 95, 180, 400]),
+        )
+        self.log(f"{created} ratings")
+
+    def create_loans(self, books, members, count):
+        stock = dict(AvailBooks.objects.filter(book__isbn__startswith=ISBN_PREFIX).values_list('book_id', 'pk'))
+        after = UserBorrowed.objects.aggregate(highest=Max('pk'))['highest'] or 0
+        created = self.bulk_create(UserBorrowed, (
+            UserBorrowed(user_id=members[n // UserBorrowed.MAX_LOANS], book_id=stock[self.pick_book(books)])
+            for n in range(count)
+        ))
+        # borrow_date is auto_now_add; make some loans due and some overdue
+        loans = UserBorrowed.objects.filter(pk__gt=after)
+        loans.update(borrow_date=spread(F('borrow_date'), [0, 1, 2, 4, 6, 10, 21]))
+        self.bulk_create(LateFees, (
+            LateFees(user_borrowed_id=pk)
+            for pk in loans.values_list('pk', flat=True).iterator(chunk_size=self.batch_size)
+        ))
+        self.log(f"{created} current loans")
+
+    def rebuild_derived_data(self):
+        """
+        bulk_create skips the save() methods and signals that keep stock,
+        rating totals, fees, the search index, leaderboard and recommendations in step,
+        so rebuild them set-based.
+        """
+        on_loan = Coalesce(Subquery(
+            UserBorrowed.objects.filter(book=OuterRef('pk')).order_by().values('book')
+            .annotate(total=Count('pk')).values('total')
+        ), 0)
+        with transaction.atomic():
+            # Popular titles can be lent out more often than the random stock allows
+            AvailBooks.objects.annotate(on_loan=on_loan).filter(on_loan__gt=F('total_books')).update(
+                total_books=on_loan,
+            )
+            AvailBooks.objects.update(available_books=F('total_books') - on_loan)
+        call_command('rebuild_rating_totals', stdout=self.stdout)
+        call_command('update_late_fees', stdout=self.stdout)
+        if fts_enabled():
+            rebuild_fts_table()
+        refresh_leaderboard()
+        refresh_neighbours(full=True)
+        self.log("stock, rating totals, late fees, search index, leaderboard and recommendations rebuilt")
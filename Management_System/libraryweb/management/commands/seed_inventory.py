@@ -0,0 +1,55 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from libraryweb.models import AvailBooks, BookMain
+
+
+class Command(BaseCommand):
+    help = 'Create AvailBooks rows for every book that has none. Safe to rerun.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--copies', type=int, default=10, help='Copies for books not covered by other options.')
+        parser.add_argument(
+            '--genre-copies',
+            action='append',
+            default=[],
+            metavar='GENRE=N',
+            help='Copies for every book of a genre, can be repeated.',
+        )
+        parser.add_argument('--csv', help='CSV file with isbn and copies columns, overrides the other options.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        genre_copies = {}
+        for item in options['genre_copies']:
+            genre, _, copies = item.partition('=')
+            if not copies.isdigit():
+                raise CommandError(f"--genre-copies expects GENRE=N, got {item!r}")
+            genre_copies[genre.strip().lower()] = int(copies)
+        isbn_copies = self.read_csv(options['csv']) if options['csv'] else {}
+
+        # One anti-join for every book without an AvailBooks row
+        missing = BookMain.objects.filter(availability__isnull=True).values_list('pk', 'isbn', 'genre')
+
+        rows = []
+        for book_id, isbn, genre in missing.iterator(chunk_size=options['batch_size']):
+            copies = isbn_copies.get(isbn, genre_copies.get(genre.lower(), options['copies']))
+            rows.append(AvailBooks(book_id=book_id, total_books=copies, available_books=copies))
+
+        with transaction.atomic():
+            # ignore_conflicts keeps a concurrent run from failing on the OneToOneField
+            AvailBooks.objects.bulk_create(rows, batch_size=options['batch_size'], ignore_conflicts=True)
+        self.stdout.write(self.style.SUCCESS(f"Populated AvailBooks for {len(rows)} books."))
+
+    def read_csv(self, path):
+        try:
+            with open(path, newline='', encoding='utf-8') as f:
+                reader = csv.DictReader(f)
+                if not reader.fieldnames or not {'isbn', 'copies'} <= set(reader.fieldnames):
+                    raise CommandError("The CSV needs isbn and copies columns.")
+                return {row['isbn'].strip(): int(row['copies']) for row in reader if row['isbn'].strip()}
+        except OSError as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+        except ValueError as e:
+            raise CommandError(f"Bad copies value in {path}: {e}")
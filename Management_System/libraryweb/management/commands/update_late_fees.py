@@ -1,15 +1,55 @@
+from time import perf_counter
+
 from django.core.management.base import BaseCommand
-from libraryweb.models import LateFees
-from django.db import transaction
+from libraryweb.late_fees import bulk_supported, recompute_late_fees, recompute_late_fees_per_row
 
 class Command(BaseCommand):
     help = 'Update late fees for all borrowed books'
 
-    def handle(self, *args, **kwargs):
-        with transaction.atomic():
-            updated_count = 0
-            for late_fee in LateFees.objects.all():
-                late_fee.calculate_fees()
-                late_fee.save()
-                updated_count += 1
-        self.stdout.write(self.style.SUCCESS(f"Updated late fees for {updated_count} entries."))
\ No newline at end of file
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Number of LateFees rows checked and committed per transaction.',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the loans whose fees would change without writing anything.',
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='Print detailed counters and timing.',
+        )
+        parser.add_argument(
+            '--per-row',
+            action='store_true',
+            help='Use the old row-by-row recalculation instead of set-based UPDATEs.',
+        )
+
+    def handle(self, *args, **options):
+        started = perf_counter()
+
+        if options['per_row'] or not bulk_supported():
+            updated_count = recompute_late_fees_per_row()
+            self.stdout.write(self.style.SUCCESS(f"Updated late fees for {updated_count} entries."))
+            return
+
+        stats = recompute_late_fees(chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+        elapsed = perf_counter() - started
+
+        if options['stats'] or options['dry_run']:
+            prefix = "Would update" if options['dry_run'] else "Updated"
+            self.stdout.write(f"Loans scanned: {stats['scanned']}")
+            self.stdout.write(f"{prefix} days late: {stats['days_changed']}")
+            self.stdout.write(f"{prefix} fees: {stats['fees_changed']}")
+            self.stdout.write(f"Chunks: {stats['chunks']} of up to {options['chunk_size']}")
+            self.stdout.write(f"Outstanding fees: ₹{stats['outstanding']}")
+            self.stdout.write(f"Elapsed: {elapsed:.3f}s")
+
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f"Updated late fees for {stats['days_changed']} of {stats['scanned']} entries."
+            ))
@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+from copy import deepcopy
+from time import monotonic
+
+from django.conf import settings
+
+from .models import LibraryUser
+
+
+class LibraryUserCache:
+    """
+    Small per-process LRU of active LibraryUser rows (with their User) keyed
+    by lib_num. Entries are dropped by the LibraryUser/User signals in this
+    process, and expire after LIBRARY_MEMBER_CACHE_TTL seconds so changes
+    made by other worker processes are picked up too.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lib_nums = {}  # user_id -> lib_num, to invalidate on User saves
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self):
+        return getattr(settings, 'LIBRARY_MEMBER_CACHE_SIZE', 1024)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'LIBRARY_MEMBER_CACHE_TTL', 30)
+
+    def get(self, lib_num):
+        if not lib_num:
+            return None
+        with self._lock:
+            entry = self._entries.get(lib_num)
+            if entry and entry[0] > monotonic():
+                self._entries.move_to_end(lib_num)
+                # Hand out a copy so a view changing fields can't leak into other requests
+                return deepcopy(entry[1])
+
+        library_user = LibraryUser.objects.select_related('user').filter(lib_num=lib_num).first()
+        if library_user is None or not (library_user.is_active and library_user.user.is_active):
+            # Only active members are cached, so a member who signed in
+            # through another worker is never turned away by a stale entry
+            return library_user
+        with self._lock:
+            self._entries[lib_num] = (monotonic() + self.ttl, library_user)
+            self._entries.move_to_end(lib_num)
+            self._lib_nums[library_user.user_id] = lib_num
+            while len(self._entries) > self.max_size:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._lib_nums.pop(evicted.user_id, None)
+        return deepcopy(library_user)
+
+    def invalidate(self, lib_num=None, user_id=None):
+        with self._lock:
+            if lib_num is None:
+                lib_num = self._lib_nums.get(user_id)
+            entry = self._entries.pop(lib_num, None)
+            if entry:
+                self._lib_nums.pop(entry[1].user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._lib_nums.clear()
+
+
+library_users = LibraryUserCache()
+
+
+def get_library_user(lib_num):
+    return library_users.get(lib_num)
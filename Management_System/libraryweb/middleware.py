@@ -8,54 +8,107 @@ from datetime import timedelta,datetime
 from .models import User
 from django.contrib.auth import logout
 from django.utils.timezone import now 
+from .members import get_library_user
+from .presence import presence
+from django.conf import settings
 
 
+import json
+import logging
 import re
+from contextlib import ExitStack
+from functools import lru_cache
+from time import perf_counter
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections
+
+performance_logger = logging.getLogger('libraryweb.performance')
+
+
+class LibraryUserMiddleware:
+    """
+    Middleware to resolve the LibraryUser named by the URL's lib_num once per
+    request (from the member cache, with the User already joined) and expose
+    it as request.library_user. It is None when the URL has no lib_num or the
+    member does not exist.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.library_user = None
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        lib_num = view_kwargs.get('lib_num')
+        if lib_num:
+            request.library_user = get_library_user(lib_num)
+        return None
+
+
+# Compiled once at import instead of going through re's cache on every request
+LIB_NUM_RE = re.compile(r'LIB\d+', re.IGNORECASE)
+EXCLUDED_PREFIXES = ('/admin', '/static', '/media')
+
+
+def canonical_path(path):
+    """
+    Return the title-cased form of a valid path if it differs, else None.
+    Always the same answer for a given path and URLconf, so
+    CaseInsensitiveMiddleware memoizes it.
+    """
+    if path.startswith(EXCLUDED_PREFIXES) or LIB_NUM_RE.search(path):
+        return None
+    try:
+        # Resolve the path to check if it's valid
+        resolve(path)
+    except Exception:
+        return None  # Ignore errors in resolving the path
+
+    # Title-case every segment (paths containing a LIBNum were excluded above)
+    normalized_path = '/'.join(segment.title() for segment in path.split('/'))
+    return normalized_path if normalized_path != path else None
+
 
 class CaseInsensitiveMiddleware:
+    """
+    Middleware to permanently redirect valid paths to their title-cased
+    form, keeping the query string. canonical_path() results are kept per
+    raw path in an LRU of LIBRARY_CANONICAL_PATH_CACHE_SIZE entries.
+    """
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.canonical_path = lru_cache(
+            maxsize=getattr(settings, 'LIBRARY_CANONICAL_PATH_CACHE_SIZE', 2048)
+        )(canonical_path)
 
     def __call__(self, request):
         # Exclude paths starting with '/admin', '/static', '/media',
         # or containing 'LIBNum' (case-insensitive match)
-        if not (
-            request.path_info.startswith('/admin') or
-            request.path_info.startswith('/static') or
-            request.path_info.startswith('/media') or
-            re.search(r'LIB\d+', request.path_info, re.IGNORECASE)
-        ):
-            try:
-                # Resolve the path to check if it's valid
-                resolved_path = resolve(request.path_info)
-                if resolved_path:  # If a valid URL match is found
-                    # Split the path into segments
-                    segments = request.path_info.split('/')
-
-                    # Title-case all segments except those containing LIBNum
-                    title_cased_segments = [
-                        segment if re.search(r'LIB\d+', segment, re.IGNORECASE) else segment.title()
-                        for segment in segments
-                    ]
-
-                    # Rejoin the segments into the normalized path
-                    normalized_path = '/'.join(title_cased_segments)
-
-                    # Ensure the correct format, and check if any change is needed
-                    if request.path_info != normalized_path:
-                        # Redirect to the normalized path
-                        return HttpResponsePermanentRedirect(normalized_path)
-            except Exception:
-                pass  # Ignore errors in resolving the path
+        path = request.path_info
+        if not path.startswith(EXCLUDED_PREFIXES):
+            normalized_path = self.canonical_path(path)
+            if normalized_path:
+                # Redirect to the normalized path
+                query_string = request.META.get('QUERY_STRING')
+                if query_string:
+                    normalized_path = f'{normalized_path}?{query_string}'
+                return HttpResponsePermanentRedirect(normalized_path)
 
         # Proceed with the view handling
-        response = self.get_response(request)
-        return response
-    
-    
+        return self.get_response(request)
+
+
 class InactivityLogoutMiddleware:
     """
     Middleware to log out users after a period of inactivity.
+
+    last_activity is only rewritten once it is LIBRARY_ACTIVITY_GRANULARITY
+    seconds old, so most requests don't touch the session table. Timed out
+    members are deactivated through the presence buffer.
     """
 
     def __init__(self, get_response):
@@ -64,19 +117,18 @@ class InactivityLogoutMiddleware:
     def __call__(self, request):
         if request.user.is_authenticated and not request.user.is_superuser:
             last_activity = request.session.get('last_activity')
+            current_time = now()
+            last_activity_time = None
 
             if last_activity:
                 try:
                     last_activity_time = datetime.fromisoformat(last_activity)
                     inactivity_limit = timedelta(minutes=5)
 
-                    if now() - last_activity_time > inactivity_limit:
+                    if current_time - last_activity_time > inactivity_limit:
                         # Mark the user as inactive if they exceed the inactivity limit
                         if request.user.is_active:
-                            request.user.is_active = False
-                            request.user.library_profile.is_active = False
-                            request.user.save()
-                            request.user.library_profile.save()
+                            presence.mark_inactive(request.user.pk)
 
                         # Logout and clear session (non-flush to preserve data)
                         logout(request)
@@ -85,9 +137,162 @@ class InactivityLogoutMiddleware:
 
                 except ValueError:
                     # If session data is malformed, reset last_activity
-                    request.session['last_activity'] = now().isoformat()
+                    last_activity_time = None
 
-            # Update last activity time
-            request.session['last_activity'] = now().isoformat()
+            # Update last activity time, at most once per granularity
+            granularity = timedelta(seconds=getattr(settings, 'LIBRARY_ACTIVITY_GRANULARITY', 30))
+            if last_activity_time is None or current_time - last_activity_time >= granularity:
+                request.session['last_activity'] = current_time.isoformat()
 
-        return self.get_response(request)
\ No newline at end of file
+        return self.get_response(request)
+
+
+class RequestMetrics:
+    """
+    Timings of one request, filled in by the two performance middlewares
+    and the database execute wrapper. All times are in seconds.
+    """
+    # Statements kept per request for the slow request report
+    MAX_QUERIES = 500
+
+    def __init__(self):
+        self.total = 0.0
+        self.view = 0.0
+        self.template = 0.0
+        self.sql = 0.0
+        self.query_count = 0
+        self.queries = []
+        self.rendering = False  # Inside a timed template render
+
+    def database_wrapper(self, alias):
+        def record(execute, sql, params, many, context):
+            started = perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                elapsed = perf_counter() - started
+                self.sql += elapsed
+                self.query_count += 1
+                if len(self.queries) < self.MAX_QUERIES:
+                    self.queries.append((alias, sql, params, many, elapsed))
+        return record
+
+    def server_timing(self):
+        """
+        Server-Timing header value. The entries overlap: sql and tpl are
+        spent inside view, and mw is everything around the view (sessions,
+        auth, inactivity checks).
+        """
+        return ', '.join([
+            f'sql;dur={self.sql * 1000:.1f};desc="{self.query_count} queries"',
+            f'tpl;dur={self.template * 1000:.1f};desc="Templates"',
+            f'view;dur={self.view * 1000:.1f};desc="View"',
+            f'mw;dur={(self.total - self.view) * 1000:.1f};desc="Middleware"',
+            f'total;dur={self.total * 1000:.1f};desc="Total"',
+        ])
+
+    def slowest_queries(self, count):
+        """
+        The `count` slowest statements with their EXPLAIN output. Run after
+        the execute wrappers are removed, so the EXPLAINs aren't counted.
+        """
+        report = []
+        for alias, sql, params, many, elapsed in sorted(self.queries, key=lambda query: -query[4])[:count]:
+            # Parameters are left out of the log: they carry session data and member details
+            entry = {'sql': sql, 'ms': round(elapsed * 1000, 2)}
+            if not many and sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+                entry['explain'] = self.explain(alias, sql, params)
+            report.append(entry)
+        return report
+
+    @staticmethod
+    def explain(alias, sql, params):
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f"{connection.ops.explain_query_prefix()} {sql}", params)
+                return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+        except DatabaseError as e:
+            return [f"EXPLAIN failed: {e}"]
+
+
+def performance_enabled():
+    return getattr(settings, 'LIBRARY_PERF_INSTRUMENTATION', False)
+
+
+class PerformanceMiddleware:
+    """
+    Opt-in request instrumentation, enabled by LIBRARY_PERF_INSTRUMENTATION.
+    Goes first in MIDDLEWARE, with PerformanceViewMiddleware last, so the
+    time spent in the middleware chain can be told apart from the view.
+
+    Each response gets a Server-Timing header (SQL count and time, template,
+    view, middleware and total time, shown by browser dev tools) and each
+    request a JSON log line on the libraryweb.performance logger. Requests
+    slower than LIBRARY_PERF_SLOW_MS are logged as warnings along with
+    their slowest statements and EXPLAIN output.
+    """
+
+    def __init__(self, get_response):
+        if not performance_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = request.performance = RequestMetrics()
+        started = perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics.database_wrapper(connection.alias)))
+            response = self.get_response(request)
+        metrics.total = perf_counter() - started
+
+        response['Server-Timing'] = metrics.server_timing()
+        self.log(request, response, metrics)
+        return response
+
+    def log(self, request, response, metrics):
+        slow = metrics.total * 1000 >= getattr(settings, 'LIBRARY_PERF_SLOW_MS', 500)
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'view': request.resolver_match.view_name if request.resolver_match else None,
+            'status': response.status_code,
+            'total_ms': round(metrics.total * 1000, 2),
+            'view_ms': round(metrics.view * 1000, 2),
+            'middleware_ms': round((metrics.total - metrics.view) * 1000, 2),
+            'template_ms': round(metrics.template * 1000, 2),
+            'sql_ms': round(metrics.sql * 1000, 2),
+            'queries': metrics.query_count,
+            'slow': slow,
+        }
+        if slow:
+            record['slowest_queries'] = metrics.slowest_queries(getattr(settings, 'LIBRARY_PERF_EXPLAIN_QUERIES', 5))
+        performance_logger.log(
+            logging.WARNING if slow else logging.INFO,
+            json.dumps(record, sort_keys=True),
+            extra={'performance': record},
+        )
+
+
+class PerformanceViewMiddleware:
+    """
+    The inner half of PerformanceMiddleware, last in MIDDLEWARE: everything
+    below it (URL resolving, process_view hooks, the view and rendering its
+    response) is view time. Template time is measured by the template
+    backend, see template_backends.py.
+    """
+
+    def __init__(self, get_response):
+        if not performance_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = getattr(request, 'performance', None)
+        if metrics is None:
+            return self.get_response(request)
+        started = perf_counter()
+        response = self.get_response(request)
+        metrics.view = perf_counter() - started
+        return response
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:17
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_rating_totals(apps, schema_editor):
+    BookMain = apps.get_model('libraryweb', 'BookMain')
+    Rating = apps.get_model('libraryweb', 'Rating')
+    ratings = Rating.objects.filter(book=OuterRef('pk')).order_by().values('book')
+    BookMain.objects.update(
+        rating_sum=Coalesce(Subquery(ratings.annotate(total=Sum('rating')).values('total')), Value(0)),
+        rating_count=Coalesce(Subquery(ratings.annotate(total=Count('pk')).values('total')), Value(0)),
+    )
+    for book in BookMain.objects.filter(rating_count__gt=0).only('rating_sum', 'rating_count'):
+        BookMain.objects.filter(pk=book.pk).update(avg_rating=book.rating_sum / book.rating_count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libraryweb', '0004_userhistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookmain',
+            name='avg_rating',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='bookmain',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='bookmain',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+FTS_TABLE = 'libraryweb_bookmain_fts'
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "title, author, genre, isbn, tokenize='unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, title, author, genre, isbn) "
+            "SELECT id, title, author, genre, isbn FROM libraryweb_bookmain"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libraryweb', '0005_bookmain_rating_totals'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+        # Maps the table for joins, see BookSearchEntry
+        migrations.CreateModel(
+            name='BookSearchEntry',
+            fields=[
+                ('book', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='libraryweb.bookmain')),
+                ('document', models.TextField(db_column='libraryweb_bookmain_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'libraryweb_bookmain_fts',
+                'managed': False,
+            },
+        ),
+    ]
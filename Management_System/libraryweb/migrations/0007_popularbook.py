@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libraryweb', '0006_bookmain_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularBook',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField(unique=True)),
+                ('avg_rating', models.FloatField(default=0)),
+                ('borrowed_count', models.PositiveIntegerField(default=0)),
+                ('refreshed_at', models.DateTimeField()),
+                ('book', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='leaderboard_entry', to='libraryweb.bookmain')),
+            ],
+        ),
+    ]
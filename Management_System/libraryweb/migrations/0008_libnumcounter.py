@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:30
+
+import re
+
+from django.db import migrations, models
+
+LIB_NUM_RE = re.compile(r'^(\d{4})LIB(\d+)$')
+
+
+def seed_counters(apps, schema_editor):
+    LibraryUser = apps.get_model('libraryweb', 'LibraryUser')
+    LibNumCounter = apps.get_model('libraryweb', 'LibNumCounter')
+    highest = {}
+    for lib_num in LibraryUser.objects.values_list('lib_num', flat=True).iterator():
+        match = LIB_NUM_RE.match(lib_num)
+        if match:
+            year, number = int(match.group(1)), int(match.group(2))
+            highest[year] = max(highest.get(year, 0), number)
+    LibNumCounter.objects.bulk_create(
+        [LibNumCounter(year=year, last_number=number) for year, number in highest.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libraryweb', '0007_popularbook'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LibNumCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField(unique=True)),
+                ('last_number', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_counters, migrations.RunPython.noop),
+    ]
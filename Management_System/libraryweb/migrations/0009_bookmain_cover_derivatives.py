@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libraryweb', '0008_libnumcounter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookmain',
+            name='cover_derivatives',
+            field=models.BooleanField(default=False),
+        ),
+    ]
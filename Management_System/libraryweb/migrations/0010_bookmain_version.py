@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libraryweb', '0009_bookmain_cover_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookmain',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
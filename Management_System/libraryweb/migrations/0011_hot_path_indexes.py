@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libraryweb', '0010_bookmain_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookmain',
+            index=models.Index(fields=['genre', 'title'], name='bookmain_genre_title_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='latefees',
+            index=models.Index(fields=['fee'], name='latefees_fee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['book', 'created_at'], name='rating_book_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='request',
+            index=models.Index(fields=['isbn'], name='request_isbn_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userborrowed',
+            index=models.Index(fields=['book', 'borrow_date'], name='borrowed_book_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userhistory',
+            index=models.Index(fields=['user', 'borrow_date'], name='history_user_borrow_idx'),
+        ),
+    ]
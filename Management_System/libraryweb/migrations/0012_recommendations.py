@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('libraryweb', '0011_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('finished_at', models.DateTimeField(auto_now_add=True)),
+                ('full', models.BooleanField(default=False)),
+                ('last_history_id', models.PositiveBigIntegerField(default=0)),
+                ('last_rating_id', models.PositiveBigIntegerField(default=0)),
+                ('books_refreshed', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BookNeighbour',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbours', to='libraryweb.bookmain')),
+                ('neighbour', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='libraryweb.bookmain')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['book', '-score'], name='neighbour_book_score_idx')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'neighbour'), name='unique_book_neighbour')],
+            },
+        ),
+    ]
@@ -3,27 +3,64 @@ from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator,MinValueValidator
 from django.utils.timezone import now
 from datetime import timedelta
-from django.db.models import Avg
+from django.db.models import Case, F, FloatField, Value, When
+from django.db.models.functions import Cast, Length
 from django.contrib.auth.models import User
 
 
+class LibNumCounter(models.Model):
+    """
+    Last lib_num number handed out per year. Numbers are taken with an
+    atomic increment, so concurrent sign-ups never get the same one.
+    """
+    year = models.PositiveSmallIntegerField(unique=True)
+    last_number = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def allocate(cls, year, count=1):
+        """
+        Reserve `count` consecutive numbers for `year` and return the first.
+        """
+        with transaction.atomic():
+            if not cls.objects.filter(year=year).update(last_number=F('last_number') + count):
+                # First number of the year: start after any lib_num already issued
+                cls.objects.bulk_create(
+                    [cls(year=year, last_number=cls.highest_issued(year))],
+                    ignore_conflicts=True,
+                )
+                cls.objects.filter(year=year).update(last_number=F('last_number') + count)
+            last_number = cls.objects.filter(year=year).values_list('last_number', flat=True).get()
+        return last_number - count + 1
+
+    @staticmethod
+    def highest_issued(year):
+        prefix = f"{year}LIB"
+        last = (
+            LibraryUser.objects.filter(lib_num__startswith=prefix)
+            .order_by(Length('lib_num').desc(), '-lib_num')
+            .values_list('lib_num', flat=True)
+            .first()
+        )
+        return int(last[len(prefix):]) if last else 0
+
+    def __str__(self):
+        return f"{self.year}: {self.last_number}"
+
+
 class LibraryUser(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="library_profile")
     lib_num = models.CharField(max_length=15, unique=True)
     is_active = models.BooleanField(default=False)
     fav_genre = models.TextField(null=True, blank=True, help_text="Favorite genres, separated by commas.")  # New field
 
+    @staticmethod
+    def format_lib_num(year, number):
+        return f"{year}LIB{number:04d}"  # Format: YYYYLIB0001
+
     def save(self, *args, **kwargs):
         if not self.lib_num:
-            with transaction.atomic():
-                current_year = now().year
-                # Find the last LibraryUser lib_num of the current year
-                last_user = LibraryUser.objects.filter(lib_num__startswith=f"{current_year}LIB").order_by('-lib_num').first()
-                if last_user:
-                    last_number = int(last_user.lib_num[8:]) + 1  # Extract the numeric part
-                else:
-                    last_number = 1
-                self.lib_num = f"{current_year}LIB{last_number:04d}"  # Format: YYYYLIB0001
+            current_year = now().year
+            self.lib_num = self.format_lib_num(current_year, LibNumCounter.allocate(current_year))
         super().save(*args, **kwargs)
 
     def __str__(self):
@@ -37,10 +74,99 @@ class BookMain(models.Model):
     author = models.CharField(max_length=255)
     genre = models.CharField(max_length=50)
     cover_image = models.ImageField(upload_to='book_covers/', blank=True, null=True)
+    # Whether the resized derivatives of cover_image exist (see covers.py).
+    # Set by mark_cover_derivatives() once they are written, never while
+    # rendering, and cleared when the cover is replaced
+    cover_derivatives = models.BooleanField(default=False)
+    # Denormalised rating totals, kept in step with Rating by signals.py
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    avg_rating = models.FloatField(default=0, db_index=True)
+    # Bumped whenever something shown on the book's card changes, it keys
+    # the cached card fragments in home.html and search.html
+    version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Genre filters sorted by title (admin list_filter, genre shelves)
+            models.Index(fields=['genre', 'title'], name='bookmain_genre_title_idx'),
+        ]
 
     @property
     def average_rating(self):
-        return self.ratings.aggregate(average=Avg('rating'))['average'] or 0
+        return self.avg_rating
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets save() and post_save tell whether the cover was replaced
+        if 'cover_image' in field_names:
+            instance._loaded_cover = values[field_names.index('cover_image')]
+        return instance
+
+    def cover_changed(self):
+        return (self.cover_image.name or None) != (getattr(self, '_loaded_cover', None) or None)
+
+    # Only ever changed by adjust_rating_totals, so saving an instance loaded
+    # before a review came in doesn't put back the old totals
+    RATING_TOTALS = {'rating_sum', 'rating_count', 'avg_rating'}
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or kwargs.get('force_insert'):
+            super().save(*args, **kwargs)
+            return
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            update_fields = {
+                field.name for field in self._meta.concrete_fields if not field.primary_key
+            } - self.RATING_TOTALS - self.get_deferred_fields() - {'cover_derivatives'}
+        update_fields = {*update_fields, 'version'}
+        if 'cover_image' in update_fields and self.cover_changed():
+            # The new cover's derivatives are made after commit, see signals.py
+            self.cover_derivatives = False
+            update_fields.add('cover_derivatives')
+        kwargs['update_fields'] = update_fields
+        # Incremented in the database, as bump_versions does, so a stale
+        # instance can't set it back
+        self.version = F('version') + 1
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=['version'])
+
+    @classmethod
+    def bump_versions(cls, book_ids):
+        """
+        Invalidate the cached cards of these books in one UPDATE.
+        """
+        cls.objects.filter(pk__in=book_ids).update(version=F('version') + 1)
+
+    @classmethod
+    def mark_cover_derivatives(cls, covers):
+        """
+        Record that these covers' derivatives have been written, and
+        invalidate the cards that showed the original meanwhile.
+        """
+        cls.objects.filter(cover_image__in=covers, cover_derivatives=False).update(
+            cover_derivatives=True, version=F('version') + 1,
+        )
+
+    @classmethod
+    def adjust_rating_totals(cls, book_id, sum_delta, count_delta):
+        """
+        Apply a rating delta to a book in a single UPDATE so concurrent
+        reviews never overwrite each other's totals.
+        """
+        new_sum = F('rating_sum') + sum_delta
+        new_count = F('rating_count') + count_delta
+        cls.objects.filter(pk=book_id).update(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            version=F('version') + 1,
+            avg_rating=Case(
+                When(rating_count__gt=-count_delta, then=Cast(new_sum, FloatField()) / new_count),
+                default=Value(0.0),
+                output_field=FloatField(),
+            ),
+        )
 
     def __str__(self):
         return self.title
@@ -55,6 +181,18 @@ class AvailBooks(models.Model):
     def remaining_books(self):#Borrowed Books
         return self.total_books - self.available_books
 
+    @classmethod
+    def take_copy(cls, pk):
+        """
+        Atomically reserve one copy. Returns False when none are left, so two
+        concurrent checkouts can never both take the last copy.
+        """
+        return cls.objects.filter(pk=pk, available_books__gt=0).update(available_books=F('available_books') - 1) == 1
+
+    @classmethod
+    def put_back_copy(cls, pk):
+        cls.objects.filter(pk=pk).update(available_books=F('available_books') + 1)
+
     def earliest_return(self):
         if self.total_books == self.available_books:
             return None  # All books are available
@@ -80,6 +218,12 @@ class UserHistory(models.Model):
     return_date = models.DateTimeField(auto_now_add=True)
     on_time = models.BooleanField()
 
+    class Meta:
+        indexes = [
+            # HistoryView: one member's loans, newest first
+            models.Index(fields=['user', 'borrow_date'], name='history_user_borrow_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         due_date = self.borrow_date + timedelta(days=3)
         self.on_time = self.return_date <= due_date
@@ -90,26 +234,35 @@ class UserHistory(models.Model):
 
 
 class UserBorrowed(models.Model):
+    MAX_LOANS = 3
+
     user = models.ForeignKey(LibraryUser, on_delete=models.CASCADE, related_name="borrowed_books")
     book = models.ForeignKey(AvailBooks, on_delete=models.CASCADE, related_name="borrowed_instances")
     borrow_date = models.DateTimeField(auto_now_add=True)
 
-    def save(self, *args, **kwargs):
-        self.book.available_books -= 1
-        self.book.save()
-        super().save(*args, **kwargs)
+    class Meta:
+        indexes = [
+            # Earliest due date of a title (detail page, AvailBooks admin)
+            models.Index(fields=['book', 'borrow_date'], name='borrowed_book_date_idx'),
+        ]
 
-    def delete(self, *args, **kwargs):
+    def save(self, *args, **kwargs):
         with transaction.atomic():
-            # Increment the available books count
-            self.book.available_books += 1
-            self.book.save()
-        super().delete(*args, **kwargs)
-    
+            if self._state.adding:
+                # Conditional UPDATE instead of a read-modify-write on the counter
+                if not AvailBooks.take_copy(self.book_id):
+                    raise ValidationError("Book is not available for borrowing.")
+                if UserBorrowed.book.is_cached(self):
+                    self.book.available_books -= 1
+            super().save(*args, **kwargs)
+
+    # Returning a copy (available_books += 1) happens once, in the pre_delete
+    # signal, so it also covers queryset deletes from the admin.
+
     def clean(self):
         # Check if available_books is greater than total_books
-        if self.user.borrowed_books.count() >= 3:
-            raise ValidationError("A user can only borrow a maximum of 3 books at a time.")
+        if self.user.borrowed_books.count() >= self.MAX_LOANS:
+            raise ValidationError(f"A user can only borrow a maximum of {self.MAX_LOANS} books at a time.")
         if self.book.available_books == 0:
             raise ValidationError("Book is not available for borrowing.")
         
@@ -123,15 +276,24 @@ class UserBorrowed(models.Model):
         return f"{self.user.lib_num} Borrowed {self.book.book.title} on {self.borrow_date.day}/{self.borrow_date.month}/{self.borrow_date.year}"
 
 class LateFees(models.Model):
+    LOAN_DAYS = 3
+    FEE_PER_DAY = 50  # ₹50 per day late
+
     user_borrowed = models.OneToOneField(UserBorrowed, on_delete=models.CASCADE, related_name="late_fee")
     days_late = models.PositiveIntegerField(default=0)
     fee = models.PositiveIntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            # Outstanding fees by amount (LateFeesListView ordering, admin sort)
+            models.Index(fields=['fee'], name='latefees_fee_idx'),
+        ]
+
     def calculate_fees(self):
-        due_date = self.user_borrowed.borrow_date + timedelta(days=3)
+        due_date = self.user_borrowed.borrow_date + timedelta(days=self.LOAN_DAYS)
         if now() > due_date:
             self.days_late = (now() - due_date).days
-            self.fee = self.days_late * 50  # ₹50 per day late
+            self.fee = self.days_late * self.FEE_PER_DAY
         else:
             self.days_late = 0
             self.fee = 0
@@ -148,6 +310,12 @@ class Request(models.Model):
     author = models.CharField(max_length=255, blank=True, null=True)
     request_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Outstanding requests for a title (admin search by ISBN)
+            models.Index(fields=['isbn'], name='request_isbn_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.lib_num} requested {self.title or 'unknown book'}"
 
@@ -162,6 +330,80 @@ class Rating(models.Model):
 
     class Meta:
         unique_together = ('user', 'book')  # Each user can review a book only once
+        indexes = [
+            # A book's reviews, newest first (detail page and "load more")
+            models.Index(fields=['book', 'created_at'], name='rating_book_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.lib_num} rated {self.book.title} - {self.rating}"
+
+class BookSearchEntry(models.Model):
+    """
+    The FTS5 search table written by search.py, mapped read-only so a search
+    can join it to BookMain and read its rank, instead of running MATCH again
+    for every result row. The table only exists when SQLite has FTS5.
+    """
+    book = models.OneToOneField(
+        BookMain, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+        db_constraint=False, related_name='search_entry',
+    )
+    # FTS5's hidden column named after the table: MATCH it to search every column
+    document = models.TextField(db_column='libraryweb_bookmain_fts')
+    # bm25() of the current MATCH, negative and smaller for better matches
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'libraryweb_bookmain_fts'
+
+
+class PopularBook(models.Model):
+    """
+    Precomputed home page leaderboard, maintained by leaderboard.py.
+    """
+    position = models.PositiveSmallIntegerField(unique=True)
+    book = models.OneToOneField(BookMain, on_delete=models.CASCADE, related_name="leaderboard_entry")
+    avg_rating = models.FloatField(default=0)
+    borrowed_count = models.PositiveIntegerField(default=0)
+    refreshed_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"#{self.position} {self.book.title}"
+
+
+class BookNeighbour(models.Model):
+    """
+    Top-N most similar books per book from the item-item collaborative
+    filter, maintained by recommendations.py.
+    """
+    book = models.ForeignKey(BookMain, on_delete=models.CASCADE, related_name="neighbours")
+    neighbour = models.ForeignKey(BookMain, on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'neighbour'], name='unique_book_neighbour'),
+        ]
+        indexes = [
+            # "Because you borrowed" lookups: a book's neighbours, best first
+            models.Index(fields=['book', '-score'], name='neighbour_book_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} -> {self.neighbour_id} ({self.score:.3f})"
+
+
+class RecommendationRun(models.Model):
+    """
+    One run of the recommendation job. The latest run's high-water marks
+    tell an incremental refresh which history and ratings are new.
+    """
+    finished_at = models.DateTimeField(auto_now_add=True)
+    full = models.BooleanField(default=False)
+    last_history_id = models.PositiveBigIntegerField(default=0)
+    last_rating_id = models.PositiveBigIntegerField(default=0)
+    books_refreshed = models.PositiveIntegerField(default=0)
 
     def __str__(self):
-        return f"{self.user.lib_num} rated {self.book.title} - {self.rating}"
\ No newline at end of file
+        return f"{'Full' if self.full else 'Incremental'} run at {self.finished_at}: {self.books_refreshed} books"
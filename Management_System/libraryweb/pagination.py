@@ -0,0 +1,196 @@
+import datetime
+import json
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.core.paginator import Paginator
+from django.db.models import Max, Q
+from django.utils.functional import cached_property
+
+TOKEN_SALT = 'libraryweb.pagination'
+
+
+class KeysetPage:
+    """
+    One page of a KeysetPaginator. Quacks enough like Django's Page for the
+    templates: iterable, has_next/has_previous, plus next/previous tokens.
+    """
+
+    def __init__(self, object_list, next_token, previous_token, total=None, total_is_lower_bound=False):
+        self.object_list = object_list
+        self.next_token = next_token
+        self.previous_token = previous_token
+        self.total = total
+        self.total_is_lower_bound = total_is_lower_bound
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_token is not None
+
+    def has_previous(self):
+        return self.previous_token is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Cursor pagination on the queryset's own ordering. A page is fetched with
+    WHERE (sort keys) < (last row's keys) LIMIT per_page + 1, so every page
+    costs the same as the first: no OFFSET, and no COUNT(*) unless a total
+    is asked for.
+
+    The ordering must be plain field or annotation names without NULLs; the
+    primary key is appended as a tie-breaker when it isn't already there.
+    Tokens are signed, so a tampered cursor just shows the first page.
+    """
+
+    def __init__(self, queryset, per_page, count_total=False):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.count_total = count_total
+        self.ordering = self.get_ordering(queryset)
+
+    @staticmethod
+    def get_ordering(queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not all(isinstance(key, str) for key in ordering):
+            raise ImproperlyConfigured("KeysetPaginator needs an ordering made of field names.")
+        pk = queryset.model._meta.pk.name
+        ordering = [key.replace('pk', pk) if key.lstrip('-') == 'pk' else key for key in ordering]
+        if not any(key.lstrip('-') == pk for key in ordering):
+            ordering.append(f'-{pk}' if ordering and ordering[-1].startswith('-') else pk)
+        return ordering
+
+    def keys_of(self, obj):
+        return [getattr(obj, key.lstrip('-')) for key in self.ordering]
+
+    def make_token(self, obj, direction, total):
+        return signing.dumps(
+            {'k': self.keys_of(obj), 'd': direction, 't': total},
+            salt=TOKEN_SALT, compress=True, serializer=KeysetSerializer,
+        )
+
+    def read_token(self, token):
+        try:
+            data = signing.loads(token, salt=TOKEN_SALT, serializer=KeysetSerializer)
+        except signing.BadSignature:
+            return None
+        if len(data.get('k', ())) != len(self.ordering) or data.get('d') not in ('next', 'prev'):
+            return None
+        return data
+
+    def after(self, keys, backwards):
+        """
+        Q for rows strictly after keys in the ordering (before, if backwards):
+        (a < x) OR (a = x AND b < y) OR ...
+        """
+        condition = Q()
+        for position, key in enumerate(self.ordering):
+            field = key.lstrip('-')
+            descending = key.startswith('-') != backwards
+            step = Q(**{f'{field}__{"lt" if descending else "gt"}': keys[position]})
+            for earlier, value in zip(self.ordering[:position], keys):
+                step &= Q(**{earlier.lstrip('-'): value})
+            condition |= step
+        return condition
+
+    def approximate_total(self):
+        """
+        Count matches up to LIBRARY_PAGINATION_COUNT_LIMIT. Returns the
+        count and whether it hit the cap (shown as "1000+").
+        """
+        limit = getattr(settings, 'LIBRARY_PAGINATION_COUNT_LIMIT', 1000)
+        count = self.queryset.order_by().values('pk')[:limit + 1].count()
+        return min(count, limit), count > limit
+
+    def page(self, token=None):
+        data = self.read_token(token) if token else None
+        if data is None:
+            total = self.approximate_total() if self.count_total else None
+            backwards = False
+            queryset = self.queryset
+        else:
+            total = data['t']
+            backwards = data['d'] == 'prev'
+            queryset = self.queryset.filter(self.after(data['k'], backwards))
+
+        if backwards:
+            queryset = queryset.order_by(*(key[1:] if key.startswith('-') else f'-{key}' for key in self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+
+        # Coming back from a later page there is always a next page, and
+        # going forward from a cursor there is always a previous one
+        has_next = more if not backwards else True
+        has_previous = data is not None and (more if backwards else True)
+        return KeysetPage(
+            rows,
+            self.make_token(rows[-1], 'next', total) if has_next and rows else None,
+            self.make_token(rows[0], 'prev', total) if has_previous and rows else None,
+            *(total or (None, False)),
+        )
+
+
+class KeysetSerializer(signing.JSONSerializer):
+    """
+    JSON that survives datetimes in the sort keys. They are written as full
+    ISO strings, microseconds included, which the ORM parses back when
+    filtering on a DateTimeField.
+    """
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':'), default=self.encode_key).encode('latin-1')
+
+    @staticmethod
+    def encode_key(value):
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        raise TypeError(f"Can't use {type(value).__name__} as a keyset pagination key")
+
+
+class KeysetPaginationMixin:
+    """
+    ListView mixin replacing OFFSET pagination with KeysetPaginator. The
+    template gets page_obj as usual; links carry ?cursor=<token>.
+    """
+    count_total = False
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = KeysetPaginator(queryset, page_size, count_total=self.count_total)
+        page = paginator.page(self.request.GET.get(self.cursor_kwarg))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator for admin changelists over big tables. An unfiltered table is
+    sized from its highest primary key, one index lookup instead of a full
+    COUNT(*); it overestimates by the number of deleted rows, which only
+    shows up as a short last page. Small tables and filtered lists are
+    counted exactly.
+    """
+    exact_count_below = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = queryset.model._default_manager.aggregate(highest=Max('pk'))['highest'] or 0
+            if estimate >= self.exact_count_below:
+                return estimate
+        return super().count
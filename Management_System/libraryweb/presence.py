@@ -0,0 +1,116 @@
+import atexit
+import threading
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models import Q
+from django.utils.timezone import now
+
+from .members import library_users
+from .models import LibraryUser
+
+
+class PresenceBuffer:
+    """
+    Per-process buffer of members who timed out. Their is_active flags are
+    cleared in one batch of UPDATEs at most LIBRARY_PRESENCE_FLUSH_INTERVAL
+    seconds after the first of them, by a timer thread, so the write never
+    waits for another request to reach this worker.
+
+    Signing in and signing out are written straight away: session
+    authentication rejects users whose is_active is False, and other
+    workers only see the flags in the database.
+    """
+
+    def __init__(self):
+        self._pending = {}  # user_id -> time the member went inactive
+        self._timer = None
+        self._lock = threading.Lock()
+
+    @property
+    def interval(self):
+        return getattr(settings, 'LIBRARY_PRESENCE_FLUSH_INTERVAL', 10)
+
+    def mark_inactive(self, user_id):
+        with self._lock:
+            self._pending[user_id] = now()
+            if self._timer is None:
+                self._timer = threading.Timer(self.interval, self._flush_on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+        library_users.invalidate(user_id=user_id)
+
+    def discard(self, user_id):
+        with self._lock:
+            self._pending.pop(user_id, None)
+            if not self._pending and self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def is_pending(self, user_id):
+        return user_id in self._pending
+
+    def flush(self):
+        """
+        Write all pending deactivations. A member who signed in again after
+        being marked, in any process, has a newer last_login and is left
+        active. Returns the count flushed.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            pending, self._pending, self._timer = self._pending, {}, None
+        if not pending:
+            return 0
+
+        still_away = reduce(or_, (
+            Q(pk=user_id) & (Q(last_login__isnull=True) | Q(last_login__lte=marked_at))
+            for user_id, marked_at in pending.items()
+        ))
+        user_ids = list(User.objects.filter(still_away).values_list('pk', flat=True))
+        User.objects.filter(pk__in=user_ids).update(is_active=False)
+        LibraryUser.objects.filter(user_id__in=user_ids).update(is_active=False)
+        for user_id in pending:
+            library_users.invalidate(user_id=user_id)
+        return len(user_ids)
+
+    def _flush_on_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread's connections are never reused
+            connections.close_all()
+
+
+presence = PresenceBuffer()
+atexit.register(presence.flush)
+
+
+def activate(user):
+    """
+    Mark a signing-in user and their LibraryUser active, using set-based
+    UPDATEs and only when a flag actually needs changing.
+    """
+    presence.discard(user.pk)
+    library_user = user.library_profile
+    if not user.is_active:
+        User.objects.filter(pk=user.pk).update(is_active=True)
+        user.is_active = True
+    if not library_user.is_active:
+        LibraryUser.objects.filter(pk=library_user.pk).update(is_active=True)
+        library_user.is_active = True
+    library_users.invalidate(user_id=user.pk)
+
+
+def deactivate(user):
+    """
+    Mark a signing-out user and their LibraryUser inactive straight away.
+    """
+    presence.discard(user.pk)
+    User.objects.filter(pk=user.pk).update(is_active=False)
+    LibraryUser.objects.filter(user_id=user.pk).update(is_active=False)
+    user.is_active = False
+    library_users.invalidate(user_id=user.pk)
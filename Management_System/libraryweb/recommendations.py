@@ -0,0 +1,254 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+
+from .models import BookMain, BookNeighbour, Rating, RecommendationRun, UserHistory
+
+# How much a single interaction counts: a borrow is 1, a rating scales from
+# 0.5 (0 stars) to 2.0 (5 stars); a member who did both keeps the larger
+BORROW_WEIGHT = 1.0
+RATING_WEIGHT_BASE = 0.5
+RATING_WEIGHT_PER_STAR = 0.3
+
+
+def neighbours_per_book():
+    return getattr(settings, 'LIBRARY_RECOMMENDATION_NEIGHBOURS', 20)
+
+
+def genre_weight():
+    return getattr(settings, 'LIBRARY_RECOMMENDATION_GENRE_WEIGHT', 0.2)
+
+
+class InteractionMatrix:
+    """
+    The sparse member x book interaction matrix, stored both ways round in
+    CSR form (offsets into index/weight arrays) so one book's co-readers and
+    each co-reader's books can be sliced without Python loops.
+    """
+
+    def __init__(self, members, books, weights):
+        import numpy as np
+
+        self.np = np
+        # Dense 0..n-1 numbering for members and books
+        self.book_ids, book_index = np.unique(books, return_inverse=True)
+        member_ids, member_index = np.unique(members, return_inverse=True)
+
+        # One cell per (member, book), keeping the strongest interaction
+        cells = member_index.astype(np.int64) * len(self.book_ids) + book_index
+        cells, cell_index = np.unique(cells, return_inverse=True)
+        strength = np.zeros(len(cells))
+        np.maximum.at(strength, cell_index, weights)
+        cell_members, cell_books = np.divmod(cells, len(self.book_ids))
+
+        # cells are sorted by member already, which gives the member -> books CSR
+        self.member_books = cell_books
+        self.member_weights = strength
+        self.member_offsets = np.searchsorted(cell_members, np.arange(len(member_ids) + 1))
+
+        by_book = np.argsort(cell_books, kind='stable')
+        self.book_members = cell_members[by_book]
+        self.book_weights = strength[by_book]
+        self.book_offsets = np.searchsorted(cell_books[by_book], np.arange(len(self.book_ids) + 1))
+
+        # Euclidean norm of each book's column, for cosine similarity
+        self.norms = np.sqrt(np.bincount(cell_books, weights=strength ** 2, minlength=len(self.book_ids)))
+
+    @classmethod
+    def load(cls, books=None):
+        """
+        Read the borrows and ratings in two streaming queries: every one, or
+        those of the books in `books` (a subquery of book ids).
+        """
+        import numpy as np
+
+        history, ratings = UserHistory.objects.all(), Rating.objects.all()
+        if books is not None:
+            history, ratings = history.filter(book_id__in=books), ratings.filter(book_id__in=books)
+        history = history.values_list('user_id', 'book_id').order_by().iterator(chunk_size=10000)
+        pairs = np.fromiter(history, dtype=np.dtype((np.int64, 2)))
+        ratings = ratings.values_list('user_id', 'book_id', 'rating').order_by().iterator(chunk_size=10000)
+        rated = np.fromiter(ratings, dtype=np.dtype((np.int64, 3)))
+        if not len(pairs) and not len(rated):
+            return None
+        pairs = pairs.reshape(-1, 2)
+        rated = rated.reshape(-1, 3)
+        return cls(
+            np.concatenate([pairs[:, 0], rated[:, 0]]),
+            np.concatenate([pairs[:, 1], rated[:, 1]]),
+            np.concatenate([
+                np.full(len(pairs), BORROW_WEIGHT),
+                RATING_WEIGHT_BASE + rated[:, 2] * RATING_WEIGHT_PER_STAR,
+            ]),
+        )
+
+    def similar(self, book, genres, limit, boost):
+        """
+        Top neighbours of one book (dense index) as (indices, scores): cosine
+        similarity over co-readers, plus boost for books sharing its genre.
+        """
+        np = self.np
+        start, end = self.book_offsets[book], self.book_offsets[book + 1]
+        readers, reader_weights = self.book_members[start:end], self.book_weights[start:end]
+
+        # Gather every book of every co-reader in one fancy-indexing step
+        starts, ends = self.member_offsets[readers], self.member_offsets[readers + 1]
+        lengths = ends - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        books = self.member_books[positions]
+        products = self.member_weights[positions] * np.repeat(reader_weights, lengths)
+
+        candidates, inverse = np.unique(books, return_inverse=True)
+        dot = np.bincount(inverse, weights=products)
+        scores = dot / (self.norms[book] * self.norms[candidates])
+        scores = scores + boost * (genres[candidates] == genres[book])
+        keep = candidates != book
+        candidates, scores = candidates[keep], scores[keep]
+
+        if len(candidates) > limit:
+            top = np.argpartition(-scores, limit)[:limit]
+            candidates, scores = candidates[top], scores[top]
+        return candidates, scores
+
+
+def books_read_by(members):
+    """
+    Subquery of the ids of books borrowed or rated by `members` (user ids,
+    or a subquery of them).
+    """
+    return (
+        UserHistory.objects.filter(user_id__in=members).values('book_id')
+        .union(Rating.objects.filter(user_id__in=members).values('book_id'))
+    )
+
+
+def readers_of(books):
+    """
+    Subquery of the ids of members who borrowed or rated `books`.
+    """
+    return (
+        UserHistory.objects.filter(book_id__in=books).values('user_id')
+        .union(Rating.objects.filter(book_id__in=books).values('user_id'))
+    )
+
+
+def refresh_neighbours(full=False, batch_size=500):
+    """
+    Recompute stored neighbours. A full run redoes every book; otherwise
+    only the books of members with history or ratings newer than the last
+    run are redone (a new pair changes both books' rows). Scores of other
+    books drift slightly as popularity changes, until the next full run.
+
+    An incremental run only loads the rows of the books its targets are
+    compared with, the books of their readers: that is every row cosine
+    similarity reads, so the redone scores match a full run's.
+    Returns the RecommendationRun recorded.
+    """
+    import numpy as np
+
+    last_run = None if full else RecommendationRun.objects.order_by('-finished_at', '-id').first()
+    marks = {
+        'last_history_id': UserHistory.objects.aggregate(m=Max('id'))['m'] or 0,
+        'last_rating_id': Rating.objects.aggregate(m=Max('id'))['m'] or 0,
+    }
+
+    if last_run is None:
+        matrix = InteractionMatrix.load()
+        if matrix is None:
+            BookNeighbour.objects.all().delete()
+            return RecommendationRun.objects.create(full=True, books_refreshed=0, **marks)
+        targets = matrix.book_ids
+    else:
+        members = set(
+            UserHistory.objects.filter(id__gt=last_run.last_history_id, id__lte=marks['last_history_id'])
+            .values_list('user_id', flat=True)
+        ) | set(
+            Rating.objects.filter(id__gt=last_run.last_rating_id, id__lte=marks['last_rating_id'])
+            .values_list('user_id', flat=True)
+        )
+        changed = books_read_by(members)
+        targets = np.array(sorted(row['book_id'] for row in changed), dtype=np.int64)
+        compared = books_read_by(readers_of(changed))
+        matrix = InteractionMatrix.load(compared) if len(targets) else None
+        if matrix is None:
+            return RecommendationRun.objects.create(full=False, books_refreshed=0, **marks)
+        # Rows written since the matrix was read are picked up next time
+        targets = targets[np.isin(targets, matrix.book_ids)]
+
+    books = BookMain.objects.all() if last_run is None else BookMain.objects.filter(pk__in=compared)
+    genre_of = dict(books.values_list('pk', 'genre').iterator(chunk_size=10000))
+    _, genres = np.unique([genre_of.get(book_id, '') for book_id in matrix.book_ids.tolist()], return_inverse=True)
+    limit, boost = neighbours_per_book(), genre_weight()
+    book_index = np.searchsorted(matrix.book_ids, targets)
+
+    for batch_start in range(0, len(targets), batch_size):
+        batch = book_index[batch_start:batch_start + batch_size]
+        rows = []
+        for book in batch.tolist():
+            candidates, scores = matrix.similar(book, genres, limit, boost)
+            book_id = int(matrix.book_ids[book])
+            rows += [
+                BookNeighbour(book_id=book_id, neighbour_id=int(matrix.book_ids[candidate]), score=float(score))
+                for candidate, score in zip(candidates.tolist(), scores.tolist())
+            ]
+        with transaction.atomic():
+            BookNeighbour.objects.filter(book_id__in=matrix.book_ids[batch].tolist()).delete()
+            BookNeighbour.objects.bulk_create(rows, batch_size=1000)
+
+    if last_run is None:
+        # Books nobody reads any more keep no stale neighbours
+        BookNeighbour.objects.filter(
+            ~Exists(UserHistory.objects.filter(book=OuterRef('book'))),
+            ~Exists(Rating.objects.filter(book=OuterRef('book'))),
+        ).delete()
+    return RecommendationRun.objects.create(full=last_run is None, books_refreshed=len(targets), **marks)
+
+
+def neighbours_of(book, limit=6):
+    """
+    "Members who borrowed this also borrowed": one indexed lookup.
+    """
+    return [
+        entry.neighbour
+        for entry in BookNeighbour.objects.filter(book=book).select_related('neighbour').order_by('-score')[:limit]
+    ]
+
+
+def because_you_borrowed(library_user, seeds=3, per_seed=5):
+    """
+    Recommendations grouped by the member's most recent distinct borrows:
+    a list of (borrowed book, [recommended books]), skipping books the
+    member has already borrowed and favouring their fav_genre. Two queries
+    on the history and neighbour indexes.
+    """
+    recent = []
+    for entry in (
+        UserHistory.objects.filter(user=library_user).select_related('book')
+        .order_by('-borrow_date')[:seeds * 4]
+    ):
+        if all(entry.book_id != book.pk for book in recent):
+            recent.append(entry.book)
+        if len(recent) == seeds:
+            break
+    if not recent:
+        return []
+
+    already_read = UserHistory.objects.filter(user=library_user).values('book_id')
+    entries = list(
+        BookNeighbour.objects.filter(book__in=recent)
+        .exclude(neighbour__in=already_read)
+        .select_related('neighbour')
+    )
+    # fav_genre holds comma separated genres
+    fav_genres = {genre.strip().lower() for genre in (library_user.fav_genre or '').split(',') if genre.strip()}
+    boost = genre_weight()
+    entries.sort(key=lambda entry: -(entry.score + boost * (entry.neighbour.genre.lower() in fav_genres)))
+
+    groups = {book.pk: [] for book in recent}
+    shown = set()
+    for entry in entries:
+        group = groups[entry.book_id]
+        if len(group) < per_seed and entry.neighbour_id not in shown:
+            group.append(entry.neighbour)
+            shown.add(entry.neighbour_id)
+    return [(book, groups[book.pk]) for book in recent if groups[book.pk]]
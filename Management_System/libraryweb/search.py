@@ -0,0 +1,143 @@
+import re
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import ExpressionWrapper, F, FloatField, Lookup, Q, Value
+
+from .models import BookMain, BookSearchEntry
+
+FTS_TABLE = 'libraryweb_bookmain_fts'
+FTS_COLUMNS = ('title', 'author', 'genre', 'isbn')
+
+# Words the user typed, anything else (quotes, operators, punctuation) is dropped
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_fts_state = {}
+
+
+class Match(Lookup):
+    """
+    document__match=query, FTS5's `table MATCH query`.
+    """
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+BookSearchEntry._meta.get_field('document').register_lookup(Match)
+
+
+def fts_enabled(using='default'):
+    """
+    Return True when the database supports FTS5 and the search table exists.
+    The answer is cached per database so the check costs nothing after the first call.
+    """
+    connection = connections[using]
+    key = (using, str(connection.settings_dict['NAME']))
+    if key not in _fts_state:
+        enabled = False
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+                has_fts5 = bool(cursor.fetchone()[0])
+                enabled = has_fts5 and FTS_TABLE in connection.introspection.table_names(cursor)
+        _fts_state[key] = enabled
+    return _fts_state[key]
+
+
+def reset_fts_state():
+    _fts_state.clear()
+
+
+def create_fts_table(cursor):
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        f"{', '.join(FTS_COLUMNS)}, tokenize='unicode61 remove_diacritics 2')"
+    )
+
+
+def rebuild_fts_table(using='default'):
+    """
+    Drop and repopulate the search table from BookMain in one INSERT ... SELECT.
+    Returns the number of indexed books.
+    """
+    columns = ', '.join(FTS_COLUMNS)
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        create_fts_table(cursor)
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, {columns}) "
+            f"SELECT id, {columns} FROM {BookMain._meta.db_table}"
+        )
+        cursor.execute(f"SELECT count(*) FROM {FTS_TABLE}")
+        indexed = cursor.fetchone()[0]
+    reset_fts_state()
+    return indexed
+
+
+def index_book(book, using='default'):
+    if not fts_enabled(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [book.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}(rowid, {', '.join(FTS_COLUMNS)}) VALUES (%s, %s, %s, %s, %s)",
+            [book.pk] + [getattr(book, column) for column in FTS_COLUMNS],
+        )
+
+
+def unindex_book(book, using='default'):
+    if not fts_enabled(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [book.pk])
+
+
+def build_match_query(query):
+    """
+    Turn free text into an FTS5 query where every word is a quoted prefix term,
+    e.g. 'harry pot' -> '"harry"* "pot"*'. Returns '' if nothing searchable remains.
+    """
+    return ' '.join(f'"{token}"*' for token in TOKEN_RE.findall(query))
+
+
+def search_books(queryset, query, using='default'):
+    """
+    Filter a BookMain queryset by the search text.
+
+    With FTS5 the matches are ranked by BM25 blended with the stored average
+    rating and the borrowed_count annotation (which the queryset must carry).
+    Without FTS5 it falls back to the icontains filters and the plain ordering.
+    A blank query lists every book; one with no words in it (e.g. '!!!') none.
+    """
+    match = build_match_query(query)
+    if not match:
+        browse = queryset.order_by('-avg_rating', '-borrowed_count', 'title')
+        return browse if not query.strip() else browse.none()
+
+    if not fts_enabled(using):
+        return queryset.filter(
+            Q(title__icontains=query) |
+            Q(author__icontains=query) |
+            Q(genre__icontains=query) |
+            Q(isbn__icontains=query)
+        ).order_by('-avg_rating', '-borrowed_count', 'title')
+
+    rating_weight = getattr(settings, 'LIBRARY_SEARCH_RATING_WEIGHT', 0.5)
+    borrow_weight = getattr(settings, 'LIBRARY_SEARCH_BORROW_WEIGHT', 0.1)
+    # One pass over the FTS index joined to the books by rowid; rank is only
+    # defined in the query doing the MATCH
+    return (
+        queryset.filter(search_entry__document__match=match)
+        .annotate(text_rank=F('search_entry__rank'))
+        .annotate(search_score=ExpressionWrapper(
+            Value(0.0) - F('text_rank')
+            + Value(rating_weight) * F('avg_rating')
+            + Value(borrow_weight) * F('borrowed_count'),
+            output_field=FloatField(),
+        ))
+        .order_by('-search_score', '-avg_rating', '-borrowed_count', 'title')
+    )
@@ -1,6 +1,12 @@
-from django.db.models.signals import post_delete,pre_delete,post_save
+from django.db.models.signals import post_delete,pre_delete,post_save,pre_save
+from django.db import transaction
 from django.dispatch import receiver
-from .models import UserHistory,UserBorrowed,LateFees
+from .models import UserHistory,UserBorrowed,LateFees,Rating,BookMain,AvailBooks,LibraryUser
+from django.contrib.auth.models import User
+from .members import library_users
+from .search import index_book,unindex_book
+from .leaderboard import note_book_changed
+from .covers import generate_derivatives
 from django.utils.timezone import now
 from datetime import timedelta
 
@@ -18,14 +24,91 @@ def create_user_history_on_delete(sender, instance, **kwargs):
         return_date=return_date,
         on_time=on_time
     )
+    BookMain.bump_versions([instance.book.book_id])
+    note_book_changed(instance.book.book_id)
 
 @receiver(pre_delete, sender=UserBorrowed)
 def handle_bulk_delete(sender, instance, **kwargs):
-    # Increment the available_books count before deletion
-    instance.book.available_books += 1
-    instance.book.save()
+    # Increment the available_books count before deletion, atomically so
+    # concurrent returns of the same title are all counted
+    AvailBooks.put_back_copy(instance.book_id)
+    if UserBorrowed.book.is_cached(instance):
+        instance.book.available_books += 1
 
 @receiver(post_save, sender=UserBorrowed)
 def create_late_fees(sender, instance, created, **kwargs):
     if created:
-        LateFees.objects.create(user_borrowed=instance)
\ No newline at end of file
+        LateFees.objects.create(user_borrowed=instance)
+        BookMain.bump_versions([instance.book.book_id])
+        note_book_changed(instance.book.book_id)
+
+@receiver(post_save, sender=AvailBooks)
+def bump_book_version_on_stock_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        BookMain.bump_versions([instance.book_id])
+
+@receiver(post_save, sender=AvailBooks)
+def update_leaderboard_on_stock_change(sender, instance, raw=False, **kwargs):
+    # borrowed_count is copies out of the total, so a stock edit can move a book
+    if not raw:
+        note_book_changed(instance.book_id)
+
+@receiver(pre_save, sender=Rating)
+def remember_previous_rating(sender, instance, **kwargs):
+    # Keep the stored values so post_save can apply an exact delta on edits
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = Rating.objects.filter(pk=instance.pk).values('book_id', 'rating').first()
+
+@receiver(post_save, sender=Rating)
+def update_rating_totals_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_rating', None)
+    if previous is None:
+        BookMain.adjust_rating_totals(instance.book_id, instance.rating, 1)
+    elif previous['book_id'] != instance.book_id:
+        BookMain.adjust_rating_totals(previous['book_id'], -previous['rating'], -1)
+        BookMain.adjust_rating_totals(instance.book_id, instance.rating, 1)
+        note_book_changed(previous['book_id'])
+    elif previous['rating'] != instance.rating:
+        BookMain.adjust_rating_totals(instance.book_id, instance.rating - previous['rating'], 0)
+    else:
+        return  # Only the review text changed
+    note_book_changed(instance.book_id)
+
+@receiver(post_delete, sender=Rating)
+def update_rating_totals_on_delete(sender, instance, **kwargs):
+    BookMain.adjust_rating_totals(instance.book_id, -instance.rating, -1)
+    note_book_changed(instance.book_id)
+
+@receiver(post_save, sender=BookMain)
+def update_search_index_on_save(sender, instance, **kwargs):
+    index_book(instance, using=kwargs.get('using') or 'default')
+
+@receiver(post_save, sender=BookMain)
+def generate_cover_derivatives(sender, instance, raw=False, **kwargs):
+    # Only for a new or replaced cover. Uploads get unique storage names, so
+    # a replaced cover gets fresh derivatives. Pages show the original until
+    # they are written, after the save commits
+    cover = instance.cover_image.name or None
+    if cover and not raw and instance.cover_changed():
+        transaction.on_commit(lambda: resize_cover(cover))
+    instance._loaded_cover = cover
+
+def resize_cover(cover):
+    if generate_derivatives(cover) is not None:
+        BookMain.mark_cover_derivatives([cover])
+
+@receiver(post_delete, sender=BookMain)
+def update_search_index_on_delete(sender, instance, **kwargs):
+    unindex_book(instance, using=kwargs.get('using') or 'default')
+    note_book_changed(instance.pk)
+
+@receiver(post_save, sender=LibraryUser)
+@receiver(post_delete, sender=LibraryUser)
+def invalidate_cached_library_user(sender, instance, **kwargs):
+    library_users.invalidate(lib_num=instance.lib_num)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    library_users.invalidate(user_id=instance.pk)
@@ -0,0 +1,29 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const loadMoreBtn = document.getElementById('load-more-reviews');
+    const reviews = document.getElementById('reviews');
+    if (!loadMoreBtn || !reviews) {
+        return;
+    }
+
+    // Fetch the next page of reviews and append the rendered cards
+    loadMoreBtn.addEventListener('click', function() {
+        const url = loadMoreBtn.dataset.url + '?cursor=' + encodeURIComponent(loadMoreBtn.dataset.cursor);
+        loadMoreBtn.disabled = true;
+
+        fetch(url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+            .then(response => response.json())
+            .then(data => {
+                reviews.insertAdjacentHTML('beforeend', data.html);
+                if (data.next) {
+                    loadMoreBtn.dataset.cursor = data.next;
+                    loadMoreBtn.disabled = false;
+                } else {
+                    loadMoreBtn.remove();
+                }
+            })
+            .catch(error => {
+                console.error('Error loading reviews:', error);
+                loadMoreBtn.disabled = false;
+            });
+    });
+});
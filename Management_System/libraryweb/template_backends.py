@@ -0,0 +1,42 @@
+from time import perf_counter
+
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates, Template, reraise
+
+
+class TimedTemplate(Template):
+    """
+    A Django template that adds its render time to the request's
+    RequestMetrics, when PerformanceMiddleware put one on the request.
+    Only the outermost render is timed: a template rendered while another
+    is (render_to_string() from a tag, say) is already inside its time.
+    """
+
+    def render(self, context=None, request=None):
+        metrics = getattr(request, 'performance', None)
+        if metrics is None or metrics.rendering:
+            return super().render(context, request)
+        metrics.rendering = True
+        started = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template += perf_counter() - started
+            metrics.rendering = False
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend with TimedTemplates, so template time is
+    measured however a view renders: TemplateResponse, render() or
+    render_to_string() with the request.
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return TimedTemplate(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
@@ -0,0 +1,23 @@
+from django import template
+
+from ..covers import cover_sources
+
+register = template.Library()
+
+# Cards are a 2/3/5 column grid, see home.html and search.html
+GRID_SIZES = "(min-width: 1024px) 20vw, (min-width: 768px) 33vw, 50vw"
+
+
+@register.inclusion_tag('libraryweb/partials/cover.html')
+def book_cover(book, sizes=GRID_SIZES, css_class='', alt=None, lazy=True):
+    """
+    Render a book cover as a <picture> with WebP and JPEG srcsets of the
+    resized derivatives, or the placeholder when the book has no cover.
+    """
+    return {
+        'sources': cover_sources(book.cover_image.name, book.cover_derivatives) if book.cover_image else None,
+        'sizes': sizes,
+        'css_class': css_class,
+        'alt': alt if alt is not None else book.title,
+        'lazy': lazy,
+    }
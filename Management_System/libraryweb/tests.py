@@ -1,3 +1,1391 @@
-from django.test import TestCase
+import json
+import os
+import re
+import sys
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from statistics import quantiles
+from time import perf_counter
+from tempfile import TemporaryDirectory
+from unittest import mock, skipUnless
+from zoneinfo import ZoneInfo
 
-# Create your tests here.
+from django.contrib.admin.models import LogEntry
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Exists, F, OuterRef, Value
+from django.db.models.functions import Coalesce
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from django.urls import resolve, reverse
+from django.utils.http import http_date
+from django.utils.timezone import now
+
+from .models import AvailBooks, BookMain, BookNeighbour, LateFees, LibNumCounter, LibraryUser, PopularBook, Rating, Request, UserBorrowed, UserHistory
+from .circulation import checkout, return_book, return_books
+from .files import parse_range, serve_file
+from .pagination import KeysetPaginator
+from .importer import CatalogueImporter, StubClient, normalise_record
+from .late_fees import recompute_late_fees, recompute_late_fees_per_row
+from .leaderboard import popular_books, refresh_if_affected, refresh_leaderboard
+from .members import library_users
+from .middleware import CaseInsensitiveMiddleware
+from .presence import presence
+from .recommendations import InteractionMatrix, because_you_borrowed, neighbours_of, refresh_neighbours
+from .search import search_books
+from .templatetags.book_covers import book_cover
+
+
+def make_member(username):
+    user = User.objects.create_user(username=username, password='test-pass-123')
+    return LibraryUser.objects.create(user=user, is_active=True)
+
+
+@override_settings(LIBRARY_REVIEWS_PER_PAGE=5)
+class DetailPageTests(TestCase):
+    # Session, user, member, book, one page of reviews and the book's
+    # neighbours, whatever the review count
+    QUERY_CEILING = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = make_member('reader')
+        cls.book = BookMain.objects.create(isbn='9780000000001', title='Dune', author='Frank Herbert', genre='Sci-Fi')
+        cls.availability = AvailBooks.objects.create(book=cls.book, total_books=3, available_books=3)
+        cls.reviewers = [make_member(f'reviewer{n}') for n in range(12)]
+
+    def setUp(self):
+        self.client.force_login(self.member.user)
+        self.url = reverse('libraryweb:detail', kwargs={'lib_num': self.member.lib_num, 'isbn': self.book.isbn})
+
+    def add_reviews(self, reviewers):
+        for n, reviewer in enumerate(reviewers):
+            Rating.objects.create(user=reviewer, book=self.book, rating=n % 5 + 1, review=f'Review {n}')
+
+    def count_queries(self):
+        self.client.get(self.url)  # warm the member cache
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_reviews(self):
+        self.add_reviews(self.reviewers[:1])
+        one_review = self.count_queries()
+        self.add_reviews(self.reviewers[1:])
+        many_reviews = self.count_queries()
+
+        self.assertEqual(one_review, many_reviews)
+        self.assertLessEqual(many_reviews, self.QUERY_CEILING)
+
+    def test_availability_and_own_rating(self):
+        checkout(self.reviewers[0], self.availability)
+        Rating.objects.create(user=self.member, book=self.book, rating=4, review='Great')
+
+        response = self.client.get(self.url)
+        book = response.context['bookdetail']
+        self.assertEqual(book.availability.available_books, 2)
+        self.assertIsNotNone(book.earliest_return)
+        self.assertEqual(response.context['existing_rating'], {'rating': 4, 'review': 'Great'})
+
+    def test_load_more_pages_through_all_reviews(self):
+        self.add_reviews(self.reviewers)
+        response = self.client.get(self.url)
+        page = response.context['reviews']
+        self.assertEqual(len(page), 5)
+        self.assertContains(response, 'Load more reviews')
+
+        reviews_url = reverse('libraryweb:reviews', kwargs={'lib_num': self.member.lib_num, 'isbn': self.book.isbn})
+        seen = [rating.review for rating in page]
+        cursor = page.next_token
+        while cursor:
+            data = self.client.get(reviews_url, {'cursor': cursor}).json()
+            seen += [f'Review {n}' for n in range(12) if f'>Review {n}<' in data['html']]
+            cursor = data['next']
+        self.assertCountEqual(seen, [f'Review {n}' for n in range(12)])
+
+    def test_invalid_rating_rerenders_with_errors(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, {'rating': 9, 'review': ''})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['rating_form'].errors)
+        book_queries = [q for q in queries if 'FROM "libraryweb_bookmain"' in q['sql'] and 'isbn' in q['sql']]
+        self.assertEqual(len(book_queries), 1)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked with SQLite EXPLAIN QUERY PLAN')
+class QueryPlanTests(TestCase):
+    """
+    The hot lookups must keep using their indexes: a plain SCAN of a table
+    or a temporary B-tree for the ORDER BY means a query went linear.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        genres = ['Fiction', 'History', 'Science', 'Poetry']
+        cls.members = [make_member(f'member{n}') for n in range(20)]
+        cls.books = BookMain.objects.bulk_create([
+            BookMain(isbn=f'978{n:010d}', title=f'Book {n}', author=f'Author {n % 17}', genre=genres[n % 4])
+            for n in range(200)
+        ])
+        stock = AvailBooks.objects.bulk_create([AvailBooks(book=book, total_books=5, available_books=4) for book in cls.books])
+        started = now() - timedelta(days=30)
+        # bulk_create skips the circulation signals, only the rows matter here
+        loans = UserBorrowed.objects.bulk_create([
+            UserBorrowed(user=cls.members[n % 20], book=stock[n % 200]) for n in range(400)
+        ])
+        LateFees.objects.bulk_create([LateFees(user_borrowed=loan, fee=n % 7 * 50) for n, loan in enumerate(loans)])
+        UserHistory.objects.bulk_create([
+            UserHistory(user=cls.members[n % 20], book=cls.books[n % 200], borrow_date=started + timedelta(hours=n),
+                        return_date=started + timedelta(hours=n + 30), on_time=True)
+            for n in range(2000)
+        ])
+        Rating.objects.bulk_create([
+            Rating(user=member, book=book, rating=3)
+            for member in cls.members for book in cls.books[::4]
+        ])
+        Request.objects.bulk_create([
+            Request(user=cls.members[n % 20], isbn=f'979{n % 150:010d}', title='Wanted') for n in range(600)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        for line in plan.splitlines():
+            self.assertFalse('SCAN ' in line and 'USING' not in line, f"Full table scan:\n{plan}")
+        self.assertNotIn('USE TEMP B-TREE', plan)
+
+    def test_history_page(self):
+        queryset = (
+            UserHistory.objects.filter(user=self.members[3]).select_related('book')
+            .order_by('-borrow_date', '-id')[:11]
+        )
+        self.assertUsesIndex(queryset, 'history_user_borrow_idx')
+
+    def test_earliest_return(self):
+        queryset = UserBorrowed.objects.filter(book__book=self.books[7]).order_by('borrow_date').values('borrow_date')[:1]
+        self.assertUsesIndex(queryset, 'borrowed_book_date_idx')
+
+    def test_reviews_page(self):
+        queryset = (
+            Rating.objects.filter(book=self.books[8]).select_related('user__user')
+            .order_by('-created_at', '-id')[:11]
+        )
+        self.assertUsesIndex(queryset, 'rating_book_created_idx')
+
+    def test_late_fees_by_amount(self):
+        self.assertUsesIndex(LateFees.objects.filter(fee__gt=0).order_by('-fee')[:100], 'latefees_fee_idx')
+
+    def test_requests_by_isbn(self):
+        self.assertUsesIndex(Request.objects.filter(isbn='9790000000042'), 'request_isbn_idx')
+
+    def test_genre_shelf(self):
+        self.assertUsesIndex(BookMain.objects.filter(genre='History').order_by('title')[:25], 'bookmain_genre_title_idx')
+
+
+# Fraction of the full seed_dataset volumes (100k books, 50k members, 1M
+# history rows) the budget tests run against; LIBRARY_PERF_SCALE=1 for full size
+PERF_SCALE = float(os.environ.get('LIBRARY_PERF_SCALE', '0.02'))
+# Wall clock budgets are asserted at full size or with LIBRARY_PERF_TIMINGS=1,
+# and only reported otherwise: a small run on a busy machine is mostly noise
+ASSERT_TIMINGS = PERF_SCALE >= 1 or os.environ.get('LIBRARY_PERF_TIMINGS') == '1'
+
+
+# Periodic work (refreshing the cached member, recording last activity) is
+# amortised over many requests and kept out of the per-request budget
+@override_settings(LIBRARY_MEMBER_CACHE_TTL=3600, LIBRARY_ACTIVITY_GRANULARITY=3600)
+class MemberViewBudgetTests(TestCase):
+    """
+    Every member-facing page against a seed_dataset library: a fixed ceiling
+    on queries per request, so nothing grows with the data, and on the p95
+    time of warm requests (see ASSERT_TIMINGS).
+    """
+    REQUESTS = 20
+    # Page: (max queries, p95 milliseconds). Two of the queries are always
+    # the session and auth user; budgets hold at LIBRARY_PERF_SCALE=1
+    BUDGETS = {
+        'home': (5, 100),
+        'search': (4, 150),
+        'search_term': (4, 150),
+        'search_cursor': (3, 150),
+        'detail': (5, 100),
+        'reviews': (4, 75),
+        'history': (4, 75),
+        'borrow': (3, 75),
+        'late': (3, 75),
+        'profile': (2, 50),
+        'credits': (2, 50),
+        'request': (2, 150),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'seed_dataset',
+            books=int(100_000 * PERF_SCALE),
+            members=int(50_000 * PERF_SCALE),
+            history=int(1_000_000 * PERF_SCALE),
+            ratings=int(200_000 * PERF_SCALE),
+            loans=int(30_000 * PERF_SCALE),
+            seed=1,
+            stdout=StringIO(),
+        )
+        # A member with something on every page: loans, fees and history
+        cls.member = LibraryUser.objects.filter(
+            Exists(LateFees.objects.filter(user_borrowed__user=OuterRef('pk'), fee__gt=0)),
+            Exists(UserHistory.objects.filter(user=OuterRef('pk'))),
+        ).select_related('user').first()
+        # The most reviewed book, so the detail page has a full page of reviews
+        cls.book = BookMain.objects.order_by('-rating_count').first()
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.timings = {}  # budget -> p95 ms, when not asserted
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.timings:
+            report = ', '.join(f'{budget} {p95:.1f}ms' for budget, p95 in sorted(cls.timings.items()))
+            sys.stderr.write(f"\nMember view p95 at LIBRARY_PERF_SCALE={PERF_SCALE} (not asserted): {report}\n")
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client.force_login(self.member.user)
+
+    def url(self, name, **kwargs):
+        return reverse(f'libraryweb:{name}', kwargs={'lib_num': self.member.lib_num, **kwargs})
+
+    def assertWithinBudget(self, budget, url, params=None):
+        max_queries, p95_ms = self.BUDGETS[budget]
+        self.client.get(url, params)  # warm the member and fragment caches
+        timings = []
+        for _ in range(self.REQUESTS):
+            with CaptureQueriesContext(connection) as queries:
+                started = perf_counter()
+                response = self.client.get(url, params)
+                timings.append((perf_counter() - started) * 1000)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(queries), max_queries, f"{budget} ran {len(queries)} queries")
+        p95 = quantiles(timings, n=20)[-1]
+        if ASSERT_TIMINGS:
+            self.assertLessEqual(p95, p95_ms, f"{budget} p95 was {p95:.1f}ms")
+        else:
+            self.timings[budget] = p95
+        return response
+
+    def test_home(self):
+        self.assertWithinBudget('home', self.url('home'))
+
+    def test_search(self):
+        self.assertWithinBudget('search', self.url('search'))
+
+    def test_search_term(self):
+        self.assertWithinBudget('search_term', self.url('search'), {'query': 'Golden'})
+
+    def test_search_next_page(self):
+        page = self.client.get(self.url('search'), {'query': 'Golden'}).context['page_obj']
+        self.assertTrue(page.has_next())
+        self.assertWithinBudget('search_cursor', self.url('search'), {'query': 'Golden', 'cursor': page.next_token})
+
+    def test_detail(self):
+        self.assertWithinBudget('detail', self.url('detail', isbn=self.book.isbn))
+
+    def test_reviews(self):
+        page = self.client.get(self.url('detail', isbn=self.book.isbn)).context['reviews']
+        self.assertTrue(page.has_next())
+        self.assertWithinBudget('reviews', self.url('reviews', isbn=self.book.isbn), {'cursor': page.next_token})
+
+    def test_history(self):
+        self.assertWithinBudget('history', self.url('history'))
+
+    def test_borrowed(self):
+        self.assertWithinBudget('borrow', self.url('borrow'))
+
+    def test_late_fees(self):
+        response = self.assertWithinBudget('late', self.url('late'))
+        self.assertTrue(response.context['late_fees'])
+
+    def test_profile(self):
+        self.assertWithinBudget('profile', self.url('profile'))
+
+    def test_credits(self):
+        self.assertWithinBudget('credits', self.url('credits'))
+
+    def test_request_form(self):
+        self.assertWithinBudget('request', self.url('request'))
+
+
+class AsgiCatalogueTests(TestCase):
+    """
+    The sync views and middleware served through the ASGI handler.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = make_member('async-reader')
+        cls.book = BookMain.objects.create(isbn='9780000000002', title='Solaris', author='Stanislaw Lem', genre='Sci-Fi')
+        AvailBooks.objects.create(book=cls.book, total_books=2, available_books=2)
+
+    def setUp(self):
+        self.async_client.force_login(self.member.user)
+
+    def url(self, name, **kwargs):
+        return reverse(f'libraryweb:{name}', kwargs={'lib_num': self.member.lib_num, **kwargs})
+
+    async def test_catalogue_pages(self):
+        response = await self.async_client.get(self.url('home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(self.book, response.context['popular_books'])
+
+        response = await self.async_client.get(self.url('search'), {'query': 'solaris'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['page_obj']), [self.book])
+
+        response = await self.async_client.get(self.url('detail', isbn=self.book.isbn))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['bookdetail'], self.book)
+
+    async def test_rating_submission(self):
+        url = self.url('detail', isbn=self.book.isbn)
+        response = await self.async_client.post(url, {'rating': 5, 'review': 'Strange and good'})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        self.assertTrue(await Rating.objects.filter(user=self.member, book=self.book, rating=5).aexists())
+
+    async def test_inactive_session_is_signed_out(self):
+        self.addCleanup(presence.discard, self.member.user_id)
+        session = await self.async_client.asession()
+        await session.aset('last_activity', (now() - timedelta(minutes=10)).isoformat())
+        await session.asave()
+        response = await self.async_client.get(self.url('home'))
+        self.assertRedirects(response, reverse('libraryweb:signin'), fetch_redirect_response=False)
+        self.assertTrue(presence.is_pending(self.member.user_id))
+
+
+class LibraryUserMiddlewareTests(TestCase):
+    PAGES = ['home', 'search', 'history', 'borrow', 'late', 'credits', 'request']
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = make_member('resolved')
+
+    def setUp(self):
+        self.client.force_login(self.member.user)
+        library_users.clear()
+
+    def test_member_resolved_once_per_request(self):
+        for page in self.PAGES:
+            library_users.clear()
+            with self.subTest(page=page), mock.patch.object(library_users, 'get', wraps=library_users.get) as lookup:
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse(f'libraryweb:{page}', kwargs={'lib_num': self.member.lib_num}))
+                self.assertEqual(response.status_code, 200)
+                lookup.assert_called_once_with(self.member.lib_num)
+                self.assertEqual(response.wsgi_request.library_user, self.member)
+                # One query for the member, with the User joined
+                member_queries = [query['sql'] for query in queries if 'FROM "libraryweb_libraryuser"' in query['sql']]
+                self.assertEqual(len(member_queries), 1, member_queries)
+                self.assertIn('INNER JOIN "auth_user"', member_queries[0])
+
+    def test_unknown_member_and_paths_without_lib_num(self):
+        response = self.client.get(reverse('libraryweb:home', kwargs={'lib_num': '2000LIB9999'}))
+        self.assertRedirects(response, reverse('libraryweb:signout'), fetch_redirect_response=False)
+        self.assertIsNone(response.wsgi_request.library_user)
+        response = self.client.get(reverse('libraryweb:signin'))
+        self.assertIsNone(response.wsgi_request.library_user)
+
+
+class PresenceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = make_member('visitor')
+
+    def assertActive(self, active):
+        self.assertEqual(User.objects.get(pk=self.member.user_id).is_active, active)
+        self.assertEqual(LibraryUser.objects.get(pk=self.member.pk).is_active, active)
+
+    def test_sign_out_is_written_straight_away(self):
+        self.client.force_login(self.member.user)
+        self.client.get(reverse('libraryweb:signout'))
+        self.assertActive(False)
+        self.assertFalse(presence.is_pending(self.member.user_id))
+
+    @override_settings(LIBRARY_PRESENCE_FLUSH_INTERVAL=3)
+    def test_timeouts_are_flushed_by_a_timer(self):
+        self.addCleanup(presence.discard, self.member.user_id)
+        presence.mark_inactive(self.member.user_id)
+        timer = presence._timer
+        self.assertEqual(timer.interval, 3)
+        # Run the timer's flush here, where the test transaction is visible
+        timer.cancel()
+        timer.function()
+        self.assertActive(False)
+        self.assertFalse(presence.is_pending(self.member.user_id))
+
+    def test_signing_in_again_cancels_the_timeout(self):
+        presence.mark_inactive(self.member.user_id)
+        presence.discard(self.member.user_id)
+        self.assertIsNone(presence._timer)
+        self.assertEqual(presence.flush(), 0)
+        self.assertActive(True)
+
+
+class BookVersionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = make_member('editor')
+        cls.book = BookMain.objects.create(isbn='9780000000003', title='Ubik', author='Philip K. Dick', genre='Sci-Fi')
+
+    def test_stale_save_keeps_version_and_rating_totals(self):
+        stale = BookMain.objects.get(pk=self.book.pk)
+        BookMain.bump_versions([self.book.pk])
+        Rating.objects.create(user=self.member, book=self.book, rating=4)
+        current = BookMain.objects.get(pk=self.book.pk)
+
+        stale.title = 'Ubik (reissue)'
+        stale.save()
+        self.assertEqual(stale.version, current.version + 1)
+        saved = BookMain.objects.get(pk=self.book.pk)
+        self.assertEqual(saved.title, 'Ubik (reissue)')
+        self.assertEqual(saved.version, current.version + 1)
+        self.assertEqual((saved.rating_sum, saved.rating_count, saved.avg_rating), (4, 1, 4.0))
+
+    def test_update_fields_save_bumps_version(self):
+        version = self.book.version
+        self.book.genre = 'Fiction'
+        self.book.save(update_fields=['genre'])
+        self.assertEqual(BookMain.objects.get(pk=self.book.pk).version, version + 1)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.dune = BookMain.objects.create(isbn='9780000000004', title='Dune', author='Frank Herbert', genre='Sci-Fi')
+        cls.emma = BookMain.objects.create(isbn='9780000000005', title='Emma', author='Jane Austen', genre='Classic')
+
+    def search(self, query):
+        return list(search_books(BookMain.objects.annotate(borrowed_count=Value(0)), query))
+
+    def test_blank_query_lists_every_book(self):
+        self.assertCountEqual(self.search(''), [self.dune, self.emma])
+        self.assertCountEqual(self.search('  '), [self.dune, self.emma])
+
+    def test_query_without_words_matches_nothing(self):
+        self.assertEqual(self.search('!!!'), [])
+        self.assertEqual(self.search('"*'), [])
+
+    def test_prefix_terms(self):
+        self.assertEqual(self.search('frank du'), [self.dune])
+
+
+class BulkReturnTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.members = [make_member(f'borrower{n}') for n in range(2)]
+        cls.stock = [
+            AvailBooks.objects.create(
+                book=BookMain.objects.create(isbn=f'97800000001{n:02d}', title=f'Book {n}', author='A. Writer', genre='Fiction'),
+                total_books=4,
+                available_books=4,
+            )
+            for n in range(2)
+        ]
+
+    def lend(self, members):
+        loans = [checkout(member, stock) for member in members for stock in self.stock]
+        # One overdue loan, so history has a late return and a fee is removed
+        UserBorrowed.objects.filter(pk=loans[0].pk).update(borrow_date=now() - timedelta(days=5))
+        call_command('update_late_fees', stdout=StringIO())
+        return list(UserBorrowed.objects.filter(pk__in=[loan.pk for loan in loans]))
+
+    def state_after(self, give_back):
+        with transaction.atomic():
+            loans = self.lend(self.members)
+            for member in self.members:
+                library_users.get(member.lib_num)
+            with self.captureOnCommitCallbacks(execute=True):
+                give_back(loans)
+            state = {
+                'history': sorted(UserHistory.objects.values_list('user_id', 'book_id', 'on_time')),
+                'stock': list(AvailBooks.objects.order_by('pk').values_list('available_books', flat=True)),
+                'late_fees': list(LateFees.objects.values_list('pk', flat=True)),
+                'loans': list(UserBorrowed.objects.values_list('pk', flat=True)),
+                'leaderboard': list(PopularBook.objects.order_by('position').values_list('book_id', 'borrowed_count')),
+                'cached_members': [member.lib_num in library_users._entries for member in self.members],
+            }
+            transaction.set_rollback(True)
+        return state
+
+    def test_bulk_return_matches_single_returns(self):
+        def one_by_one(loans):
+            for loan in loans:
+                return_book(loan)
+
+        single = self.state_after(one_by_one)
+        bulk = self.state_after(return_books)
+        self.assertEqual(bulk, single)
+        self.assertEqual(len(bulk['history']), 4)
+        self.assertIn(False, [on_time for _, _, on_time in bulk['history']])
+        self.assertEqual(bulk['stock'], [4, 4])
+        self.assertEqual((bulk['late_fees'], bulk['loans']), ([], []))
+
+    def test_query_count_is_fixed_per_title(self):
+        # Claim, read, an UPDATE per title, history INSERT, two DELETEs and
+        # the version bump, inside a savepoint
+        for members in (self.members[:1], self.members):
+            loans = self.lend(members)
+            with self.assertNumQueries(6 + len(self.stock) + 2):
+                self.assertEqual(return_books(loans), len(loans))
+
+
+class LibNumCounterTests(TestCase):
+    def add_member(self, username, lib_num):
+        user = User.objects.create_user(username=username, password='test-pass-123')
+        return LibraryUser.objects.create(user=user, lib_num=lib_num)
+
+    def test_first_allocation_starts_after_the_highest_issued(self):
+        self.add_member('early', '2026LIB0041')
+        self.add_member('late', '2026LIB10000')  # Past four digits, so not the highest as text
+        self.add_member('last-year', '2025LIB20000')
+        self.assertEqual(LibNumCounter.allocate(2026), 10001)
+        self.assertEqual(LibNumCounter.allocate(2025), 20001)
+
+    def test_blocks_do_not_overlap(self):
+        first = LibNumCounter.allocate(2026, 5)
+        second = LibNumCounter.allocate(2026, 3)
+        third = LibNumCounter.allocate(2026)
+        self.assertEqual((first, second, third), (1, 6, 9))
+        self.assertEqual(LibNumCounter.objects.get(year=2026).last_number, 9)
+
+    def test_year_rollover(self):
+        with mock.patch('libraryweb.models.now', return_value=datetime(2026, 12, 31, 23, 59, tzinfo=dt_timezone.utc)):
+            self.assertEqual(make_member('december').lib_num, '2026LIB0001')
+        with mock.patch('libraryweb.models.now', return_value=datetime(2027, 1, 1, tzinfo=dt_timezone.utc)):
+            self.assertEqual(make_member('january').lib_num, '2027LIB0001')
+            self.assertEqual(make_member('january-too').lib_num, '2027LIB0002')
+        self.assertEqual(LibNumCounter.objects.get(year=2026).last_number, 1)
+
+    def test_enrol_members_reserves_one_block_per_batch(self):
+        make_member('walk-in')
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'members.csv')
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                f.write('username,email\nada,ada@example.com\ngrace,grace@example.com\nada,again@example.com\nalan,alan@example.com\n')
+            with CaptureQueriesContext(connection) as queries:
+                call_command('enrol_members', path, batch_size=10, stdout=StringIO())
+        allocations = [query for query in queries if 'libraryweb_libnumcounter' in query['sql'] and query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(allocations), 1)
+        year = now().year
+        lib_nums = dict(LibraryUser.objects.values_list('user__username', 'lib_num'))
+        self.assertEqual(lib_nums['walk-in'], LibraryUser.format_lib_num(year, 1))
+        self.assertEqual(
+            sorted(lib_nums[name] for name in ('ada', 'grace', 'alan')),
+            [LibraryUser.format_lib_num(year, number) for number in (2, 3, 4)],
+        )
+        self.assertEqual(make_member('after').lib_num, LibraryUser.format_lib_num(year, 5))
+
+
+class SeedInventoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = {
+            isbn: BookMain.objects.create(isbn=isbn, title=f'Title {isbn}', author='Author', genre=genre)
+            for isbn, genre in [('9780000000301', 'Fiction'), ('9780000000302', 'Poetry'), ('9780000000303', 'Fiction'), ('9780000000304', 'History')]
+        }
+        AvailBooks.objects.create(book=cls.books['9780000000304'], total_books=2, available_books=1)
+
+    def seed(self, *args):
+        out = StringIO()
+        call_command('seed_inventory', *args, stdout=out)
+        return out.getvalue()
+
+    def copies(self):
+        return dict(AvailBooks.objects.values_list('book__isbn', 'total_books'))
+
+    def test_copies_by_csv_genre_and_default(self):
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'copies.csv')
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                f.write('isbn,copies\n9780000000303,7\n')
+            output = self.seed('--copies', '3', '--genre-copies', 'poetry=5', '--genre-copies', 'Fiction=4', '--csv', path)
+        self.assertIn('Populated AvailBooks for 3 books.', output)
+        self.assertEqual(self.copies(), {'9780000000301': 4, '9780000000302': 5, '9780000000303': 7, '9780000000304': 2})
+        self.assertEqual(AvailBooks.objects.get(book__isbn='9780000000301').available_books, 4)
+
+    def test_rerun_only_adds_missing_rows(self):
+        self.seed()
+        before = list(AvailBooks.objects.order_by('pk').values())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIn('Populated AvailBooks for 0 books.', self.seed('--copies', '99'))
+        # One anti-join, nothing written
+        self.assertEqual([query['sql'].split()[0] for query in queries if 'SAVEPOINT' not in query['sql']], ['SELECT'])
+        self.assertEqual(list(AvailBooks.objects.order_by('pk').values()), before)
+
+        BookMain.objects.create(isbn='9780000000305', title='New', author='Author', genre='Poetry')
+        self.assertIn('Populated AvailBooks for 1 books.', self.seed('--copies', '6'))
+        self.assertEqual(self.copies()['9780000000305'], 6)
+        self.assertEqual(self.copies()['9780000000301'], 10)
+
+    def test_bad_genre_copies(self):
+        with self.assertRaises(CommandError):
+            self.seed('--genre-copies', 'Fiction')
+
+
+class CatalogueImportTests(TestCase):
+    def setUp(self):
+        media = TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.media = media.name
+        client = StubClient()
+        self.books = [normalise_record(record, genre='Fiction') for record in client.search('tide', limit=3)]
+        self.importer = CatalogueImporter(client, workers=2)
+
+    def media_files(self):
+        return [name for _, _, names in os.walk(self.media) for name in names]
+
+    def test_import_batch(self):
+        self.assertEqual(self.importer.import_batch(self.books), 3)
+        self.assertEqual(BookMain.objects.filter(cover_derivatives=True).count(), 3)
+        # The original and every derivative of each cover
+        self.assertEqual(len(self.media_files()), 3 * 7)
+
+    def test_failed_batch_leaves_no_covers(self):
+        with mock.patch.object(BookMain.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.importer.import_batch(self.books)
+        self.assertEqual(self.media_files(), [])
+        self.assertEqual(self.importer.import_batch(self.books), 3)
+
+
+class CoverDerivativeTests(TestCase):
+    def setUp(self):
+        media = TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.cover = StubClient().cover(1)
+
+    def add_book(self, cover):
+        return BookMain.objects.create(
+            isbn='9780000000006', title='Kindred', author='Octavia E. Butler', genre='Fiction',
+            cover_image=default_storage.save('book_covers/kindred.jpg', ContentFile(cover)),
+        )
+
+    def test_original_is_shown_until_derivatives_are_written(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            book = self.add_book(self.cover)
+        with mock.patch.object(default_storage, 'exists') as exists, mock.patch.object(default_storage, 'open') as storage_open:
+            sources = book_cover(book)['sources']
+            exists.assert_not_called()
+            storage_open.assert_not_called()
+        self.assertEqual(sources['src'], book.cover_image.url)
+        self.assertEqual(sources['webp_srcset'], '')
+
+        for callback in callbacks:
+            callback()
+        book = BookMain.objects.get(pk=book.pk)
+        self.assertTrue(book.cover_derivatives)
+        # Cached cards that showed the original are invalidated
+        self.assertEqual(book.version, 1)
+        sources = book_cover(book)['sources']
+        self.assertIn('-card.jpg', sources['src'])
+        self.assertIn('-detail.webp 480w', sources['webp_srcset'])
+
+    def test_unreadable_cover_keeps_the_original(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            book = self.add_book(b'not an image')
+        book = BookMain.objects.get(pk=book.pk)
+        self.assertFalse(book.cover_derivatives)
+        self.assertEqual(book_cover(book)['sources']['src'], book.cover_image.url)
+
+    def test_derivatives_are_only_made_when_the_cover_changes(self):
+        with mock.patch('libraryweb.signals.generate_derivatives', return_value=6) as generate:
+            with self.captureOnCommitCallbacks(execute=True):
+                book = self.add_book(self.cover)
+            generate.assert_called_once_with(book.cover_image.name)
+
+            generate.reset_mock()
+            book = BookMain.objects.get(pk=book.pk)
+            book.title = 'Kindred (25th anniversary)'
+            with self.captureOnCommitCallbacks(execute=True):
+                book.save()
+                book.save()
+            generate.assert_not_called()
+            self.assertTrue(BookMain.objects.get(pk=book.pk).cover_derivatives)
+
+            book.cover_image = default_storage.save('book_covers/kindred-new.jpg', ContentFile(self.cover))
+            with self.captureOnCommitCallbacks() as callbacks:
+                book.save()
+            self.assertFalse(BookMain.objects.get(pk=book.pk).cover_derivatives)
+            for callback in callbacks:
+                callback()
+            generate.assert_called_once_with(book.cover_image.name)
+            self.assertTrue(BookMain.objects.get(pk=book.pk).cover_derivatives)
+
+
+class AdminChangelistTests(TestCase):
+    """
+    Every changelist runs the same number of queries at any row count.
+    """
+    # Queries for a warm changelist page: session, user, the estimated count
+    # and the page, plus the values of a list_filter on a plain field
+    QUERIES = {
+        'libraryuser': 4 + 1,
+        'bookmain': 4 + 2,
+        'availbooks': 4 + 2,
+        'userborrowed': 4 + 1,
+        'userhistory': 4 + 1,
+        'latefees': 4 + 2,
+        'request': 4 + 1,
+        'rating': 4 + 2,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('librarian', password='test-pass-123')
+        cls.rows = 0
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def add_rows(self, count):
+        start = self.rows
+        for n in range(start, start + count):
+            member = make_member(f'patron{n}')
+            book = BookMain.objects.create(isbn=f'97800000002{n:02d}', title=f'Title {n}', author=f'Author {n}', genre=f'Genre {n % 3}')
+            stock = AvailBooks.objects.create(book=book, total_books=2, available_books=2)
+            return_book(checkout(member, stock))
+            checkout(member, stock)
+            Request.objects.create(user=member, isbn=book.isbn, title=book.title, author=book.author)
+            Rating.objects.create(user=member, book=book, rating=n % 5 + 1, review='Fine')
+        self.rows += count
+
+    def test_query_count_does_not_grow_with_rows(self):
+        for rows in (2, 8):
+            self.add_rows(rows - self.rows)
+            for model, expected in self.QUERIES.items():
+                with self.subTest(model=model, rows=rows):
+                    url = reverse(f'admin:libraryweb_{model}_changelist')
+                    self.client.get(url)  # warm the content types and member caches
+                    with self.assertNumQueries(expected):
+                        response = self.client.get(url)
+                    self.assertEqual(len(response.context['cl'].result_list), rows)
+
+
+class CaseInsensitiveMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.middleware = CaseInsensitiveMiddleware(lambda request: HttpResponse('view'))
+
+    def test_redirects_to_title_cased_path(self):
+        response = self.middleware(self.factory.get('/Library/guest/search/'))
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], '/Library/Guest/Search/')
+
+    def test_redirect_keeps_query_string(self):
+        response = self.middleware(self.factory.get('/Library/guest/search/', {'q': 'dune messiah', 'page': '2'}))
+        self.assertEqual(response.status_code, 301)
+        self.assertEqual(response['Location'], '/Library/Guest/Search/?q=dune+messiah&page=2')
+
+    def test_canonical_excluded_and_unknown_paths_pass_through(self):
+        for path in ('/Library/Signin/', '/Library/2024LIB0001/home/', '/admin/login/', '/static/css/base.css', '/no/such/page/'):
+            with self.subTest(path=path):
+                self.assertEqual(self.middleware(self.factory.get(path)).content, b'view')
+
+    @override_settings(LIBRARY_CANONICAL_PATH_CACHE_SIZE=2)
+    def test_path_cache_is_bounded_and_reused(self):
+        middleware = CaseInsensitiveMiddleware(lambda request: HttpResponse('view'))
+        with mock.patch('libraryweb.middleware.resolve', wraps=resolve) as resolver:
+            for path in ('/Library/a/search/', '/Library/a/search/', '/Library/b/search/', '/Library/c/search/'):
+                self.assertEqual(middleware(self.factory.get(path)).status_code, 301)
+        self.assertEqual(resolver.call_count, 3)
+        info = middleware.canonical_path.cache_info()
+        self.assertEqual((info.hits, info.maxsize, info.currsize), (1, 2, 2))
+
+
+class FileServingTests(SimpleTestCase):
+    CONTENT = bytes(range(100))
+
+    def setUp(self):
+        root = TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.root = root.name
+        with open(os.path.join(self.root, 'cover.jpg'), 'wb') as f:
+            f.write(self.CONTENT)
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        request = self.factory.get('/media/cover.jpg', headers=headers)
+        return serve_file(request, 'cover.jpg', document_root=self.root)
+
+    def validators(self):
+        response = self.get()
+        response.close()
+        return response['ETag'], response['Last-Modified']
+
+    def body(self, response):
+        body = b''.join(response.streaming_content)
+        response.close()
+        return body
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 10))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 10))
+        self.assertEqual(parse_range('bytes=95-200', 100), (95, 5))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 10))
+        self.assertEqual(parse_range('bytes=-500', 100), (0, 100))
+        # Malformed or multiple ranges are ignored, the whole file is sent
+        for header in ('bytes=-', 'bytes=a-b', 'items=0-9', 'bytes=0-1,5-6'):
+            self.assertIsNone(parse_range(header, 100), header)
+        for header in ('bytes=100-', 'bytes=50-40', 'bytes=-0'):
+            self.assertIs(parse_range(header, 100), False, header)
+
+    def test_full_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        self.assertEqual(self.body(response), self.CONTENT)
+
+    def test_single_range(self):
+        response = self.get(range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(self.body(response), self.CONTENT[10:20])
+
+    def test_suffix_range(self):
+        response = self.get(range='bytes=-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 95-99/100')
+        self.assertEqual(self.body(response), self.CONTENT[95:])
+
+    def test_malformed_range_sends_the_whole_file(self):
+        response = self.get(range='bytes=oops')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.body(response), self.CONTENT)
+
+    def test_unsatisfiable_range(self):
+        response = self.get(range='bytes=100-120')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_if_none_match(self):
+        etag, _ = self.validators()
+        response = self.get(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.body(self.get(if_none_match='"stale"')), self.CONTENT)
+
+    def test_if_modified_since(self):
+        _, last_modified = self.validators()
+        self.assertEqual(self.get(if_modified_since=last_modified).status_code, 304)
+        mtime = os.stat(os.path.join(self.root, 'cover.jpg')).st_mtime
+        self.assertEqual(self.body(self.get(if_modified_since=http_date(mtime - 60))), self.CONTENT)
+
+    def test_if_range(self):
+        for validator in self.validators():
+            response = self.get(range='bytes=0-9', if_range=validator)
+            self.assertEqual(response.status_code, 206, validator)
+            response.close()
+        # A changed file makes the range stale: the whole file is sent
+        for validator in ('"stale"', http_date(0)):
+            response = self.get(range='bytes=0-9', if_range=validator)
+            self.assertEqual(response.status_code, 200, validator)
+            self.assertEqual(self.body(response), self.CONTENT)
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Few distinct ratings and titles, so most sort keys tie
+        member = make_member('critic')
+        for n in range(23):
+            book = BookMain.objects.create(
+                isbn=f'97800000003{n:02d}', title=f'Ocean {n % 4}', author='Ocean Writer', genre='Sea',
+            )
+            Rating.objects.create(user=member, book=book, rating=n % 3 + 1)
+
+    def walk(self, paginator):
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_token))
+        return pages
+
+    def assertWalksAllRows(self, queryset, per_page=5):
+        paginator = KeysetPaginator(queryset, per_page)
+        expected = list(queryset.order_by(*paginator.ordering))
+        pages = self.walk(paginator)
+        self.assertEqual([book for page in pages for book in page], expected)
+        self.assertEqual(len(pages), -(-len(expected) // per_page))
+        self.assertFalse(pages[0].has_previous())
+
+        # And back again from the last page
+        back = [pages[-1]]
+        while back[-1].has_previous():
+            back.append(paginator.page(back[-1].previous_token))
+        self.assertEqual([list(page) for page in reversed(back)], [list(page) for page in pages])
+        return pages
+
+    def test_forward_and_back_with_tied_keys(self):
+        self.assertWalksAllRows(BookMain.objects.order_by('-avg_rating', 'title'))
+
+    def test_ties_on_every_key_fall_back_to_the_primary_key(self):
+        paginator = KeysetPaginator(BookMain.objects.order_by('genre'), 5)
+        self.assertEqual(paginator.ordering, ['genre', 'id'])
+        self.assertWalksAllRows(BookMain.objects.order_by('genre'))
+
+    def test_search_ordering_on_a_float_score(self):
+        queryset = search_books(
+            BookMain.objects.annotate(borrowed_count=Coalesce(F('availability__total_books'), 0)), 'ocean',
+        )
+        self.assertIn('-search_score', KeysetPaginator(queryset, 5).ordering)
+        pages = self.assertWalksAllRows(queryset)
+        self.assertIsInstance(pages[0].object_list[0].search_score, float)
+
+    def test_tampered_cursor_shows_the_first_page(self):
+        paginator = KeysetPaginator(BookMain.objects.order_by('title'), 5)
+        first = paginator.page()
+        tampered = first.next_token[:-2] + ('AA' if not first.next_token.endswith('AA') else 'BB')
+        for token in (tampered, 'garbage', ''):
+            self.assertEqual(list(paginator.page(token)), list(first), token)
+
+    def test_cursor_for_another_ordering_shows_the_first_page(self):
+        token = KeysetPaginator(BookMain.objects.order_by('-avg_rating', 'title'), 5).page().next_token
+        paginator = KeysetPaginator(BookMain.objects.order_by('title'), 5)
+        self.assertEqual(list(paginator.page(token)), list(paginator.page()))
+
+    def test_cursor_outlives_its_row(self):
+        paginator = KeysetPaginator(BookMain.objects.order_by('title'), 5)
+        first = paginator.page()
+        expected = list(paginator.page(first.next_token))
+        first.object_list[-1].delete()
+        self.assertEqual(list(paginator.page(first.next_token)), expected)
+
+
+class LateFeeTests(TestCase):
+    """
+    The set-based recompute against LateFees.calculate_fees(), the per-row
+    path it replaced.
+    """
+    # Evening of a US daylight saving change and past midnight in India
+    CURRENT_TIME = datetime(2026, 3, 8, 19, 30, 0, 250000, tzinfo=dt_timezone.utc)
+    # How long before CURRENT_TIME each loan was borrowed, and its days late
+    LOANS = [
+        (timedelta(hours=-1), 0),  # borrow_date in the future
+        (timedelta(0), 0),
+        (timedelta(days=1), 0),
+        (timedelta(days=3, microseconds=-1), 0),
+        (timedelta(days=3), 0),  # due this instant
+        (timedelta(days=3, microseconds=1), 0),
+        (timedelta(days=4, microseconds=-1), 0),
+        (timedelta(days=4), 1),
+        (timedelta(days=4, microseconds=1), 1),
+        (timedelta(days=10, hours=23, minutes=59, seconds=59), 7),
+        (timedelta(days=11), 8),
+        (timedelta(days=400, microseconds=-250000), 396),
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        member = make_member('late-reader')
+        book = BookMain.objects.create(isbn='9780000000701', title='Overdue', author='D. Writer', genre='Fiction')
+        stock = AvailBooks.objects.create(book=book, total_books=len(cls.LOANS), available_books=len(cls.LOANS))
+        # bulk_create skips the circulation signals and leaves gaps in the ids
+        cls.loans = UserBorrowed.objects.bulk_create([UserBorrowed(user=member, book=stock) for _ in cls.LOANS])
+        for loan, (age, _) in zip(cls.loans, cls.LOANS):
+            UserBorrowed.objects.filter(pk=loan.pk).update(borrow_date=cls.CURRENT_TIME - age)
+        LateFees.objects.bulk_create([LateFees(id=n * 7 + 3, user_borrowed=loan) for n, loan in enumerate(cls.loans)])
+
+    def fees(self):
+        return list(LateFees.objects.order_by('user_borrowed_id').values_list('days_late', 'fee'))
+
+    def per_row_fees(self):
+        with mock.patch('libraryweb.models.now', return_value=self.CURRENT_TIME):
+            recompute_late_fees_per_row()
+        fees = self.fees()
+        LateFees.objects.update(days_late=0, fee=0)
+        return fees
+
+    def test_matches_calculate_fees(self):
+        expected = [(days, days * LateFees.FEE_PER_DAY) for _, days in self.LOANS]
+        self.assertEqual(self.per_row_fees(), expected)
+        for time_zone, current_time in (
+            ('UTC', self.CURRENT_TIME),
+            ('America/New_York', self.CURRENT_TIME.astimezone(ZoneInfo('America/New_York'))),
+            ('Asia/Kolkata', self.CURRENT_TIME.astimezone(ZoneInfo('Asia/Kolkata'))),
+        ):
+            with self.subTest(time_zone=time_zone), override_settings(TIME_ZONE=time_zone):
+                recompute_late_fees(chunk_size=5, current_time=current_time)
+                self.assertEqual(self.fees(), expected)
+                LateFees.objects.update(days_late=0, fee=0)
+
+    def test_chunks_by_row_not_by_id(self):
+        stats = recompute_late_fees(chunk_size=5, dry_run=True, current_time=self.CURRENT_TIME)
+        self.assertEqual((stats['days_changed'], stats['fees_changed']), (5, 5))
+        self.assertEqual(stats['outstanding'], 0)
+
+        stats = recompute_late_fees(chunk_size=5, current_time=self.CURRENT_TIME)
+        # 12 rows spread over ids 3..80 take three chunks, none of them empty
+        self.assertEqual(stats['chunks'], 3)
+        self.assertEqual(stats['scanned'], len(self.LOANS))
+        self.assertEqual(stats['days_changed'], 5)
+
+        stats = recompute_late_fees(chunk_size=5, current_time=self.CURRENT_TIME)
+        self.assertEqual((stats['days_changed'], stats['fees_changed']), (0, 0))
+        self.assertEqual(stats['outstanding'], sum(days for _, days in self.LOANS) * LateFees.FEE_PER_DAY)
+
+
+class CheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = make_member('lender')
+        cls.stock = [
+            AvailBooks.objects.create(
+                book=BookMain.objects.create(isbn=f'97800000004{n:02d}', title=f'Copy {n}', author='B. Writer', genre='Fiction'),
+                total_books=1,
+                available_books=1,
+            )
+            for n in range(UserBorrowed.MAX_LOANS + 1)
+        ]
+
+    def available(self, stock):
+        return AvailBooks.objects.get(pk=stock.pk).available_books
+
+    def test_take_copy(self):
+        stock = self.stock[0]
+        self.assertTrue(AvailBooks.take_copy(stock.pk))
+        self.assertEqual(self.available(stock), 0)
+        self.assertFalse(AvailBooks.take_copy(stock.pk))
+        self.assertEqual(self.available(stock), 0)
+
+    def test_last_copy(self):
+        loan = checkout(self.member, self.stock[0])
+        self.assertEqual(self.available(self.stock[0]), 0)
+        self.assertTrue(LateFees.objects.filter(user_borrowed=loan).exists())
+
+    def test_no_copy_left(self):
+        checkout(make_member('first-in-line'), self.stock[0])
+        with self.assertRaises(ValidationError):
+            checkout(self.member, self.stock[0])
+        self.assertEqual(self.available(self.stock[0]), 0)
+        self.assertFalse(UserBorrowed.objects.filter(user=self.member).exists())
+
+    def test_over_max_loans(self):
+        for stock in self.stock[:UserBorrowed.MAX_LOANS]:
+            checkout(self.member, stock)
+        extra = self.stock[UserBorrowed.MAX_LOANS]
+        with self.assertRaises(ValidationError):
+            checkout(self.member, extra)
+        # The failed checkout left no trace: the copy is back and no loan or fee was kept
+        self.assertEqual(self.available(extra), 1)
+        self.assertEqual(UserBorrowed.objects.filter(user=self.member).count(), UserBorrowed.MAX_LOANS)
+        self.assertEqual(LateFees.objects.filter(user_borrowed__user=self.member).count(), UserBorrowed.MAX_LOANS)
+
+    def admin_add(self, stock):
+        self.client.force_login(User.objects.create_superuser('circulation-desk', password='test-pass-123'))
+        return self.client.post(reverse('admin:libraryweb_userborrowed_add'), {'user': self.member.pk, 'book': stock.pk})
+
+    def test_admin_checkout(self):
+        response = self.admin_add(self.stock[0])
+        self.assertRedirects(response, reverse('admin:libraryweb_userborrowed_changelist'))
+        self.assertEqual(self.available(self.stock[0]), 0)
+        self.assertTrue(LateFees.objects.filter(user_borrowed__user=self.member).exists())
+
+    def test_admin_checkout_without_a_copy_is_a_form_error(self):
+        checkout(make_member('first-in-line'), self.stock[0])
+        response = self.admin_add(self.stock[0])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['adminform'].form.non_field_errors(), ["Book is not available for borrowing."])
+        self.assertFalse(UserBorrowed.objects.filter(user=self.member).exists())
+
+    def test_admin_checkout_losing_a_race_saves_nothing(self):
+        # The last copy goes between validating the form and saving
+        with mock.patch('libraryweb.admin.checkout', side_effect=ValidationError("Book is not available for borrowing.")):
+            response = self.admin_add(self.stock[0])
+        self.assertRedirects(response, reverse('admin:libraryweb_userborrowed_add'))
+        messages = [str(message) for message in response.wsgi_request._messages]
+        self.assertEqual(messages, ["Book is not available for borrowing."])
+        self.assertFalse(UserBorrowed.objects.exists())
+        self.assertFalse(LogEntry.objects.exists())
+
+
+class RatingTotalsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.readers = [make_member(f'rater{n}') for n in range(3)]
+        cls.book = BookMain.objects.create(isbn='9780000000501', title='Beloved', author='Toni Morrison', genre='Fiction')
+        cls.other = BookMain.objects.create(isbn='9780000000502', title='Jazz', author='Toni Morrison', genre='Fiction')
+
+    def assertTotals(self, book, rating_sum, rating_count):
+        book = BookMain.objects.get(pk=book.pk)
+        self.assertEqual((book.rating_sum, book.rating_count), (rating_sum, rating_count))
+        self.assertEqual(book.avg_rating, rating_sum / rating_count if rating_count else 0)
+
+    def test_create_update_and_delete(self):
+        ratings = [
+            Rating.objects.create(user=reader, book=self.book, rating=score)
+            for reader, score in zip(self.readers, (5, 4, 2))
+        ]
+        self.assertTotals(self.book, 11, 3)
+
+        ratings[2].rating = 3
+        ratings[2].save()
+        self.assertTotals(self.book, 12, 3)
+
+        ratings[2].review = 'Changed my mind about the ending'
+        ratings[2].save()
+        self.assertTotals(self.book, 12, 3)
+
+        ratings[1].book = self.other
+        ratings[1].save()
+        self.assertTotals(self.book, 8, 2)
+        self.assertTotals(self.other, 4, 1)
+
+        ratings[0].delete()
+        self.assertTotals(self.book, 3, 1)
+        ratings[2].delete()
+        self.assertTotals(self.book, 0, 0)
+
+    def test_rebuild_repairs_drift(self):
+        for reader, score in zip(self.readers, (5, 4, 3)):
+            Rating.objects.create(user=reader, book=self.book, rating=score)
+        # Totals written behind the signals' back, e.g. by a raw import
+        BookMain.objects.filter(pk=self.book.pk).update(rating_sum=40, rating_count=9, avg_rating=4.4)
+        BookMain.objects.filter(pk=self.other.pk).update(rating_sum=7, rating_count=2, avg_rating=3.5)
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rating_totals', verify=True, stdout=StringIO())
+        call_command('rebuild_rating_totals', stdout=StringIO())
+        self.assertTotals(self.book, 12, 3)
+        self.assertTotals(self.other, 0, 0)
+        call_command('rebuild_rating_totals', verify=True, stdout=StringIO())
+
+
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = {
+            name: BookMain.objects.create(isbn=f'97800000004{n:02d}', title=name, author='Author', genre=genre)
+            for n, (name, genre) in enumerate([
+                ('a1', 'Fiction'), ('a2', 'Fiction'), ('a3', 'Fiction'), ('a4', 'Poetry'), ('b1', 'History'), ('b2', 'History'),
+            ])
+        }
+        cls.members = [make_member(f'reader{n}') for n in range(4)]
+        # Two groups of readers with no book in common
+        for member, names in zip(cls.members, [['a1', 'a2'], ['a1', 'a2', 'a3'], ['a2', 'a3'], ['b1', 'b2']]):
+            for days, name in enumerate(reversed(names)):
+                cls.borrow(member, name, days)
+        Rating.objects.create(user=cls.members[2], book=cls.books['a4'], rating=5)
+
+    @classmethod
+    def borrow(cls, member, name, days_ago=0):
+        borrowed = now() - timedelta(days=days_ago + 1)
+        UserHistory.objects.create(user=member, book=cls.books[name], borrow_date=borrowed, return_date=borrowed + timedelta(days=1))
+
+    def neighbours(self, *names):
+        return {
+            (entry.book.title, entry.neighbour.title): entry.score
+            for entry in BookNeighbour.objects.filter(book__title__in=names).select_related('book', 'neighbour')
+        }
+
+    def refresh(self, **kwargs):
+        loaded = []
+        load = InteractionMatrix.load
+
+        def record(*args, **kwargs):
+            loaded.append(load(*args, **kwargs))
+            return loaded[-1]
+
+        with mock.patch.object(InteractionMatrix, 'load', side_effect=record):
+            return refresh_neighbours(**kwargs), loaded
+
+    def test_full_refresh(self):
+        run, _ = self.refresh(full=True)
+        self.assertEqual((run.full, run.books_refreshed), (True, 6))
+        self.assertEqual([book.title for book in neighbours_of(self.books['a1'])], ['a2', 'a3'])
+        self.assertEqual([book.title for book in neighbours_of(self.books['b1'])], ['b2'])
+        # Same genre as well as the same readers
+        self.assertGreater(self.neighbours('a3')[('a3', 'a2')], self.neighbours('a3')[('a3', 'a4')])
+
+    def test_incremental_refresh_loads_only_the_compared_books(self):
+        self.refresh(full=True)
+        b_rows = self.neighbours('b1', 'b2')
+        self.borrow(self.members[0], 'a3')
+        run, [matrix] = self.refresh()
+        self.assertEqual((run.full, run.books_refreshed), (False, 3))
+        # The new borrower's books, compared with every book of their readers
+        self.assertEqual(
+            sorted(matrix.book_ids.tolist()),
+            sorted(self.books[name].pk for name in ['a1', 'a2', 'a3', 'a4']),
+        )
+        self.assertEqual(self.neighbours('b1', 'b2'), b_rows)
+
+        incremental = self.neighbours('a1', 'a2', 'a3')
+        self.refresh(full=True)
+        full = self.neighbours('a1', 'a2', 'a3')
+        self.assertEqual(incremental.keys(), full.keys())
+        for pair, score in full.items():
+            self.assertAlmostEqual(incremental[pair], score, msg=pair)
+
+    def test_incremental_refresh_without_new_activity(self):
+        self.refresh(full=True)
+        rows = self.neighbours('a1', 'a2', 'a3', 'a4', 'b1', 'b2')
+        run, loaded = self.refresh()
+        self.assertEqual((run.full, run.books_refreshed, loaded), (False, 0, []))
+        self.assertEqual(self.neighbours('a1', 'a2', 'a3', 'a4', 'b1', 'b2'), rows)
+
+    def test_because_you_borrowed(self):
+        refresh_neighbours(full=True)
+        member = self.members[0]
+        with self.assertNumQueries(2):
+            groups = because_you_borrowed(member)
+        # Most recent borrow first, nothing already read and no book twice
+        self.assertEqual([(seed.title, [book.title for book in books]) for seed, books in groups], [('a2', ['a3', 'a4'])])
+
+        # A strong enough favourite genre outranks a closer neighbour
+        member.fav_genre = 'Drama, poetry'
+        with override_settings(LIBRARY_RECOMMENDATION_GENRE_WEIGHT=1):
+            groups = because_you_borrowed(member)
+        self.assertEqual([(seed.title, [book.title for book in books]) for seed, books in groups], [('a2', ['a4', 'a3'])])
+        self.assertEqual(because_you_borrowed(self.members[3]), [])
+        self.assertEqual(because_you_borrowed(make_member('newcomer')), [])
+
+
+@override_settings(LIBRARY_LEADERBOARD_SIZE=2)
+class LeaderboardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alpha, cls.beta, cls.gamma = [
+            BookMain.objects.create(isbn=f'978000000060{n}', title=title, author='C. Writer', genre='Fiction')
+            for n, title in enumerate(('Alpha', 'Beta', 'Gamma'))
+        ]
+        cls.stock = {book.pk: AvailBooks.objects.create(book=book, total_books=2, available_books=2) for book in (cls.alpha, cls.beta, cls.gamma)}
+        # Ratings written behind the signals' back, so nothing refreshes the board yet
+        for book, avg_rating in ((cls.alpha, 5), (cls.beta, 4), (cls.gamma, 3)):
+            BookMain.objects.filter(pk=book.pk).update(avg_rating=avg_rating)
+
+    def board(self):
+        return list(PopularBook.objects.order_by('position').values_list('book_id', flat=True))
+
+    def test_empty_board_is_read_not_built(self):
+        with self.assertNumQueries(2):
+            books = popular_books()
+        self.assertEqual(books, [self.alpha, self.beta])
+        self.assertFalse(PopularBook.objects.exists())
+
+    def test_stale_board_is_served_until_refreshed(self):
+        refresh_leaderboard()
+        BookMain.objects.filter(pk=self.gamma.pk).update(avg_rating=5)
+        with self.assertNumQueries(1):
+            self.assertEqual(popular_books(), [self.alpha, self.beta])
+
+        call_command('refresh_leaderboard', stdout=StringIO())
+        self.assertEqual(self.board(), [self.alpha.pk, self.gamma.pk])
+
+    def test_refresh_only_when_affected(self):
+        refresh_leaderboard()
+        with self.assertNumQueries(2):
+            self.assertFalse(refresh_if_affected([self.gamma.pk]))
+
+        BookMain.objects.filter(pk=self.gamma.pk).update(avg_rating=4.5)
+        self.assertTrue(refresh_if_affected([self.gamma.pk]))
+        self.assertEqual(self.board(), [self.alpha.pk, self.gamma.pk])
+        # A listed book always refreshes the board
+        self.assertTrue(refresh_if_affected([self.alpha.pk]))
+
+    def test_ratings_and_stock_refresh_after_commit(self):
+        refresh_leaderboard()
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(2):
+                Rating.objects.create(user=make_member(f'fan{n}'), book=self.gamma, rating=4)
+        self.assertEqual(self.board(), [self.alpha.pk, self.beta.pk])
+
+        # Gamma now ties Beta on rating and has copies out: total minus available
+        stock = self.stock[self.gamma.pk]
+        stock.total_books, stock.available_books = 3, 1
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.save()
+        self.assertEqual(self.board(), [self.alpha.pk, self.gamma.pk])
+        self.assertEqual(popular_books()[1].borrowed_count, 2)
+
+
+@override_settings(LIBRARY_PERF_INSTRUMENTATION=True, LIBRARY_PERF_SLOW_MS=60_000)
+class PerformanceMiddlewareTests(TestCase):
+    SERVER_TIMING_RE = re.compile(
+        r'^sql;dur=\d+\.\d;desc="(\d+) queries", tpl;dur=\d+\.\d;desc="Templates", '
+        r'view;dur=\d+\.\d;desc="View", mw;dur=\d+\.\d;desc="Middleware", total;dur=\d+\.\d;desc="Total"$'
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = make_member('profiled')
+
+    def setUp(self):
+        self.client.force_login(self.member.user)
+        library_users.clear()
+        self.url = reverse('libraryweb:credits', kwargs={'lib_num': self.member.lib_num})
+
+    def get(self):
+        with self.assertLogs('libraryweb.performance', level='INFO') as logs:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        [record] = logs.records
+        return response, record, queries
+
+    def test_server_timing_header(self):
+        response, _, queries = self.get()
+        match = self.SERVER_TIMING_RE.match(response['Server-Timing'])
+        self.assertIsNotNone(match, response['Server-Timing'])
+        self.assertEqual(int(match[1]), len(queries))
+
+    def test_log_record(self):
+        response, record, queries = self.get()
+        self.assertEqual(record.levelname, 'INFO')
+        self.assertEqual(record.performance['queries'], len(queries))
+        self.assertEqual(record.performance['view'], 'libraryweb:credits')
+        self.assertEqual(record.performance['status'], 200)
+        self.assertFalse(record.performance['slow'])
+        self.assertNotIn('slowest_queries', record.performance)
+        self.assertEqual(json.loads(record.getMessage()), record.performance)
+
+    @override_settings(LIBRARY_PERF_SLOW_MS=0, LIBRARY_PERF_EXPLAIN_QUERIES=10)
+    def test_slow_request_logs_explain_without_params(self):
+        _, record, queries = self.get()
+        self.assertEqual(record.levelname, 'WARNING')
+        self.assertTrue(record.performance['slow'])
+        slowest = record.performance['slowest_queries']
+        self.assertEqual(len(slowest), record.performance['queries'])
+        self.assertEqual([entry['ms'] for entry in slowest], sorted((entry['ms'] for entry in slowest), reverse=True))
+        selects = [entry for entry in slowest if entry['sql'].startswith('SELECT')]
+        self.assertTrue(selects)
+        for entry in selects:
+            self.assertTrue(entry['explain'])
+            self.assertNotIn('EXPLAIN failed', entry['explain'][0])
+        # The member's lib_num and the session key were bound parameters
+        self.assertTrue(any('"lib_num" = %s' in entry['sql'] for entry in slowest))
+        reported = json.dumps(slowest)
+        self.assertNotIn(self.member.lib_num, reported)
+        self.assertNotIn(self.client.session.session_key, reported)
+
+    def test_template_time_of_a_template_response(self):
+        self.url = reverse('libraryweb:home', kwargs={'lib_num': self.member.lib_num})
+        response, record, _ = self.get()
+        self.assertGreater(record.performance['template_ms'], 0)
+        self.assertNotIn('tpl;dur=0.0;', response['Server-Timing'])
+
+    def test_template_time_of_a_render_view(self):
+        # book_request_view renders with render(), not a TemplateResponse
+        self.url = reverse('libraryweb:request', kwargs={'lib_num': self.member.lib_num})
+        response, record, _ = self.get()
+        self.assertGreater(record.performance['template_ms'], 0)
+        self.assertLessEqual(record.performance['template_ms'], record.performance['view_ms'])
+        self.assertNotIn('tpl;dur=0.0;', response['Server-Timing'])
@@ -21,6 +21,7 @@ urlpatterns = [
     path('<str:lib_num>/Profile', views.ProfileView.as_view(), name='profile'),
     path('<str:lib_num>/Profile/Updated', views.UpdateProfileView.as_view(), name='update_profile'),
     path('<str:lib_num>/<str:isbn>/', views.DetailPage.as_view(), name="detail"),
+    path('<str:lib_num>/<str:isbn>/Reviews/', views.ReviewsView.as_view(), name="reviews"),
     path('<str:lib_num>/Success/<str:isbn>', views.RequestSuccessView.as_view(), name='success'),
     
 ]
@@ -1,15 +1,24 @@
 from django.shortcuts import render,redirect,get_object_or_404
 import json
-from django.db.models import Q,Avg,Count
+from datetime import timedelta
+from django.db.models import OuterRef,Subquery
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.http import Http404
 from django.views.generic import ListView,DetailView,FormView,TemplateView,View
 from django.urls import reverse
 from .forms import BookRequestForm,SignUpForm,ResetPasswordForm,SignInForm,RatingForm
 from django.http import JsonResponse
+from django.template.loader import render_to_string
+from django.conf import settings
 from django.urls import reverse_lazy
 from django.contrib.auth.forms import SetPasswordForm
 from .models import LibraryUser,BookMain,Request,Rating,UserBorrowed,UserHistory,LateFees
+from .search import search_books
+from .pagination import KeysetPaginationMixin,KeysetPaginator
+from .leaderboard import borrowed_count,popular_books
+from .recommendations import because_you_borrowed,neighbours_of
+from .members import get_library_user
+from .presence import presence,activate,deactivate
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.contrib.auth import login,logout,authenticate
@@ -81,39 +90,46 @@ def error_500(request):
     return render(request,'error500.html',{'lib_num': lib_num}, status=500)
 
 
-class BorrowedBooksView(ListView):
-    model = UserBorrowed
-    template_name = "libraryweb/main/borrowed.html"
-    context_object_name = "borrowed_books"
+def member_redirect(request, library_user):
+    """
+    Return a redirect to sign out if the member is unknown or inactive, else None.
+    """
+    if library_user is None:
+        messages.error(request, "An error occurred. Please try again later.")
+        return redirect('libraryweb:signout')
+    if not library_user.user.is_active or not library_user.is_active or presence.is_pending(library_user.user_id):
+        messages.error(request, "Your account is inactive. Please sign in again.")
+        return redirect('libraryweb:signout')
+    return None
 
-    def dispatch(self, request, *args, **kwargs):
-        """
-        Ensure the user is valid and active before proceeding.
-        """
-        # Get lib_num from the URL
-        lib_num = self.kwargs.get('lib_num')
 
-        try:
-            # Fetch the LibraryUser
-            self.library_user = get_object_or_404(LibraryUser, lib_num=lib_num)
+class LibraryMemberMixin:
+    """
+    Ensure the member named by the URL's lib_num is valid and active before
+    proceeding. The member comes from request.library_user, resolved once by
+    LibraryUserMiddleware, and is stored as self.library_user / self.user.
+    """
 
-            # Check if the user is active
-            if not self.library_user.user.is_active or not self.library_user.is_active:
-                messages.error(self.request, "Your account is inactive. Please sign in again.")
-                return redirect('libraryweb:signout')
+    def dispatch(self, request, *args, **kwargs):
+        self.library_user = getattr(request, 'library_user', None) or get_library_user(kwargs.get('lib_num'))
+        response = member_redirect(request, self.library_user)
+        if response:
+            return response
+        self.user = self.library_user.user
+        return super().dispatch(request, *args, **kwargs)
 
-        except Exception as e:
-            print(f"Error occurred: {e}")
-            messages.error(self.request, "An error occurred. Please try again later.")
-            return redirect('libraryweb:signout')
 
-        return super().dispatch(request, *args, **kwargs)
+class BorrowedBooksView(LibraryMemberMixin, ListView):
+    model = UserBorrowed
+    template_name = "libraryweb/main/borrowed.html"
+    context_object_name = "borrowed_books"
 
     def get_queryset(self):
         """
-        Filter borrowed books by the library user.
+        Filter borrowed books by the library user. The template shows each
+        loan's title, so join the stock row and book in the same query.
         """
-        return UserBorrowed.objects.filter(user=self.library_user)
+        return UserBorrowed.objects.filter(user=self.library_user).select_related('book__book')
 
     def get_context_data(self, **kwargs):
         """
@@ -124,32 +140,9 @@ class BorrowedBooksView(ListView):
         return context
 
 
-class ProfileView(TemplateView):
+class ProfileView(LibraryMemberMixin, TemplateView):
     template_name = 'libraryweb/main/profile.html'
 
-    def dispatch(self, request, *args, **kwargs):
-        # Get lib_num from the URL
-        lib_num = self.kwargs.get('lib_num', None)
-
-        try:
-            # Get the LibraryUser associated with the lib_num
-            self.library_user = get_object_or_404(LibraryUser, lib_num=lib_num)
-            self.user = self.library_user.user
-
-            # Check if the user is active
-            if not self.user.is_active or not self.library_user.is_active:
-                print("User is not active, redirecting to signout")
-                messages.error(self.request, "Your account is inactive. Please sign in again.")
-                return redirect('libraryweb:signout')
-
-        except Exception as e:
-            # Log and handle unexpected errors
-            print(f"Unexpected error: {e}")
-            messages.error(self.request, "An error occurred while loading your profile.")
-            return redirect('libraryweb:signout')
-
-        return super().dispatch(request, *args, **kwargs)
-
     def get_context_data(self, **kwargs):
         # Get the context from the parent class
         context = super().get_context_data(**kwargs)
@@ -183,44 +176,14 @@ class UpdateProfileView(View):
             return JsonResponse({'success': False})
 
 
-class HomePageView(ListView):
+class HomePageView(LibraryMemberMixin, ListView):
     model = BookMain
     context_object_name = "popular_books"
     template_name = "libraryweb/main/home.html"
-    paginate_by = 10  # Limit to top 10 books
 
     def get_queryset(self):
-        # Annotate books with average rating and borrowed count
-        return (
-            BookMain.objects.annotate(
-                avg_rating=Avg('ratings__rating'),  # Average rating
-                borrowed_count=Count('availability__borrowed_instances')  # Borrowed count
-            )
-            .order_by('-avg_rating', '-borrowed_count', 'title')[:10]  # Limit to top 10
-        )
-
-    def dispatch(self, request, *args, **kwargs):
-        # Get the library number from the URL
-        lib_num = self.kwargs.get('lib_num', None)
-
-        try:
-            self.library_user = get_object_or_404(LibraryUser, lib_num=lib_num)
-            self.user = self.library_user.user
-
-            if not self.user.is_active or not self.library_user.is_active:
-                print("User is not active, redirecting to signout")
-                messages.error(self.request, "Your account is inactive. Please sign in again.")
-                return redirect('libraryweb:signout')
-
-
-        except LibraryUser.DoesNotExist:
-            return redirect('libraryweb:signout')
-
-        except Exception as e:
-            print(f"Unexpected error: {e}")
-            return redirect('libraryweb:signout')
-
-        return super().dispatch(request, *args, **kwargs)
+        # Precomputed top books (LIBRARY_LEADERBOARD_SIZE), read in one query
+        return popular_books()
 
     def get_context_data(self, **kwargs):
         # Fetch the context from the parent class
@@ -228,45 +191,25 @@ class HomePageView(ListView):
 
         # Add the library number to the context
         context['lib_num'] = self.kwargs.get('lib_num', None)
+
+        # "Because you borrowed ..." rows from the precomputed neighbours
+        context['recommendations'] = because_you_borrowed(self.library_user)
         return context
 
 #in home page we will use for loop to take out data, later this will be done by real database
 
     
 
-class HistoryView(ListView):
+class HistoryView(LibraryMemberMixin, KeysetPaginationMixin, ListView):
     model = UserHistory
     template_name = 'libraryweb/main/history.html'  # Specify your template
     context_object_name = 'user_history'  # The name of the context variable
-    paginate_by = 10  # Number of items per page
+    paginate_by = 10  # Number of items per page, paged by cursor on borrow_date
+    count_total = True
 
     def get_queryset(self):
-        # Get the user based on their library number
-        lib_num = self.kwargs['lib_num']
-        return UserHistory.objects.filter(user__lib_num=lib_num).order_by('-borrow_date')
-
-    def dispatch(self, request, *args, **kwargs):
-        # Get the library number from the URL
-        lib_num = self.kwargs.get('lib_num', None)
-
-        try:
-            self.library_user = get_object_or_404(LibraryUser, lib_num=lib_num)
-            self.user = self.library_user.user
-
-            if not self.user.is_active or not self.library_user.is_active:
-                print("User is not active, redirecting to signout")
-                messages.error(self.request, "Your account is inactive. Please sign in again.")
-                return redirect('libraryweb:signout')
-
-
-        except LibraryUser.DoesNotExist:
-            return redirect('libraryweb:signout')
-
-        except Exception as e:
-            print(f"Unexpected error: {e}")
-            return redirect('libraryweb:signout')
-
-        return super().dispatch(request, *args, **kwargs)
+        # History of the member resolved in dispatch
+        return UserHistory.objects.filter(user=self.library_user).select_related('book').order_by('-borrow_date')
 
     def get_context_data(self, **kwargs):
         # Fetch the context from the parent class
@@ -278,37 +221,13 @@ class HistoryView(ListView):
 
 
 
-class SearchPageView(ListView):
+class SearchPageView(LibraryMemberMixin, KeysetPaginationMixin, ListView):
     model = BookMain
     context_object_name = "books"
-    paginate_by = 10
+    paginate_by = 10  # Paged by cursor on the search ordering
+    count_total = True
     template_name = 'libraryweb/main/search.html'
 
-    def dispatch(self, request, *args, **kwargs):
-        """
-        Ensure the user is valid and active before proceeding.
-        """
-        # Get lib_num from the URL
-        lib_num = self.kwargs.get('lib_num')
-
-        try:
-            # Fetch the LibraryUser
-            self.library_user = get_object_or_404(LibraryUser, lib_num=lib_num)
-            self.user = self.library_user.user
-
-            # Check if the user is active
-            if not self.user.is_active or not self.library_user.is_active:
-                print("User is not active, redirecting to signout")
-                messages.error(self.request, "Your account is inactive. Please sign in again.")
-                return redirect('libraryweb:signout')
-
-        except Exception as e:
-            print(f"Error occurred: {e}")
-            messages.error(self.request, "An error occurred. Please try again later.")
-            return redirect('libraryweb:signout')
-
-        return super().dispatch(request, *args, **kwargs)
-
     def get_queryset(self):
         """
         Filter books based on the search query.
@@ -316,23 +235,12 @@ class SearchPageView(ListView):
         # Get the search query from the request
         query = self.request.GET.get("query", "")
 
-        # Annotate with average rating and borrowed count
-        queryset = BookMain.objects.annotate(
-            avg_rating=Avg('ratings__rating'),  # Average rating of the book
-            borrowed_count=Count('availability__borrowed_instances')  # Borrowed count
-        )
+        # Annotate with borrowed count, avg_rating is already stored on the book
+        queryset = BookMain.objects.annotate(borrowed_count=borrowed_count())
 
-        # Apply search filters if query exists
-        if query:
-            queryset = queryset.filter(
-                Q(title__icontains=query) |
-                Q(author__icontains=query) |
-                Q(genre__icontains=query) |
-                Q(isbn__icontains=query)
-            )
-        
-        # Order by avg_rating (descending), borrowed_count (descending), and title (ascending)
-        return queryset.order_by('-avg_rating', '-borrowed_count', 'title')
+        # Full-text match ranked by relevance, rating and borrow count
+        # (falls back to icontains filters when FTS5 is unavailable)
+        return search_books(queryset, query)
 
     def get_context_data(self, **kwargs):
         """
@@ -349,41 +257,51 @@ class SearchPageView(ListView):
     
 
 
-class DetailPage(DetailView):
+def reviews_page(book, cursor=None):
+    """
+    One page of a book's reviews, newest first, with the reviewer's username
+    joined in. Paged by cursor so "load more" never re-reads earlier pages.
+    """
+    reviews = (
+        Rating.objects.filter(book=book)
+        .select_related('user__user')
+        .only('rating', 'review', 'created_at', 'user__lib_num', 'user__user__username')
+        .order_by('-created_at', '-id')
+    )
+    per_page = getattr(settings, 'LIBRARY_REVIEWS_PER_PAGE', 10)
+    return KeysetPaginator(reviews, per_page).page(cursor)
+
+
+class DetailPage(LibraryMemberMixin, DetailView):
     model = BookMain
     context_object_name = "bookdetail"
     template_name = "libraryweb/main/detail.html"
 
-    def dispatch(self, request, *args, **kwargs):
-        """
-        Ensure the user is valid and active before proceeding.
-        """
-        lib_num = self.kwargs.get('lib_num')
-        try:
-            # Fetch the LibraryUser
-            self.library_user = get_object_or_404(LibraryUser, lib_num=lib_num)
-
-            # Check if the user is active
-            if not self.library_user.user.is_active or not self.library_user.is_active:
-                messages.error(self.request, "Your account is inactive. Please sign in again.")
-                return redirect('libraryweb:signout')
-
-        except Exception as e:
-            print(f"Error occurred: {e}")
-            messages.error(self.request, "An error occurred. Please try again later.")
-            return redirect('libraryweb:signout')
-
-        return super().dispatch(request, *args, **kwargs)
-
     def get_object(self):
         """
-        Get the book object based on ISBN.
+        Get the book, its availability, the earliest due date and the member's
+        own rating in a single query.
         """
         isbn = self.kwargs.get("isbn")
+        loans = UserBorrowed.objects.filter(book__book=OuterRef('pk')).order_by('borrow_date')
+        own_rating = Rating.objects.filter(book=OuterRef('pk'), user=self.library_user)
         try:
-            book = BookMain.objects.get(isbn=isbn)
+            book = (
+                BookMain.objects.select_related('availability')
+                .annotate(
+                    earliest_borrow=Subquery(loans.values('borrow_date')[:1]),
+                    own_rating=Subquery(own_rating.values('rating')[:1]),
+                    own_review=Subquery(own_rating.values('review')[:1]),
+                )
+                .get(isbn=isbn)
+            )
         except BookMain.DoesNotExist:
             raise Http404("Book Not Found")
+
+        # Same value as AvailBooks.earliest_return(), without its extra query
+        book.earliest_return = None
+        if book.earliest_borrow:
+            book.earliest_return = book.earliest_borrow + timedelta(days=LateFees.LOAN_DAYS)
         return book
 
     def post(self, request, *args, **kwargs):
@@ -391,7 +309,7 @@ class DetailPage(DetailView):
         Handle the POST request to submit a rating form.
         """
         # Get the current book
-        book = self.get_object()
+        self.object = book = self.get_object()
 
         # Create the form instance with the POST data
         form = RatingForm(request.POST)
@@ -408,7 +326,7 @@ class DetailPage(DetailView):
             return redirect('libraryweb:detail', lib_num=self.library_user.lib_num, isbn=book.isbn)
 
         # If the form is not valid, re-render the page with form errors
-        return self.get(request, *args, **kwargs)
+        return self.render_to_response(self.get_context_data(rating_form=form))
 
     def get_context_data(self, **kwargs):
         """
@@ -419,12 +337,31 @@ class DetailPage(DetailView):
         # Add lib_num to the context
         context['lib_num'] = self.kwargs.get('lib_num')
 
-        # Add rating form and reviews
-        context['rating_form'] = RatingForm()
-        context['existing_rating'] = Rating.objects.filter(user=self.library_user, book=self.object).first()
-        context['all_ratings'] = Rating.objects.filter(book=self.object).select_related('user')
+        # Add rating form, the member's own rating and the first page of reviews
+        context.setdefault('rating_form', RatingForm())
+        if self.object.own_rating is not None:
+            context['existing_rating'] = {'rating': self.object.own_rating, 'review': self.object.own_review}
+        context['reviews'] = reviews_page(self.object)
+        context['also_borrowed'] = neighbours_of(self.object)
 
         return context
+
+
+class ReviewsView(LibraryMemberMixin, View):
+    """
+    Next page of a book's reviews for the detail page's "load more" button:
+    the rendered review cards plus the cursor for the page after.
+    """
+
+    def get(self, request, *args, **kwargs):
+        book = BookMain.objects.filter(isbn=kwargs.get('isbn')).only('pk').first()
+        if book is None:
+            raise Http404("Book Not Found")
+        page = reviews_page(book, request.GET.get('cursor'))
+        return JsonResponse({
+            'html': render_to_string('libraryweb/partials/reviews.html', {'reviews': page}, request=request),
+            'next': page.next_token,
+        })
     
 
 class RequestSuccessView(TemplateView):
@@ -470,25 +407,17 @@ class RequestSuccessView(TemplateView):
         return context
 
 def book_request_view(request, lib_num):
-    # Fetch the LibraryUser and check if the user is active
-    try:
-        # Fetch the LibraryUser instance using lib_num
-        library_user = get_object_or_404(LibraryUser, lib_num=lib_num)
-        user = library_user.user  # Assuming LibraryUser has a related User object
-
-        # Check if the user and library user are both active
-        if not user.is_active or not library_user.is_active:
-            print("User is not active, redirecting to signout")
-            messages.error(request, "Your account is inactive. Please sign in again.")
-            return redirect('libraryweb:signout')
-
-    except LibraryUser.DoesNotExist:
-        # Handle case where LibraryUser is not found (you can redirect or show an error)
-        messages.error(request, "User not found.")
-        return redirect('libraryweb:signout')
+    # The LibraryUser was resolved by LibraryUserMiddleware, check it is active
+    library_user = getattr(request, 'library_user', None) or get_library_user(lib_num)
+    if library_user is None:
+        raise Http404("User not found.")
+    response = member_redirect(request, library_user)
+    if response:
+        return response
 
     # Continue with the book request form processing
-    request.session['lib_num'] = lib_num
+    if request.session.get('lib_num') != lib_num:
+        request.session['lib_num'] = lib_num
     if request.method == 'POST':
         form = BookRequestForm(request.POST)
 
@@ -523,29 +452,9 @@ def book_request_view(request, lib_num):
 
 
 
-class CreditsView(TemplateView):
+class CreditsView(LibraryMemberMixin, TemplateView):
     template_name = "libraryweb/main/credits.html"
 
-    def dispatch(self, request, *args, **kwargs):
-        # Fetch lib_num from URL kwargs
-        lib_num = kwargs.get('lib_num')
-
-        try:
-            # Fetch the LibraryUser
-            self.library_user = get_object_or_404(LibraryUser, lib_num=lib_num)
-
-            # Check if the user is active
-            if not self.library_user.user.is_active or not self.library_user.is_active:
-                messages.error(request, "Your account is inactive. Please sign in again.")
-                return redirect('libraryweb:signout')
-
-        except Exception as e:
-            print(f"Error occurred: {e}")
-            messages.error(request, "An error occurred. Please try again later.")
-            return redirect('libraryweb:signout')
-
-        return super().dispatch(request, *args, **kwargs)
-
 class SignInView(FormView):
     template_name = 'libraryweb/auth/signin.html'
     form_class = SignInForm
@@ -562,11 +471,10 @@ class SignInView(FormView):
         if user and hasattr(user, 'library_profile'):
             # If the user is authenticated, log them in
             if not user.is_active or not user.library_profile.is_active:
-                user.is_active = True
-                user.library_profile.is_active = True
-                user.save()
-                user.library_profile.save()
+                activate(user)
                 self.request.session['lib_num'] = user.library_profile.lib_num
+            else:
+                presence.discard(user.pk)  # Cancel a sign out that has not been flushed yet
 
             login(self.request, user)
             return redirect('libraryweb:home', lib_num=user.library_profile.lib_num)
@@ -631,11 +539,7 @@ def sign_out(request):
     # Check if the user is authenticated
     if request.user.is_authenticated:
         # Set the user's 'is_active' status to False
-        user = request.user
-        user.is_active = False
-        user.library_profile.is_active = False
-        user.library_profile.save()
-        user.save()
+        deactivate(request.user)
         # Clear the user's session data
         request.session.flush()
         # Log the user out
@@ -644,39 +548,21 @@ def sign_out(request):
     # Redirect to the sign-in page after logging out
     return redirect('libraryweb:signin')
 
-class LateFeesListView(ListView):
+class LateFeesListView(LibraryMemberMixin, ListView):
     model = LateFees
     template_name = 'libraryweb/main/late.html'
     context_object_name = 'late_fees'
 
-    def dispatch(self, request, *args, **kwargs):
-        """
-        Ensure the user is valid and active before proceeding.
-        """
-        lib_num = self.kwargs['lib_num']
-        try:
-            # Fetch the LibraryUser based on the lib_num
-            self.library_user = get_object_or_404(LibraryUser, lib_num=lib_num)
-
-            # Check if the user is active
-            if not self.library_user.user.is_active or not self.library_user.is_active:
-                messages.error(self.request, "Your account is inactive. Please sign in again.")
-                return redirect('libraryweb:signout')
-
-        except Exception as e:
-            print(f"Error occurred: {e}")
-            messages.error(self.request, "An error occurred. Please try again later.")
-            return redirect('libraryweb:signout')
-
-        return super().dispatch(request, *args, **kwargs)
-
     def get_queryset(self):
         """
         Filter LateFees based on the user's library number (lib_num).
         """
-        lib_num = self.kwargs['lib_num']
         # Filtering LateFees based on the related UserBorrowed and LibraryUser models
-        return LateFees.objects.filter(user_borrowed__user__lib_num=lib_num).order_by('fee')
+        return (
+            LateFees.objects.filter(user_borrowed__user=self.library_user)
+            .select_related('user_borrowed__book__book')
+            .order_by('fee')
+        )
 
     def get_context_data(self, **kwargs):
         """